@@ -0,0 +1,356 @@
+'''
+Benchmarks and parity checks for the faster code paths. Run it from the NSC folder, e.g.
+    python bench.py ssw --hospital=1 --seed=42
+Every check exits with an AssertionError when a fast path does not match its reference.
+'''
+import os
+import time
+import argparse
+
+
+def load_middle(institution, seed):
+    from main import load_middle_data, split_middle_data
+    df, auc_global, auc_local = load_middle_data(institution)
+    x_train, y_train, x_test, y_test = split_middle_data(df, seed)
+    return x_train, y_train, x_test, y_test, auc_global, auc_local
+
+
+def timed(fn, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+
+def bench_ssw(args):
+    from main import SeeSawingWeights
+
+    x_train, y_train, _, _, auc_global, auc_local = load_middle(args.hospital, args.seed)
+
+    models, times = {}, {}
+    for engine in args.engines:
+        models[engine] = SeeSawingWeights(epoch=args.epochs, auc_global=auc_global, auc_local=auc_local, engine=engine)
+        _, times[engine] = timed(models[engine].train_weights, x_train, y_train)
+        print(f"{engine:>6} | {times[engine]:8.3f} s | ser={models[engine].ser_weight!r} loc={models[engine].loc_weight!r}")
+
+    # The sequential engines have to reproduce the reference loop bit for bit
+    reference = models.get('loop')
+    if reference is not None:
+        for engine, model in models.items():
+            if engine in ('loop', 'batch'):
+                continue
+            assert model.ser_weight == reference.ser_weight, f"{engine}: ser_weight differs from the loop"
+            assert model.loc_weight == reference.loc_weight, f"{engine}: loc_weight differs from the loop"
+            assert list(model.loss) == list(reference.loss), f"{engine}: per-epoch loss differs from the loop"
+            print(f"{engine}: identical to the loop, {times['loop']/times[engine]:.1f}x faster")
+
+
+def bench_ssw_predict(args):
+    import numpy as np
+    from main import SeeSawingWeights
+
+    x_train, y_train, x_test, _, auc_global, auc_local = load_middle(args.hospital, args.seed)
+
+    model = SeeSawingWeights(epoch=args.epochs, auc_global=auc_global, auc_local=auc_local)
+    model.train_weights(x_train, y_train)
+
+    # Row by row reference, the way predict_proba used to score
+    def rows(X):
+        return np.array([model.ser_weight*row.iloc[0] + model.loc_weight*row.iloc[2] for _, row in X.iterrows()])
+
+    reference, t_rows = timed(rows, x_test)
+    batched, t_batch = timed(model.predict_proba, x_test)
+    streamed, t_stream = timed(lambda: np.concatenate(list(model.predict_proba_stream(f'middle_{args.hospital}.csv', args.chunksize))))
+
+    print(f"rows   | {t_rows:8.4f} s")
+    print(f"batch  | {t_batch:8.4f} s | {t_rows/t_batch:.0f}x faster")
+    print(f"stream | {t_stream:8.4f} s | whole middle_{args.hospital}.csv, {len(streamed)} rows")
+
+    assert batched.shape == (len(x_test),)
+    assert np.allclose(batched, reference, rtol=0, atol=1e-15), "batched SSW probabilities differ from the row loop"
+    assert np.allclose(streamed[:, 0] + streamed[:, 1], model.ser_weight + model.loc_weight, atol=1e-6)
+    print("batched SSW probabilities match the row loop")
+
+
+def bench_shap(args):
+    import numpy as np
+    import shap
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Dense, Dropout, BatchNormalization
+    from tensorflow.keras.utils import to_categorical
+    import datacache
+    import explainers
+
+    # Same network as the localized model of train.py, trained briefly on the cached split
+    split = datacache.load_split(args.hospital, args.seed)
+    x_train = split.x_train_local.astype(float)
+    model = Sequential()
+    model.add(Dense(12, activation='relu', input_shape=(x_train.shape[1],)))
+    model.add(BatchNormalization())
+    model.add(Dense(6, activation='relu'))
+    model.add(BatchNormalization())
+    model.add(Dropout(0.2))
+    model.add(Dense(2, activation='softmax'))
+    model.compile(optimizer='adam', loss='categorical_crossentropy')
+    model.fit(x_train, to_categorical(split.y_train, num_classes=2), epochs=args.epochs, verbose=0)
+
+    # The same background and samples as featureInterpreter
+    background = shap.sample(x_train, 100, random_state=args.seed)
+    samples = x_train.iloc[299:299 + args.samples, :]
+
+    values, times = {}, {}
+    for backend in args.backends:
+        np.random.seed(args.seed)
+        values[backend], times[backend] = timed(explainers.shap_values, model, background, samples, backend)
+        print(f"{backend:>11} | {times[backend]:8.2f} s")
+
+    reference = values.get('kernel')
+    if reference is None:
+        return
+    importance = np.abs(reference[1]).mean(axis=0)
+    for backend, result in values.items():
+        if backend == 'kernel':
+            continue
+        diff = np.max(np.abs(result[1] - reference[1]))
+        corr = np.corrcoef(importance, np.abs(result[1]).mean(axis=0))[0, 1]
+        print(f"{backend:>11} | {times['kernel']/times[backend]:6.1f}x faster | max |diff| {diff:.2e} | mean |SHAP| corr {corr:.4f}")
+        if backend == 'kernel-fast':
+            # Same estimator and the same coalitions, only the model call changes
+            assert np.allclose(result[1], reference[1], atol=1e-5), "kernel-fast SHAP values differ from kernel"
+
+
+def bench_nn(args):
+    import numpy as np
+    from sklearn.metrics import roc_auc_score
+    import models
+    import utils
+
+    if args.spec == 'dpn':
+        x_train, y_train, x_test, y_test, _, _ = load_middle(args.hospital, args.seed)
+    else:
+        import datacache
+        split = datacache.load_split(args.hospital, args.seed)
+        x_train, y_train, x_test, y_test = split.x_train_local, split.y_train, split.x_test_local, split.y_test
+    x_train, x_test = np.asarray(x_train, dtype=np.float32), np.asarray(x_test, dtype=np.float32)
+    y_one_hot = np.eye(2, dtype=np.float32)[np.asarray(y_train, dtype=int)]
+    class_weights = utils.get_class_balanced_weights(y_train, (len(x_train)-1)/len(x_train))
+
+    aurocs, times = {}, {}
+    for backend in args.backends:
+        if backend == 'keras':
+            import tensorflow as tf
+            tf.random.set_seed(args.seed)
+        model = models.build_model(args.spec, x_train.shape[1], learning_rate=0.003, backend=backend, **({'seed': args.seed} if backend == 'numpy' else {}))
+        lr_scheduler = models.reduce_lr_on_plateau(model, monitor='loss', factor=0.5, patience=5, min_lr=0.000005)
+        _, times[backend] = timed(model.fit, x_train, y_one_hot, epochs=args.epochs, class_weight=class_weights, callbacks=[lr_scheduler], verbose=0)
+        aurocs[backend] = roc_auc_score(y_test, np.asarray(model.predict(x_test))[:, 1])
+        print(f"{backend:>6} | {times[backend]:8.2f} s | test AUROC {aurocs[backend]:.4f}")
+
+    if 'keras' in aurocs and 'numpy' in aurocs:
+        print(f"numpy: {times['keras']/times['numpy']:.1f}x faster, AUROC difference {aurocs['numpy'] - aurocs['keras']:+.4f}")
+        # Different random initialisation and batch order, so only the quality has to match
+        assert abs(aurocs['numpy'] - aurocs['keras']) <= args.tolerance, "NumPy trainer AUROC is off the Keras one"
+
+
+def bench_throughput(args):
+    import numpy as np
+    from sklearn.metrics import roc_auc_score
+    import models
+    import pipeline
+    import utils
+
+    pipeline.configure(args)
+    if args.spec == 'dpn':
+        x_train, y_train, x_test, y_test, _, _ = load_middle(args.hospital, args.seed)
+    else:
+        import datacache
+        split = datacache.load_split(args.hospital, args.seed)
+        x_train, y_train, x_test, y_test = split.x_train_local, split.y_train, split.x_test_local, split.y_test
+    class_weights = utils.get_class_balanced_weights(y_train, (len(x_train)-1)/len(x_train))
+
+    # Samples/sec and test AUROC per batch size, to pick --batch-size and the thread counts for a node
+    for batch_size in args.batch_sizes:
+        model = models.build_model(args.spec, x_train.shape[1], learning_rate=0.003, backend=args.backend)
+        lr_scheduler = models.reduce_lr_on_plateau(model, monitor='loss', factor=0.5, patience=5, min_lr=0.000005)
+        history, seconds = timed(pipeline.fit, model, x_train, utils.one_hot(y_train), args.epochs, class_weights,
+                                 [lr_scheduler], name=f'batch {batch_size}', batch_size=batch_size)
+        auroc = roc_auc_score(y_test, np.asarray(model.predict(pipeline.as_float32(x_test)))[:, 1])
+        print(f"batch {batch_size:>5} | {seconds:8.2f} s | {np.median(history.history['samples_per_sec']):>12,.0f} samples/s | test AUROC {auroc:.4f}")
+
+
+def bench_metrics(args):
+    import numpy as np
+    from sklearn.metrics import roc_auc_score, roc_curve, precision_recall_curve, auc
+    from main import SeeSawingWeights
+    import metrics
+
+    x_train, y_train, x_test, y_test, auc_global, auc_local = load_middle(args.hospital, args.seed)
+    model = SeeSawingWeights(epoch=args.epochs, auc_global=auc_global, auc_local=auc_local)
+    model.train_weights(x_train, y_train)
+    proba = model.predict_proba(x_test)
+
+    def reference():
+        fpr, tpr, thresholds = roc_curve(y_test, proba)
+        precision, recall, _ = precision_recall_curve(y_test, proba)
+        return roc_auc_score(y_test, proba), auc(recall, precision), thresholds[np.argmax(tpr - fpr)]
+
+    (auroc, auprc, threshold), t_sklearn = timed(reference)
+    scores, t_engine = timed(lambda: metrics.Scores(y_test, proba).summary())
+    print(f"sklearn | {t_sklearn:8.4f} s | AUROC {auroc:.6f} AUPRC {auprc:.6f} threshold {threshold:.6f}")
+    print(f"metrics | {t_engine:8.4f} s | AUROC {scores['auroc']:.6f} AUPRC {scores['auprc']:.6f} threshold {scores['threshold']:.6f}")
+    assert abs(scores['auroc'] - auroc) < 1e-12, "AUROC differs from roc_auc_score"
+    assert abs(scores['auprc'] - auprc) < 1e-12, "AUPRC differs from auc(precision_recall_curve)"
+    assert scores['threshold'] == threshold, "Youden threshold differs from roc_curve"
+
+    # Bootstrap: vectorized resampling against refitting the sklearn metrics per resample
+    y, p = np.asarray(y_test), np.asarray(proba)
+    rng = np.random.default_rng(args.seed)
+    def refit():
+        return [roc_auc_score(y[i], p[i]) for i in rng.integers(0, len(y), size=(args.reference_boot, len(y)))]
+    _, t_refit = timed(refit)
+    ci, t_boot = timed(metrics.bootstrap, y, p, n_boot=args.n_boot, seed=args.seed)
+    print(f"bootstrap | {t_boot:8.3f} s for {args.n_boot} resamples | AUROC 95% CI {ci['auroc'][0]:.4f}-{ci['auroc'][1]:.4f} "
+          f"| AUPRC 95% CI {ci['auprc'][0]:.4f}-{ci['auprc'][1]:.4f}")
+    print(f"refit     | {t_refit:8.3f} s for {args.reference_boot} resamples, "
+          f"{(t_refit/args.reference_boot)/(t_boot/args.n_boot):.0f}x slower per resample")
+
+
+def bench_stage(args):
+    import numpy as np
+    import pandas as pd
+    import stage
+    import utils
+
+    # Parse of the middle/init CSVs against the memory mapped stage arrays and a shared memory attach
+    def csv_load():
+        df = pd.read_csv(utils.stage_path(args.stage_dir, 'middle', args.hospital))
+        return df, pd.read_csv(utils.stage_path(args.stage_dir, 'init', args.hospital))
+
+    (df, _), t_csv = timed(csv_load)
+    handoff, t_npy = timed(stage.load, args.stage_dir, args.hospital)
+    frame, t_frame = timed(handoff.frame)
+    block, descriptor = stage.to_shared_memory(handoff)
+    try:
+        (reader, shared), t_shm = timed(stage.from_shared_memory, descriptor)
+        assert np.array_equal(shared.probs, handoff.probs) and np.array_equal(shared.index, handoff.index)
+        del shared
+        reader.close()
+    finally:
+        block.close()
+        block.unlink()
+
+    print(f"csv    | {t_csv:8.4f} s")
+    print(f"npy    | {t_npy:8.4f} s (mmap) + {t_frame:.4f} s frame | {t_csv/(t_npy + t_frame):.0f}x faster")
+    print(f"shm    | {t_shm:8.4f} s attach")
+    assert np.array_equal(df['Outcome'].to_numpy(), frame['Outcome'].to_numpy()), "outcomes differ from the middle CSV"
+    # The CSV holds the float32 outputs as text, only as precise as its shortest float32 repr
+    assert np.allclose(df[list(stage.COLUMNS)].to_numpy(), frame[list(stage.COLUMNS)].to_numpy(), rtol=0, atol=1e-7)
+    print("stage arrays match the middle CSV")
+
+
+HEAVY_MODULES = ('tensorflow', 'keras', 'shap', 'flwr', 'matplotlib', 'seaborn', 'sklearn', 'numba')
+
+
+def import_profile(module):
+    # Cumulative import time (seconds) of every module loaded by `import module`, from python -X importtime
+    import sys
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=here, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def bench_import_time(args):
+    failed = []
+    for module in args.modules:
+        times = import_profile(module)
+        total = times.get(module, 0.0)
+        heavy = [name for name in HEAVY_MODULES if name in times]
+        top = sorted(((t, name) for name, t in times.items() if '.' not in name and name != module), reverse=True)[:args.top]
+        print(f"{module:>12} | {total:6.3f} s | heavy: {', '.join(heavy) or '-'}")
+        for t, name in top:
+            print(f"{'':>12} |   {t:6.3f} s {name}")
+        if total > args.budget:
+            failed.append(f"{module} ({total:.3f} s)")
+    assert not failed, f"over the {args.budget} s import budget: {', '.join(failed)}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks and parity checks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ssw = subparsers.add_parser('ssw', help='SSW training engines against the original loop')
+    ssw.add_argument('--hospital', type=int, default=1, help='Hospital Data for training')
+    ssw.add_argument('--seed', type=int, default=42, help='Random seed for reproducibility')
+    ssw.add_argument('--epochs', type=int, default=30, help='SSW epochs')
+    ssw.add_argument('--engines', nargs='+', default=['loop', 'numpy', 'numba', 'batch'], help='Engines to compare')
+    ssw.set_defaults(func=bench_ssw)
+
+    ssw_predict = subparsers.add_parser('ssw-predict', help='batched/streamed SSW inference against the row loop')
+    ssw_predict.add_argument('--hospital', type=int, default=1, help='Hospital Data for training')
+    ssw_predict.add_argument('--seed', type=int, default=42, help='Random seed for reproducibility')
+    ssw_predict.add_argument('--epochs', type=int, default=30, help='SSW epochs')
+    ssw_predict.add_argument('--chunksize', type=int, default=4096, help='rows per chunk for the streaming path')
+    ssw_predict.set_defaults(func=bench_ssw_predict)
+
+    shap_parser = subparsers.add_parser('shap', help='SHAP backends of featureInterpreter against Kernel SHAP')
+    shap_parser.add_argument('--hospital', type=int, default=1, help='Hospital Data for training')
+    shap_parser.add_argument('--seed', type=int, default=42, help='Random seed for reproducibility')
+    shap_parser.add_argument('--epochs', type=int, default=5, help='Training epochs of the explained model')
+    shap_parser.add_argument('--samples', type=int, default=100, help='Rows to explain')
+    shap_parser.add_argument('--backends', nargs='+', default=['kernel', 'kernel-fast', 'gradient', 'deep'], help='Backends to compare')
+    shap_parser.set_defaults(func=bench_shap)
+
+    nn = subparsers.add_parser('nn', help='NumPy trainer against Keras, time and test AUROC')
+    nn.add_argument('--spec', default='baseline', choices=['baseline', 'centralized', 'dpn'], help='Architecture from models.py')
+    nn.add_argument('--hospital', type=int, default=1, help='Hospital Data for training')
+    nn.add_argument('--seed', type=int, default=42, help='Random seed for reproducibility')
+    nn.add_argument('--epochs', type=int, default=300, help='Training epochs')
+    nn.add_argument('--backends', nargs='+', default=['keras', 'numpy'], help='Backends to compare')
+    nn.add_argument('--tolerance', type=float, default=0.02, help='Largest accepted AUROC difference')
+    nn.set_defaults(func=bench_nn)
+
+    throughput = subparsers.add_parser('throughput', help='training samples/sec and AUROC per batch size (pipeline.py)')
+    throughput.add_argument('--spec', default='baseline', choices=['baseline', 'centralized', 'dpn'], help='Architecture from models.py')
+    throughput.add_argument('--backend', default='keras', choices=['keras', 'numpy'], help='Trainer')
+    throughput.add_argument('--hospital', type=int, default=1, help='Hospital Data for training')
+    throughput.add_argument('--seed', type=int, default=42, help='Random seed for reproducibility')
+    throughput.add_argument('--epochs', type=int, default=20, help='Training epochs per batch size')
+    throughput.add_argument('--batch-sizes', type=int, nargs='+', default=[32, 128, 512], help='Batch sizes to compare')
+    throughput.add_argument('--intra-op-threads', type=int, default=0, help='TensorFlow intra-op threads (0: default)')
+    throughput.add_argument('--inter-op-threads', type=int, default=0, help='TensorFlow inter-op threads (0: default)')
+    throughput.set_defaults(func=bench_throughput, batch_size=32)
+
+    metrics_parser = subparsers.add_parser('metrics', help='metrics.py engine against sklearn, and the bootstrap against refitting')
+    metrics_parser.add_argument('--hospital', type=int, default=1, help='Hospital Data for training')
+    metrics_parser.add_argument('--seed', type=int, default=42, help='Random seed for reproducibility')
+    metrics_parser.add_argument('--epochs', type=int, default=30, help='SSW epochs')
+    metrics_parser.add_argument('--n-boot', type=int, default=1000, help='Bootstrap resamples')
+    metrics_parser.add_argument('--reference-boot', type=int, default=100, help='Resamples refitted with sklearn for the timing')
+    metrics_parser.set_defaults(func=bench_metrics)
+
+    stage_parser = subparsers.add_parser('stage', help='middle/init CSV parse against the stage.py artifact (train.py --stage-format=both)')
+    stage_parser.add_argument('--hospital', type=int, default=1, help='Hospital Data for training')
+    stage_parser.add_argument('--stage-dir', default='.', help='Folder with both the CSV files and the stage artifact')
+    stage_parser.set_defaults(func=bench_stage)
+
+    import_time = subparsers.add_parser('import-time', help='import time of the entry points (python -X importtime)')
+    import_time.add_argument('--modules', nargs='+', default=['main', 'ssw_engine', 'datacache', 'utils'], help='Modules to import')
+    import_time.add_argument('--budget', type=float, default=1.0, help='Largest accepted import time per module, in seconds')
+    import_time.add_argument('--top', type=int, default=5, help='Heaviest top level imports to list')
+    import_time.set_defaults(func=bench_import_time)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,12 +5,14 @@ import random
 from sklearn.model_selection import train_test_split
 
 
-def onehot_encoding(df, seed):
+def onehot_encoding(df, seed, encoder):
+    # encoder: the hospital's encoder.local_encoder, same columns as get_dummies on the whole dataset
     train = pd.DataFrame()
     validation = pd.DataFrame()
     test = pd.DataFrame()
-    columns_exclude = ['Radiation', 'Chemotherapy', 'Surgery', 'Target'] 
-    df = pd.get_dummies(df, drop_first=False, columns=[col for col in df.columns if col not in columns_exclude])
+    target = df['Target']
+    df = encoder.transform_frame(df)
+    df['Target'] = target
 
     trainset, testset = train_test_split(df, test_size = 0.1, stratify=df['Target'], random_state = seed)
     train = pd.concat([train, trainset])
@@ -3,30 +3,28 @@ This code is for centralized learning in cross institution. It is used to compar
 '''
 
 import os
+import sys
 import yaml
 import numpy as np
 import pandas as pd
 import tensorflow as tf
 import matplotlib.pyplot as plt
 from keras import metrics
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense, Dropout
-from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.layers import BatchNormalization
-from tensorflow.keras.callbacks import ReduceLROnPlateau
 from tensorflow.keras.utils import to_categorical
 from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score, matthews_corrcoef, roc_auc_score, roc_curve
 import cen_utils
 import shap
 
-os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
-
-global_feature = ['Laterality', 'Age', 'Gender', 'SepNodule', 'PleuInva', 'Tumorsz', 'LYMND', 'AJCC', 'Radiation', 
-                    'Chemotherapy', 'Surgery']
+# Shared feature groups and one hot encoder of the NSC folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import encoder
+import models
+from features import global_feature, taiwan_feature, seer_feature
 
-taiwan_feature = ['PleuEffu', 'EGFR', 'ALK', 'MAGN', 'DIFF', 'BMI_label', 'CIG', 'BN', 'ALC']
+# 'keras' or 'numpy' (the NumPy trainer of NSC/numpy_nn.py)
+model_backend = 'keras'
 
-seer_feature = ['Income', 'Area', 'Race']
+os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
 
 # All columns you want for training (cen+fed)
 columns = list(global_feature)
@@ -34,35 +32,30 @@ institution = int(input("Please choose a hospital: 1 for Taiwan, 2 for US (SEER
 
 if institution == 1:
     columns.extend(taiwan_feature)
-    df = pd.read_csv('..\Data_folder\Taiwan_en.csv')
+    source = '..\Data_folder\Taiwan_en.csv'
 else: 
     columns.extend(seer_feature)
-    df = pd.read_csv('..\Data_folder\SEER_en.csv')
+    source = '..\Data_folder\SEER_en.csv'
 
 columns.append('Target')
-df = df[columns]
+df = pd.read_csv(source)[columns]
+
+# Built once (and saved) from the whole dataset instead of get_dummies for every seed
+local_encoder = encoder.local_encoder(institution, df, os.path.join('..', 'Data_folder', 'encoders'), source_hash=encoder.file_hash(source))
 
 auroc = []
 
 
 for seed in range(10, 15):
 
-      trainset, testset = cen_utils.onehot_encoding(df, seed)
+      trainset, testset = cen_utils.onehot_encoding(df, seed, local_encoder)
       x_train, y_train = trainset.drop(columns=['Target']), trainset['Target']
       x_test, y_test = testset.drop(columns=['Target']),testset['Target']
 
       # print(f"x_train (data number, feature number): {x_train.shape}")
       # print(f"x_test (data number, feature number): {x_test.shape}")
 
-      opt_adam = Adam(learning_rate = 0.003)
-      model = Sequential() 
-      model.add(Dense(12, activation = 'relu', input_shape = (x_train.shape[1],))) 
-      model.add(BatchNormalization())
-      model.add(Dense(6, activation = 'sigmoid'))
-      model.add(BatchNormalization())
-      model.add(Dropout(0.2))
-      model.add(Dense(2, activation = 'softmax'))
-      model.compile(optimizer = opt_adam, loss = "categorical_crossentropy", metrics = ['accuracy'])
+      model = models.build_model('centralized', x_train.shape[1], learning_rate = 0.003, backend = model_backend)
 
       y_train_one_hot = to_categorical(y_train, num_classes=2)
       y_test_one_hot = to_categorical(y_test, num_classes=2)
@@ -70,7 +63,7 @@ for seed in range(10, 15):
       # Choose a value for beta, e.g., 0.999 or tune it based on your dataset
       beta = 0.999
       class_weights = cen_utils.get_class_balanced_weights(y_train, beta)
-      lr_scheduler = ReduceLROnPlateau(monitor='loss', factor=0.5, patience=5, min_lr=0.0005)
+      lr_scheduler = models.reduce_lr_on_plateau(model, monitor='loss', factor=0.5, patience=5, min_lr=0.0005)
 
       history = model.fit(x_train, y_train_one_hot, epochs = 300, class_weight = class_weights, callbacks=[lr_scheduler])
 
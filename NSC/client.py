@@ -0,0 +1,64 @@
+import flwr as fl
+from sklearn.metrics import roc_auc_score
+import codec
+import models
+from utils import one_hot
+
+
+class SpcancerClient(fl.client.NumPyClient):
+    def __init__(self, model, x_train, y_train, x_test, y_test, class_weights):
+        self.model = model
+        self.x_train, self.y_train = x_train.astype(float), y_train.astype(float)
+        self.x_test, self.y_test = x_test.astype(float), y_test.astype(float)
+        self.class_weights = class_weights
+        self.codec = codec.ClientCodec()
+
+    def get_parameters(self):
+        return self.model.get_weights()
+
+    # flwr 0.18 deletes NumPyClientWrapper.get_properties when a client has none, a second
+    # start_numpy_client in the same process (one per fold of train.py --folds) then fails
+    def get_properties(self, config):
+        return {}
+
+
+    # config is the information which is sent by the server every round.
+    # The content of the config will change every round
+    def fit(self, parameters, config):
+        self.model.set_weights(parameters)
+
+        print(f"Round: {config['round']}")
+        epochs: int = config["local_epochs"]
+
+        lr_scheduler = models.reduce_lr_on_plateau(self.model, monitor='loss', factor=0.5, patience=5, min_lr=0.000005)
+        history = self.model.fit(self.x_train, self.y_train, epochs=epochs, class_weight=self.class_weights, callbacks=[lr_scheduler])
+
+        # draw_loss_function(history=history, name="federated learning")
+
+        # Encoded with the codec the server asked for ('none' sends the plain weights)
+        payload, counters = self.codec.encode(self.model.get_weights(), parameters, config)
+
+        # Return updated model parameters and results
+        results = {
+            "loss": history.history["loss"][0],
+            "accuracy": history.history["accuracy"][0],
+            **counters,
+        }
+
+        return payload, len(self.x_train), results
+
+
+    def evaluate(self, parameters, config):
+        self.model.set_weights(parameters)
+
+        pred_prob = self.model.predict(self.x_test)
+
+        loss, accuracy = self.model.evaluate(self.x_test, one_hot(self.y_test), steps = config['val_steps'])
+        auc = roc_auc_score(self.y_test, pred_prob[:, 1])
+
+        results = {
+            "accuracy": accuracy,
+            "auc": auc,
+        }
+
+        return loss, len(self.x_test), results
@@ -0,0 +1,114 @@
+'''
+Compressed weight exchange between SpcancerClient and the server.py strategy.
+
+The server picks the codec and sends it to the clients in the fit config, so both sides always agree.
+A client encodes the weights it trained, the strategy decodes them back to full weights before FedAdam
+aggregates them. Only the client -> server direction is compressed, the global weights still go out
+as float32.
+
+    none    : full float32 weights, what the clients always sent (default)
+    float16 : half precision
+    int8    : symmetric per-tensor quantization, one float32 scale per tensor
+    topk    : only the topk_ratio largest entries of every tensor, as int32 indices + float32 values
+
+delta: encode the difference to the global weights of the round instead of the weights themselves.
+       Required by topk, and what makes float16/int8 lose so little.
+error_feedback: the part of the update lost by the encoding is added to the next round's update.
+'''
+import math
+import numpy as np
+
+CODECS = ('none', 'float16', 'int8', 'topk')
+
+
+def payload_bytes(arrays):
+    return int(sum(np.asarray(a).nbytes for a in arrays))
+
+
+def encode(update, kind, topk_ratio=0.01):
+    if kind == 'none':
+        return list(update)
+    if kind == 'float16':
+        return [u.astype(np.float16) for u in update]
+
+    payload = []
+    for u in update:
+        if kind == 'int8':
+            scale = float(np.max(np.abs(u))) / 127 if u.size else 0.0
+            scale = scale or 1.0
+            payload += [np.clip(np.rint(u / scale), -127, 127).astype(np.int8), np.array([scale], dtype=np.float32)]
+        elif kind == 'topk':
+            flat = u.ravel()
+            k = min(flat.size, max(1, math.ceil(topk_ratio * flat.size)))
+            index = np.argpartition(np.abs(flat), flat.size - k)[flat.size - k:]
+            payload += [index.astype(np.int32), flat[index].astype(np.float32)]
+        else:
+            raise ValueError(f"Unknown codec: {kind}, choose from {CODECS}")
+    return payload
+
+
+def decode(payload, kind, shapes):
+    if kind == 'none':
+        return [np.asarray(p, dtype=np.float32) for p in payload]
+    if kind == 'float16':
+        return [p.astype(np.float32) for p in payload]
+
+    update = []
+    for i, shape in enumerate(shapes):
+        first, second = payload[2*i], payload[2*i + 1]
+        if kind == 'int8':
+            update.append(first.astype(np.float32) * second[0])
+        elif kind == 'topk':
+            flat = np.zeros(int(np.prod(shape)), dtype=np.float32)
+            flat[first] = second
+            update.append(flat.reshape(shape))
+        else:
+            raise ValueError(f"Unknown codec: {kind}, choose from {CODECS}")
+    return update
+
+
+def codec_config(kind='none', delta=True, topk_ratio=0.01, error_feedback=True):
+    # The part of the fit config the clients read their codec from
+    if kind not in CODECS:
+        raise ValueError(f"Unknown codec: {kind}, choose from {CODECS}")
+    if kind == 'topk' and not delta:
+        raise ValueError("The topk codec only works on deltas")
+    return {'codec': kind, 'codec_delta': bool(delta and kind != 'none'), 'topk_ratio': float(topk_ratio),
+            'error_feedback': bool(error_feedback and kind != 'none')}
+
+
+class ClientCodec:
+    '''
+    Client side: keeps the error feedback residual between rounds and counts the bytes it sends.
+    '''
+    def __init__(self):
+        self.residual = None
+        self.history = []
+
+    def encode(self, weights, global_weights, config):
+        kind = config.get('codec', 'none')
+        delta = config.get('codec_delta', False)
+
+        update = [w - g for w, g in zip(weights, global_weights)] if delta else [np.asarray(w) for w in weights]
+        if config.get('error_feedback', False) and self.residual is not None:
+            update = [u + r for u, r in zip(update, self.residual)]
+
+        payload = encode(update, kind, config.get('topk_ratio', 0.01))
+
+        if config.get('error_feedback', False):
+            decoded = decode(payload, kind, [u.shape for u in update])
+            self.residual = [u - d for u, d in zip(update, decoded)]
+
+        counters = {'bytes_raw': payload_bytes([np.asarray(w, dtype=np.float32) for w in weights]),
+                    'bytes_sent': payload_bytes(payload)}
+        self.history.append(counters)
+        return payload, counters
+
+
+def decode_weights(payload, global_weights, config):
+    # Server side: the full weights a client trained, from what it sent
+    shapes = [g.shape for g in global_weights]
+    update = decode(payload, config.get('codec', 'none'), shapes)
+    if config.get('codec_delta', False):
+        return [(g + u).astype(np.float32) for g, u in zip(global_weights, update)]
+    return update
@@ -0,0 +1,97 @@
+'''
+Cache of the preprocessed train/test split of every hospital.
+
+The first run for a (dataset, features, seed) reads the CSV, splits it and one hot encodes it, then
+saves the encoded matrices as .npy files under Data_folder/cache/<key>/. Later runs memory map them
+and never parse the CSV again. The key covers the SHA-256 of the source file, the feature list,
+the seed, the test size and both encoder vocabularies, so a changed source file simply misses the
+cache and gets rebuilt.
+'''
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import encoder
+import fileio
+from features import local_feature
+
+CACHE_DIR = os.path.join('Data_folder', 'cache')
+DATASETS = {1: os.path.join('Data_folder', 'Taiwan_en.csv'), 2: os.path.join('Data_folder', 'SEER_en.csv')}
+# Bump when the layout of the cached files changes
+CACHE_VERSION = 1
+
+ARRAYS = ('x_train_global', 'x_test_global', 'x_train_local', 'x_test_local', 'y_train', 'y_test', 'index_train', 'index_test')
+
+
+class DatasetSplit:
+    '''
+    Encoded split of one hospital. x_* are DataFrames over the (memory mapped) uint8 matrices, with the
+    encoder columns and the row index of the source file; y_* are Series with the same index.
+    '''
+    def __init__(self, arrays, global_columns, local_columns):
+        self.arrays = arrays
+        index_train, index_test = arrays['index_train'], arrays['index_test']
+        self.x_train_global = pd.DataFrame(arrays['x_train_global'], columns=global_columns, index=index_train)
+        self.x_test_global = pd.DataFrame(arrays['x_test_global'], columns=global_columns, index=index_test)
+        self.x_train_local = pd.DataFrame(arrays['x_train_local'], columns=local_columns, index=index_train)
+        self.x_test_local = pd.DataFrame(arrays['x_test_local'], columns=local_columns, index=index_test)
+        self.y_train = pd.Series(arrays['y_train'], index=index_train, name='Target')
+        self.y_test = pd.Series(arrays['y_test'], index=index_test, name='Target')
+
+
+def build_arrays(df, seed, test_size, global_encoder, local_encoder):
+    # sklearn is only needed on a cache miss
+    from sklearn.model_selection import train_test_split
+    trainset, testset = train_test_split(df, test_size=test_size, stratify=df['Target'], random_state=seed)
+    return {
+        'x_train_global': global_encoder.transform(trainset),
+        'x_test_global': global_encoder.transform(testset),
+        'x_train_local': local_encoder.transform(trainset),
+        'x_test_local': local_encoder.transform(testset),
+        'y_train': trainset['Target'].to_numpy(dtype=np.int8),
+        'y_test': testset['Target'].to_numpy(dtype=np.int8),
+        'index_train': trainset.index.to_numpy(dtype=np.int64),
+        'index_test': testset.index.to_numpy(dtype=np.int64),
+    }
+
+
+def load_split(institution, seed, test_size=0.4, cache_dir=CACHE_DIR, use_cache=True):
+    source = DATASETS[institution]
+    columns = local_feature(institution) + ['Target']
+
+    # The CSV is only parsed when something has to be built from it. The local encoder is rebuilt when the
+    # source changed since it was saved, and always with use_cache=False
+    digest = encoder.file_hash(source)
+    df = None if use_cache else pd.read_csv(source, usecols=columns)[columns]
+    global_encoder = encoder.global_encoder()
+    local_encoder = encoder.local_encoder(institution, df, source=source, source_hash=digest, rebuild=not use_cache)
+
+    if not use_cache:
+        arrays = build_arrays(df, seed, test_size, global_encoder, local_encoder)
+        return DatasetSplit(arrays, global_encoder.columns, local_encoder.columns)
+
+    key = json.dumps({'version': CACHE_VERSION, 'source': digest, 'columns': columns, 'seed': seed,
+                      'test_size': test_size, 'global': global_encoder.to_dict(), 'local': local_encoder.to_dict()},
+                     sort_keys=True)
+    path = os.path.join(cache_dir, f'{institution}_{seed}_{hashlib.sha256(key.encode()).hexdigest()[:16]}')
+
+    if not os.path.exists(os.path.join(path, 'key.json')):
+        if df is None:
+            df = pd.read_csv(source, usecols=columns)[columns]
+        arrays = build_arrays(df, seed, test_size, global_encoder, local_encoder)
+
+        # Written to a temporary folder and renamed, a concurrent run never reads a half written cache
+        try:
+            with fileio.atomic_path(path, directory=True) as tmp_path:
+                for name, array in arrays.items():
+                    np.save(os.path.join(tmp_path, f'{name}.npy'), array)
+                with open(os.path.join(tmp_path, 'key.json'), 'w') as f:
+                    f.write(key)
+        except OSError:
+            # Another run got there first with the same content
+            if not os.path.exists(os.path.join(path, 'key.json')):
+                raise
+
+    arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in ARRAYS}
+    return DatasetSplit(arrays, global_encoder.columns, local_encoder.columns)
@@ -0,0 +1,173 @@
+'''
+One hot encoder with a fixed vocabulary, shared by train.py, centralized learning and the utils scripts.
+
+pd.get_dummies derives the columns from whatever values a frame happens to contain, so the train and
+the test split of the same hospital could end up with different columns. A FeatureEncoder is built
+once from the category vocabulary, saved as JSON, and always produces the same columns in the same
+order. transform() writes straight into a uint8 matrix (dense, or scipy.sparse CSR).
+
+Output columns:
+    '<feature>'         passthrough feature, copied as is (e.g. Radiation in the local models)
+    '<feature>_<value>' one hot column of a categorical feature, unknown values give an all zero row
+    anything else       all zero column, keeps a fixed layout (see global_encoder)
+'''
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import fileio
+from features import global_feature, global_feature_en, columns_exclude, local_feature
+
+ENCODER_DIR = os.path.join('Data_folder', 'encoders')
+
+
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _parse_value(text):
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return text
+
+
+class FeatureEncoder:
+    def __init__(self, columns, categorical, passthrough=(), source_hash=None):
+        self.columns = list(columns)
+        # SHA-256 of the dataset the vocabulary was fitted on, None when it was not fitted on a file
+        self.source_hash = source_hash
+        self.categorical = {feature: list(values) for feature, values in categorical.items()}
+        self.passthrough = list(passthrough)
+
+        position = {column: i for i, column in enumerate(self.columns)}
+        self._passthrough_index = [position[feature] for feature in self.passthrough]
+        # Output position of every category, -1 when the layout has no column for it
+        self._category_index = {feature: np.array([position.get(f'{feature}_{value}', -1) for value in values])
+                                for feature, values in self.categorical.items()}
+
+    @classmethod
+    def fit(cls, df, categorical, passthrough=()):
+        # Same columns, in the same order, as pd.get_dummies(df[passthrough + categorical], columns=categorical)
+        vocabulary = {feature: sorted(df[feature].dropna().unique().tolist()) for feature in categorical}
+        passthrough = [feature for feature in df.columns if feature in set(passthrough)]
+        return cls.from_vocabulary(vocabulary, passthrough)
+
+    @classmethod
+    def from_vocabulary(cls, vocabulary, passthrough=()):
+        # vocabulary: {feature: sorted category values}, e.g. from a utils/profiler.py profile
+        columns = list(passthrough) + [f'{feature}_{value}' for feature, values in vocabulary.items() for value in values]
+        return cls(columns, vocabulary, passthrough)
+
+    @classmethod
+    def from_columns(cls, columns, categorical, passthrough=()):
+        # Vocabulary read back from '<feature>_<value>' column names
+        vocabulary = {feature: [] for feature in categorical}
+        for column in columns:
+            feature, _, value = column.rpartition('_')
+            if feature in vocabulary:
+                vocabulary[feature].append(_parse_value(value))
+        return cls(columns, vocabulary, passthrough)
+
+    @property
+    def features(self):
+        return self.passthrough + list(self.categorical)
+
+    def _codes(self, df, feature):
+        codes = pd.Categorical(df[feature], categories=self.categorical[feature]).codes
+        return np.where(codes >= 0, self._category_index[feature][codes], -1)
+
+    def transform(self, df, sparse=False, dtype=np.uint8):
+        n = len(df)
+        if sparse:
+            from scipy.sparse import csr_matrix
+            rows, cols, values = [], [], []
+            for feature, index in zip(self.passthrough, self._passthrough_index):
+                rows.append(np.arange(n))
+                cols.append(np.full(n, index))
+                values.append(df[feature].to_numpy())
+            for feature in self.categorical:
+                target = self._codes(df, feature)
+                hit = np.flatnonzero(target >= 0)
+                rows.append(hit)
+                cols.append(target[hit])
+                values.append(np.ones(len(hit)))
+            values = np.concatenate(values).astype(dtype)
+            return csr_matrix((values, (np.concatenate(rows), np.concatenate(cols))), shape=(n, len(self.columns)), dtype=dtype)
+
+        out = np.zeros((n, len(self.columns)), dtype=dtype)
+        for feature, index in zip(self.passthrough, self._passthrough_index):
+            out[:, index] = df[feature].to_numpy()
+        for feature in self.categorical:
+            target = self._codes(df, feature)
+            hit = np.flatnonzero(target >= 0)
+            out[hit, target[hit]] = 1
+        return out
+
+    def transform_frame(self, df, dtype=np.uint8):
+        # Dense matrix with the column names, keeps the row index (what Keras, SHAP and the plots use)
+        return pd.DataFrame(self.transform(df, dtype=dtype), columns=self.columns, index=df.index)
+
+    def to_dict(self):
+        return {'columns': self.columns, 'categorical': self.categorical, 'passthrough': self.passthrough}
+
+    def save(self, path):
+        # Written next to the target and renamed, so a concurrent reader never sees half a file
+        with fileio.atomic_path(path) as tmp_path, open(tmp_path, 'w') as f:
+            json.dump(dict(self.to_dict(), source=self.source_hash), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            spec = json.load(f)
+        return cls(spec['columns'], spec['categorical'], spec.get('passthrough', ()), spec.get('source'))
+
+
+def load_or_build(path, build, source_hash=None, rebuild=False):
+    '''
+    The saved encoder, unless rebuild is set or it was fitted on another version of the source file
+    (source_hash), then build() is saved in its place. A stale vocabulary would encode new categories
+    as all zero rows.
+    '''
+    if not rebuild and os.path.exists(path):
+        encoder = FeatureEncoder.load(path)
+        if source_hash is None or encoder.source_hash == source_hash:
+            return encoder
+    encoder = build()
+    encoder.source_hash = source_hash
+    encoder.save(path)
+    return encoder
+
+
+def global_encoder(directory=ENCODER_DIR):
+    '''
+    The 43 wide input of the federated models (server.py total_feature_number), in global_feature_en order.
+    The treatment features keep their columns in the layout but, like before, are not encoded into them.
+    '''
+    categorical = [feature for feature in global_feature if feature not in columns_exclude]
+    return load_or_build(os.path.join(directory, 'global.json'),
+                         lambda: FeatureEncoder.from_columns(global_feature_en, categorical))
+
+
+def local_encoder(institution, df=None, directory=ENCODER_DIR, source=None, source_hash=None, rebuild=False):
+    '''
+    Vocabulary of the whole hospital dataset, so the train and the test split always get the same columns.
+    df: the dataset, or None to read it from source when the encoder has to be (re)built.
+    source_hash: file_hash of the dataset, a saved encoder of another version is rebuilt.
+    '''
+    features = local_feature(institution)
+    categorical = [feature for feature in features if feature not in columns_exclude]
+    passthrough = [feature for feature in features if feature in columns_exclude]
+
+    def build():
+        frame = df if df is not None else pd.read_csv(source, usecols=features)
+        return FeatureEncoder.fit(frame[features], categorical, passthrough)
+    return load_or_build(os.path.join(directory, f'local_{institution}.json'), build, source_hash, rebuild)
@@ -0,0 +1,70 @@
+'''
+SHAP backends of utils.featureInterpreter, picked with --shap-backend (utils.configure_explanations).
+
+    'kernel'      : shap.KernelExplainer over model.predict, the reference
+    'kernel-fast' : the same Kernel SHAP estimator, but the model is called directly on large batches.
+                    Kernel SHAP evaluates the model on ~100k perturbed rows per explained row,
+                    model.predict pays its per-call setup (and a small default batch) every time
+    'gradient'    : shap.GradientExplainer (expected gradients) on the Keras model, one backward pass
+                    per sample instead of thousands of model evaluations
+    'deep'        : shap.DeepExplainer (DeepLIFT) on the Keras model
+
+'gradient' and 'deep' estimate the same attributions differently, their values are close to the kernel
+ones but not equal (bench.py shap compares them). They need the TensorFlow graph of a Keras model, the
+numpy backend (numpy_nn.NumpyNet) only works with the kernel backends.
+'''
+import numpy as np
+
+BACKENDS = ('kernel', 'kernel-fast', 'gradient', 'deep')
+KERAS_ONLY = ('gradient', 'deep')
+
+
+def check_backend(backend, nn_backend='keras'):
+    # Raises ValueError for an unknown backend, or one the nn backend (models.BACKENDS) cannot run
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown SHAP backend: {backend}, choose from {BACKENDS}")
+    if backend in KERAS_ONLY and nn_backend != 'keras':
+        raise ValueError(f"SHAP backend {backend} needs a Keras model, the {nn_backend} nn backend has no TensorFlow "
+                         f"graph. Use --shap-backend kernel or kernel-fast with it")
+
+
+def direct_predict(model, batch_size=8192):
+    # model.predict replacement for the Kernel explainer: one direct call per batch, in inference mode
+    def predict(X):
+        X = np.asarray(X, dtype=np.float32)
+        outputs = [np.asarray(model(X[i:i+batch_size], training=False)) for i in range(0, len(X), batch_size)]
+        return np.concatenate(outputs) if outputs else np.empty((0, model.output_shape[-1]), dtype=np.float32)
+    return predict
+
+
+def per_class(values):
+    # Newer shap versions return one (samples, features, classes) array instead of a list per class
+    if isinstance(values, list):
+        return values
+    values = np.asarray(values)
+    if values.ndim == 3:
+        return [values[..., k] for k in range(values.shape[-1])]
+    return [values]
+
+
+def shap_values(model, background, samples, backend='kernel'):
+    '''
+    SHAP values of every output class of a Keras model, as a list of (samples, features) arrays.
+    background, samples: DataFrames (or arrays) with the model inputs
+    '''
+    import shap
+    from numpy_nn import NumpyNet
+    check_backend(backend, 'numpy' if isinstance(model, NumpyNet) else 'keras')
+
+    if backend == 'kernel':
+        explainer = shap.KernelExplainer(model.predict, background)
+        return per_class(explainer.shap_values(samples))
+    if backend == 'kernel-fast':
+        explainer = shap.KernelExplainer(direct_predict(model), background)
+        return per_class(explainer.shap_values(samples))
+
+    background = np.asarray(background, dtype=np.float32)
+    samples = np.asarray(samples, dtype=np.float32)
+    if backend == 'gradient':
+        return per_class(shap.GradientExplainer(model, background).shap_values(samples))
+    return per_class(shap.DeepExplainer(model, background).shap_values(samples))
@@ -0,0 +1,39 @@
+'''
+Atomic writes shared by the caches and stores (encoders, stage artifacts, predictions, SHAP values,
+dataset profiles, the encoded split cache).
+
+Every writer fills a temporary file (or folder) next to the target and renames it over the target, so
+a reader never sees half a file. The temporary name comes from tempfile and is unique per call: two
+threads of one process (train.py --simulate) or two processes writing the same target never share it.
+'''
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_path(path, suffix='', directory=False):
+    '''
+    Yields a temporary path in the folder of path, renamed to path when the block exits without an error
+    and removed otherwise. suffix: extension the writer needs, np.save/np.savez append .npy/.npz to a
+    name without it. directory: a temporary folder instead of a file, the rename fails with OSError when
+    path is already a non empty folder.
+    '''
+    parent = os.path.dirname(path) or '.'
+    os.makedirs(parent, exist_ok=True)
+    prefix = f'.{os.path.basename(path)}.'
+    if directory:
+        tmp_path = tempfile.mkdtemp(suffix='.tmp', prefix=prefix, dir=parent)
+    else:
+        fd, tmp_path = tempfile.mkstemp(suffix=f'.tmp{suffix}', prefix=prefix, dir=parent)
+        os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
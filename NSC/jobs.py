@@ -0,0 +1,165 @@
+'''
+Deferred explanation jobs.
+
+With --explain=defer, featureInterpreter and featureInterpreter_SSW do not run inside fit(). The trained
+model and the rows to explain are stored as a job under Results/jobs/pending/ and the run goes on.
+The SHAP values and the PNGs in Results/shap/ are produced later by a pool of workers:
+
+    python jobs.py run --workers=4      # run every pending job
+    python jobs.py list                 # pending / running / done / failed counts
+    python jobs.py retry                # move the failed jobs back to pending
+    python jobs.py clear                # drop the done jobs
+
+A job is a folder (job.json + model.h5/model.npz + x_train.pkl, or job.json only for SSW). It moves
+pending -> running -> done/failed with os.replace, so two workers never pick the same job.
+'''
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+JOB_DIR = os.path.join('Results', 'jobs')
+STATES = ('pending', 'running', 'done', 'failed')
+
+
+def _state_dir(state, job_dir=JOB_DIR):
+    return os.path.join(job_dir, state)
+
+
+def _submit(spec, write_artifacts, job_dir=JOB_DIR):
+    # Written under a temporary name first, a worker only sees complete jobs
+    job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{spec['kind']}-{uuid.uuid4().hex[:8]}"
+    tmp_path = os.path.join(job_dir, f'.{job_id}.tmp')
+    os.makedirs(tmp_path)
+    write_artifacts(tmp_path)
+    with open(os.path.join(tmp_path, 'job.json'), 'w') as f:
+        json.dump(spec, f, indent=2)
+    os.makedirs(_state_dir('pending', job_dir), exist_ok=True)
+    os.replace(tmp_path, os.path.join(_state_dir('pending', job_dir), job_id))
+    return job_id
+
+
+def submit_shap(name, model, x_train, institution, method, seed, backend, job_dir=JOB_DIR):
+    # Keras models as HDF5, the NumPy trainer (numpy_nn.py) as NPZ
+    from numpy_nn import NumpyNet
+    model_file = 'model.npz' if isinstance(model, NumpyNet) else 'model.h5'
+
+    def write_artifacts(path):
+        model.save(os.path.join(path, model_file))
+        x_train.to_pickle(os.path.join(path, 'x_train.pkl'))
+
+    spec = {'kind': 'shap', 'name': name, 'institution': int(institution), 'method': method, 'seed': int(seed), 'backend': backend,
+            'model_file': model_file}
+    return _submit(spec, write_artifacts, job_dir)
+
+
+def submit_ssw(ser_weight, loc_weight, institution, seed, job_dir=JOB_DIR):
+    spec = {'kind': 'ssw', 'ser_weight': float(ser_weight), 'loc_weight': float(loc_weight), 'institution': int(institution), 'seed': int(seed)}
+    return _submit(spec, lambda path: None, job_dir)
+
+
+def claim(job_dir=JOB_DIR):
+    # Move one pending job to running, None when there is nothing left
+    os.makedirs(_state_dir('running', job_dir), exist_ok=True)
+    pending = _state_dir('pending', job_dir)
+    for job_id in sorted(os.listdir(pending)) if os.path.isdir(pending) else []:
+        try:
+            os.replace(os.path.join(pending, job_id), os.path.join(_state_dir('running', job_dir), job_id))
+            return job_id
+        except FileNotFoundError:
+            continue  # taken by another worker
+    return None
+
+
+def execute(path):
+    import pandas as pd
+    import utils
+
+    with open(os.path.join(path, 'job.json')) as f:
+        spec = json.load(f)
+
+    if spec['kind'] == 'ssw':
+        utils.featureInterpreter_SSW(spec['ser_weight'], spec['loc_weight'], spec['institution'], spec['seed'])
+    elif spec['kind'] == 'shap':
+        model_path = os.path.join(path, spec.get('model_file', 'model.h5'))
+        if model_path.endswith('.npz'):
+            from numpy_nn import load_model
+            model = load_model(model_path)
+        else:
+            from tensorflow.keras.models import load_model
+            model = load_model(model_path, compile=False)
+        x_train = pd.read_pickle(os.path.join(path, 'x_train.pkl'))
+        utils.configure_explanations(spec['backend'])
+        utils.featureInterpreter(spec['name'], model, x_train, spec['institution'], spec['method'], spec['seed'])
+    else:
+        raise ValueError(f"Unknown job kind: {spec['kind']}")
+
+
+def _work(job_dir):
+    # One worker process: run jobs until the queue is empty, returns (done, failed)
+    done, failed = 0, 0
+    while True:
+        job_id = claim(job_dir)
+        if job_id is None:
+            return done, failed
+        path = os.path.join(_state_dir('running', job_dir), job_id)
+        start_time = time.time()
+        try:
+            execute(path)
+            state = 'done'
+            done += 1
+        except Exception:
+            with open(os.path.join(path, 'error.txt'), 'w') as f:
+                f.write(traceback.format_exc())
+            state = 'failed'
+            failed += 1
+        os.makedirs(_state_dir(state, job_dir), exist_ok=True)
+        os.replace(path, os.path.join(_state_dir(state, job_dir), job_id))
+        print(f"{job_id}: {state} in {time.time() - start_time:.1f} s", flush=True)
+
+
+def run(workers=1, job_dir=JOB_DIR):
+    if workers <= 1:
+        return _work(job_dir)
+    done, failed = 0, 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for future in as_completed([pool.submit(_work, job_dir) for _ in range(workers)]):
+            d, f = future.result()
+            done, failed = done + d, failed + f
+    return done, failed
+
+
+def counts(job_dir=JOB_DIR):
+    return {state: len(os.listdir(_state_dir(state, job_dir))) if os.path.isdir(_state_dir(state, job_dir)) else 0 for state in STATES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deferred SHAP/plot jobs")
+    parser.add_argument('command', choices=['run', 'list', 'retry', 'clear'])
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes for run')
+    parser.add_argument('--job-dir', default=JOB_DIR, help='Job queue folder')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        done, failed = run(args.workers, args.job_dir)
+        print(f"{done} done, {failed} failed")
+        if failed:
+            sys.exit(1)
+    elif args.command == 'list':
+        print(counts(args.job_dir))
+    elif args.command == 'retry':
+        failed = _state_dir('failed', args.job_dir)
+        os.makedirs(_state_dir('pending', args.job_dir), exist_ok=True)
+        for job_id in os.listdir(failed) if os.path.isdir(failed) else []:
+            os.replace(os.path.join(failed, job_id), os.path.join(_state_dir('pending', args.job_dir), job_id))
+    elif args.command == 'clear':
+        shutil.rmtree(_state_dir('done', args.job_dir), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
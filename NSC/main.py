@@ -3,18 +3,20 @@ import time
 import math
 import numpy as np
 import pandas as pd
-import tensorflow as tf
-from sklearn.model_selection import KFold, train_test_split
-from sklearn.metrics import roc_auc_score, roc_curve, precision_recall_curve, auc
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense, Dropout, BatchNormalization
-from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.callbacks import ReduceLROnPlateau
-from tensorflow.keras.utils import to_categorical
 import utils
+import ssw_engine
+import models
+import pipeline
+import metrics
+import results_store
+import stage
 
 os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
 
+# sklearn, TensorFlow (DPN only) and the plotting packages are imported where they are used,
+# an SSW only run never loads TensorFlow (bench.py import-time)
+MODELS = ('SSW', 'DPN')
+
 from abc import ABC, abstractmethod
 
 # Base classifier class
@@ -29,8 +31,17 @@ class Classifier(ABC):
 
 # Implement the seesawing weights algorithm 
 class SeeSawingWeights(Classifier):
-    def __init__(self, epoch, auc_global, auc_local):
+    '''
+    engine: 'numpy' (default) runs the exact sequential rule on a float array, see ssw_engine.py.
+            'numba' compiles the same sequential rule with numba, falls back to 'numpy' without numba.
+            'loop' is the original row by row implementation, kept as the reference.
+            'batch' is fully vectorised but does not follow the sequential rule.
+    '''
+    def __init__(self, epoch, auc_global, auc_local, engine='numpy'):
+        if engine not in ssw_engine.ENGINES:
+            raise ValueError(f"Unknown SSW engine: {engine}, choose from {ssw_engine.ENGINES}")
         self.model = None
+        self.engine = engine
         self.epoch = epoch
         self.ser_weight = 0.0
         self.loc_weight = 0.0
@@ -41,11 +52,37 @@ class SeeSawingWeights(Classifier):
         
     def fit(self, X, y, institution, seed):
         start_time = time.time()
-        lr = 1/len(X)
+        self.train_weights(X, y)
+
+        print("New server weights:", self.ser_weight)
+        print("New local weights:", self.loc_weight)
+
+        end_time = time.time()
+        execution_time = end_time - start_time
+
+        # utils.draw_loss_function(history=(np.arange(self.epoch), self.loss), name = 'seesawing weights')
+        utils.explain_SSW(self.ser_weight, self.loc_weight, institution, seed)
+
+        return execution_time
+
+    # Only the weight updates, without timing and plotting (used by bench.py)
+    def train_weights(self, X, y):
         self.ser_weight = self.auc_global / (self.auc_global + self.auc_local)
         self.loc_weight = self.auc_local / (self.auc_global + self.auc_local)
         self.loss = []
 
+        if self.engine == 'loop':
+            self._fit_rows(X, y)
+        else:
+            self.ser_weight, self.loc_weight, self.loss = ssw_engine.fit(
+                X, y, self.ser_weight, self.loc_weight, self.epoch, self.convergence_number, self.engine)
+
+    def _fit_rows(self, X, y):
+        if not isinstance(X, pd.DataFrame):
+            # The reference loop reads float64 DataFrame rows, stage arrays get a positional frame
+            X, y = pd.DataFrame(np.asarray(X, dtype=np.float64)), np.asarray(y)
+        lr = 1/len(X)
+
         for cur in range(self.epoch):
             loss = 0
             # LAEARNING RATE SCHEDULER
@@ -100,54 +137,33 @@ class SeeSawingWeights(Classifier):
 
             self.loss.append(loss)
 
-        print("New server weights:", self.ser_weight)
-        print("New local weights:", self.loc_weight)
-
-        end_time = time.time()
-        execution_time = end_time - start_time
-
-        # utils.draw_loss_function(history=(np.arange(self.epoch), self.loss), name = 'seesawing weights')
-        utils.featureInterpreter_SSW(self.ser_weight, self.loc_weight, institution, seed)
-
-        return execution_time
-
     def predict(self, X, y_test):
-        y = []
-        pred_prob = []
-        for index, row in X.iterrows():
-            yes_prob = self.ser_weight * row.iloc[0] + self.loc_weight * row.iloc[2]
-            pred_prob.append(yes_prob)
+        # Youden threshold on the test probabilities, same as argmax(tpr - fpr) of roc_curve
+        pred_prob = self.predict_proba(X)
+        return metrics.Scores(y_test, pred_prob).predict(pred_prob).tolist()
 
-        fpr, tpr, threshold = roc_curve(y_test, pred_prob)
-        optimal_index = np.argmax(tpr - fpr)
-        y = [1 if prob >= threshold[optimal_index] else 0 for prob in pred_prob]
+    # Yes probability only, like DualPerceptionNet.predict_proba
+    def predict_proba(self, X):
+        return self.predict_proba_matrix(X)[:, 1]
 
-        return y
+    # (n, 2) [no prob, yes prob] for a (n, 4) array or DataFrame
+    def predict_proba_matrix(self, X):
+        return ssw_engine.predict_proba(X, self.ser_weight, self.loc_weight)
 
-    def predict_proba(self, X):
-        prob = []
-        for index, row in X.iterrows():
-            yes_prob = self.ser_weight*row.iloc[0]+self.loc_weight*row.iloc[2]
-            no_prob = self.ser_weight*row.iloc[1]+self.loc_weight*row.iloc[3]
-            prob.append(np.array(yes_prob , no_prob))
-
-        prob = np.array(prob)
-        return prob
+    # Chunked scoring of a CSV path or an iterable of chunks, yields (m, 2) arrays
+    def predict_proba_stream(self, source, chunksize=100000):
+        return ssw_engine.predict_proba_stream(source, self.ser_weight, self.loc_weight, chunksize)
     
 
 
 class DualPerceptionNet(Classifier):
-    def __init__(self, epoch, learning_rate):
+    '''
+    backend: 'keras' or 'numpy' (numpy_nn.py), same 4 -> 8 -> 4 -> 2 net, see models.py
+    '''
+    def __init__(self, epoch, learning_rate, backend='keras'):
         self.epoch = epoch
         self.learning_rate = learning_rate
-        self.model = Sequential()
-        self.model.add(Dense(8, activation='relu', input_shape=(4,)))
-        self.model.add(BatchNormalization())
-        self.model.add(Dropout(0.1))
-        self.model.add(Dense(4, activation='relu'))
-        self.model.add(BatchNormalization())
-        self.model.add(Dense(2, activation='softmax'))
-        self.model.compile(optimizer=Adam(learning_rate=self.learning_rate), loss="categorical_crossentropy", metrics=['accuracy'])
+        self.model = models.build_model('dpn', 4, learning_rate=self.learning_rate, backend=backend)
 
 
     def fit(self, X, y, institution, seed):
@@ -155,14 +171,17 @@ class DualPerceptionNet(Classifier):
 
         beta = (len(X)-1)/len(X)
         class_weights = utils.get_class_balanced_weights(y, beta)
-        lr_scheduler = ReduceLROnPlateau(monitor='loss', factor=0.5, patience=5, min_lr=0.0000005)
-        history = self.model.fit(X, to_categorical(y, num_classes=2), epochs=self.epoch, class_weight=class_weights, callbacks=[lr_scheduler])
+        lr_scheduler = models.reduce_lr_on_plateau(self.model, monitor='loss', factor=0.5, patience=5, min_lr=0.0000005)
+        history = pipeline.fit(self.model, X, utils.one_hot(y), epochs=self.epoch, class_weight=class_weights, callbacks=[lr_scheduler], name='DPN')
 
         end_time = time.time()
         execution_time = end_time - start_time    
 
         # utils.draw_loss_function(history=history, name='NN network')
-        utils.featureInterpreter('DPN', self.model, X.astype(float), institution, 'nsc' , seed)
+        if not isinstance(X, pd.DataFrame):
+            # The SHAP plots name the features, stage arrays get the middle CSV columns
+            X = pd.DataFrame(X, columns=list(stage.COLUMNS))
+        utils.explain('DPN', self.model, X.astype(float), institution, 'nsc' , seed)
 
         return execution_time
 
@@ -176,65 +195,282 @@ class DualPerceptionNet(Classifier):
         return prob[:,1]
 
 
-def evaluate_model(model, X_test, y_test, training_time):
-    predictions = model.predict(X_test, y_test)
-    proba = model.predict_proba(X_test)
+def evaluate_model(model, X_test, y_test, training_time, proba=None):
+    # The test set is scored once, AUROC/AUPRC/threshold all come from that one probability vector
+    proba = model.predict_proba(X_test) if proba is None else proba
+    return score_proba(y_test, proba, training_time)
 
-    if np.sum(y_test):
-        auroc = roc_auc_score(y_test, proba)
-        precision, recall, _ = precision_recall_curve(y_test, proba)
-        auprc = auc(recall, precision)
-    else:
-        auroc, auprc = None, None
+
+def score_proba(y_test, proba, training_time):
+    scores = metrics.Scores(y_test, proba)
 
     return {
-        'auroc': auroc,
-        'auprc': auprc,
+        'auroc': scores.auroc,
+        'auprc': scores.auprc,
+        'threshold': scores.youden_threshold,
         'training time': training_time
     }
 
 
+def load_stage(institution, stage_dir='.'):
+    # The memory mapped stage_{institution} arrays of train.py, or the middle/init CSV files (older runs,
+    # train.py --stage-format=csv removes the stage_{institution} of an earlier run)
+    if stage.exists(stage_dir, institution):
+        return stage.load(stage_dir, institution)
+
+    df = pd.read_csv(utils.stage_path(stage_dir, 'middle', institution))
+    df_init = pd.read_csv(utils.stage_path(stage_dir, 'init', institution))
+    return stage.Stage(df[list(stage.COLUMNS)].to_numpy(), df['Outcome'].to_numpy(), np.arange(len(df)),
+                       df_init['global auroc'].iloc[0], df_init['local auroc'].iloc[0])
+
+
+def load_middle_data(institution, stage_dir='.'):
+    handoff = load_stage(institution, stage_dir)
+    return handoff.frame(), handoff.auc_global, handoff.auc_local
+
+
+def split_middle_data(df, seed):
+    from sklearn.model_selection import train_test_split
+    trainset, testset = train_test_split(df, test_size=0.33, stratify=df['Outcome'], random_state=seed)
+
+    x_train, y_train = trainset.drop(columns=['Outcome']), trainset['Outcome']
+    x_test, y_test = testset.drop(columns=['Outcome']), testset['Outcome']
+    return x_train, y_train, x_test, y_test
+
+
+def split_stage(handoff, seed):
+    # split_middle_data on the stage arrays, the same rows for a seed without building the DataFrame
+    from sklearn.model_selection import train_test_split
+    train_index, test_index = train_test_split(np.arange(len(handoff)), test_size=0.33, stratify=np.asarray(handoff.outcome), random_state=seed)
+
+    x_train, y_train = handoff.rows(train_index)
+    x_test, y_test = handoff.rows(test_index)
+    return x_train, y_train, x_test, y_test
+
+
+def baseline_predictions(x_test):
+    # The federated and localized yes probabilities are columns 0 and 2 of the meta features
+    return {'Federated Learning': np.asarray(x_test)[:, 0], 'Localized Learning': np.asarray(x_test)[:, 2]}
+
+
+def save_predictions(institution, seed, y_test, predictions, folds=1):
+    # Test probabilities of every model, for the bootstrap CIs and DeLong tests of report.py.
+    # folds > 1: the out-of-fold probabilities of --folds, stored apart from the single split run
+    import report
+    hospital = 'Taiwan' if institution == 1 else 'USA'
+    report.save_predictions(hospital, seed, y_test, predictions, folds=folds)
+
+
+def format_results(all_results, institution, seed):
+    hospital = 'Taiwan' if institution == 1 else 'USA'
+    all_results = pd.DataFrame(all_results)
+    all_results = all_results[['model', 'auroc', 'auprc', 'training time']]
+    all_results.rename(columns={'model': f'Model | {hospital} | seed={seed}'}, inplace=True)
+    return all_results
+
+
+def save_results(all_results, institution, seed, config=None):
+    # One transaction per run in Results/results.db
+    save_sweep_results([(seed, all_results)], institution, config)
+
+
+def save_sweep_results(runs, institution, config=None):
+    # (seed, results) of every seed, all written with one transaction
+    results_store.record_runs(runs, 'nsc', results_store.hospital_name(institution), config, source='main.py')
+    for seed, all_results in runs:
+        print(format_results(all_results, institution, seed).to_string(index=False))
+
+
+# SSW seed sweep. Filled once per process (once per worker with --workers > 1),
+# so the middle/init data is only read one time for the whole sweep
+_sweep_data = {}
+
+
+def _init_sweep(source, institution, engine, explain=('kernel', 'sync')):
+    # source: a stage.Stage, or the descriptor of the shared memory block the parent put it in
+    block = None
+    if isinstance(source, dict):
+        block, source = stage.from_shared_memory(source)
+    _sweep_data.update(stage=source, auc_global=source.auc_global, auc_local=source.auc_local,
+                       institution=institution, engine=engine, block=block)
+    # Spawned workers do not inherit the --shap-backend/--explain settings
+    utils.configure_explanations(*explain)
+
+
+def _run_ssw_seed(seed):
+    d = _sweep_data
+    x_train, y_train, x_test, y_test = split_stage(d['stage'], seed)
+
+    model = SeeSawingWeights(epoch = 30, auc_global = d['auc_global'], auc_local = d['auc_local'], engine = d['engine'])
+    training_time = model.fit(x_train, y_train, d['institution'], seed)
+    proba = model.predict_proba(x_test)
+    result = evaluate_model(model, x_test, y_test, training_time, proba)
+    result['model'] = 'SSW'
+    save_predictions(d['institution'], seed, y_test, {**baseline_predictions(x_test), 'SSW': proba})
+    return seed, [result]
+
+
+def ssw_sweep(institution, seeds, engine='numpy', workers=1, stage_dir='.', config=None):
+    '''
+    Train SSW for every seed in one process (or one process pool) instead of one `python main.py` per seed.
+    Only the meta split changes with the seed, the middle/init data is loaded once. The workers read it
+    from one shared memory block instead of each getting a pickled copy, and return their results: the
+    rows of all the seeds go into Results/results.db with one transaction at the end.
+    '''
+    start_time = time.time()
+    handoff = load_stage(institution, stage_dir)
+    settings = (institution, engine, (utils.explain_backend, utils.explain_mode))
+
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        block, descriptor = stage.to_shared_memory(handoff)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep, initargs=(descriptor, *settings)) as pool:
+                runs = list(pool.map(_run_ssw_seed, seeds))
+        finally:
+            block.close()
+            block.unlink()
+    else:
+        _init_sweep(handoff, *settings)
+        runs = [_run_ssw_seed(seed) for seed in seeds]
+
+    save_sweep_results(runs, institution, config)
+    print(f"SSW sweep over {len(seeds)} seeds took {time.time() - start_time:.2f} s")
+
+
+def build_meta_model(name, auc_global, auc_local, args):
+    # Built lazily, DualPerceptionNet needs TensorFlow (with the keras backend)
+    if name == 'SSW':
+        return SeeSawingWeights(epoch = 30, auc_global = auc_global, auc_local = auc_local, engine = args.ssw_engine)
+    return DualPerceptionNet(epoch = 300, learning_rate = 0.003, backend = args.dpn_backend)
+
+
+# K-fold stacking, the stage and the fold of every row are set once per worker like for the sweep
+def _init_folds(source, args, folds):
+    _init_sweep(source, args.hospital, args.ssw_engine, (args.shap_backend, args.explain))
+    pipeline.configure(args)
+    _sweep_data.update(args=args, folds=folds)
+
+
+def _run_fold(task):
+    name, fold = task
+    d = _sweep_data
+    x_train, y_train = d['stage'].rows(d['folds'] != fold)
+    x_test, _ = d['stage'].rows(d['folds'] == fold)
+
+    # Only the first fold is explained, the other folds would overwrite its plots under the same seed
+    mode = utils.explain_mode
+    utils.configure_explanations(utils.explain_backend, mode if fold == 0 else 'skip')
+    try:
+        model = build_meta_model(name, d['auc_global'], d['auc_local'], d['args'])
+        training_time = model.fit(x_train, y_train, d['institution'], d['args'].seed)
+        proba = np.asarray(model.predict_proba(x_test), dtype=np.float64)
+    finally:
+        utils.configure_explanations(utils.explain_backend, mode)
+    return name, fold, proba, training_time
+
+
+def cross_validate(args):
+    '''
+    K-fold stacking over every row of the stage (the out-of-fold probabilities of train.py --folds).
+    Every (meta model, fold) is trained on the other folds and scores its own, the jobs run in --workers
+    processes that read the stage from one shared memory block. The results are the AUROC/AUPRC of the
+    out-of-fold meta probabilities over all rows, the training time is the sum over the folds.
+    '''
+    from sklearn.model_selection import StratifiedKFold
+    start_time = time.time()
+    handoff = load_stage(args.hospital, args.stage_dir)
+    outcome = np.asarray(handoff.outcome, dtype=np.int64)
+
+    folds = np.empty(len(outcome), dtype=np.int64)
+    splitter = StratifiedKFold(n_splits=args.folds, shuffle=True, random_state=args.seed)
+    for fold, (_, test_index) in enumerate(splitter.split(outcome, outcome)):
+        folds[test_index] = fold
+    tasks = [(name, fold) for name in MODELS if name in args.models for fold in range(args.folds)]
+
+    if args.workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        block, descriptor = stage.to_shared_memory(handoff)
+        try:
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_folds, initargs=(descriptor, args, folds)) as pool:
+                outputs = list(pool.map(_run_fold, tasks))
+        finally:
+            block.close()
+            block.unlink()
+    else:
+        _init_folds(handoff, args, folds)
+        outputs = [_run_fold(task) for task in tasks]
+
+    predictions = baseline_predictions(handoff.probs)
+    training_times = {}
+    for name, fold, proba, training_time in outputs:
+        predictions.setdefault(name, np.empty(len(outcome)))[folds == fold] = proba
+        training_times[name] = training_times.get(name, 0.0) + training_time
+
+    all_results = []
+    for name in training_times:
+        result = score_proba(outcome, predictions[name], training_times[name])
+        result['model'] = name
+        all_results.append(result)
+
+    save_predictions(args.hospital, args.seed, outcome, predictions, args.folds)
+    save_results(all_results, args.hospital, args.seed, results_store.run_config(args))
+    print(f"{args.folds}-fold stacking of {', '.join(training_times)} over {len(outcome)} rows took {time.time() - start_time:.2f} s")
+
+
 def main():
     '''
     If you use the script to run this program, where you can test multiple seeds per time. You need to comment 
     LINE: institution, seed = int(input("Please choose a hospital: 1 for Taiwan, 2 for US (SEER Database): ")), 42
     Otherwise, you need to comment the following line, where you can only test for one seed.
     LINE: institution, seed = utils.parse_argument_for_running_script()
+
+    With --seeds (e.g. --seeds=10-44) only SSW is trained, once per seed, on the current middle/init data.
+    With --folds (e.g. --folds=5) the meta models are cross-validated over all the stage rows instead of
+    trained on one split, use it on the out-of-fold stage of train.py --folds.
     '''
-    institution, seed = utils.parse_argument_for_running_script()
+    parser = utils.build_argument_parser()
+    parser.add_argument('--seeds', type=utils.seed_range, default=None, help='SSW only sweep over a seed range, e.g. 10-44')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes for the SSW sweep or the --folds jobs')
+    parser.add_argument('--folds', type=int, default=1, help='K-fold stacking of the meta models (1: one train/test split)')
+    parser.add_argument('--ssw-engine', default='numpy', choices=ssw_engine.ENGINES, help='SSW training engine')
+    parser.add_argument('--dpn-backend', default='keras', choices=models.BACKENDS, help='DPN trainer')
+    parser.add_argument('--models', nargs='+', default=list(MODELS), choices=MODELS, help='Meta models to train, e.g. --models SSW')
+    pipeline.add_arguments(parser)
+    args = parser.parse_args()
+    institution, seed = args.hospital, args.seed
+    utils.configure_explanations(args.shap_backend, args.explain, args.dpn_backend)
+    pipeline.configure(args)
     # institution, seed = int(input("Please choose a hospital: 1 for Taiwan, 2 for US (SEER Database): ")), 42
-    
-    df = pd.read_csv(f'middle_{institution}.csv')
 
-    trainset, testset = train_test_split(df, test_size=0.33, stratify=df['Outcome'], random_state=seed)
+    if args.seeds:
+        ssw_sweep(institution, args.seeds, args.ssw_engine, args.workers, args.stage_dir, results_store.run_config(args))
+        return
 
-    x_train, y_train = trainset.drop(columns=['Outcome']), trainset['Outcome']
-    x_test, y_test = testset.drop(columns=['Outcome']), testset['Outcome']
+    if args.folds > 1:
+        cross_validate(args)
+        return
 
-    df_init = pd.read_csv(f'init_{institution}.csv')
-    auc_global = df_init['global auroc'].iloc[0]
-    auc_local = df_init['local auroc'].iloc[0]
+    handoff = load_stage(institution, args.stage_dir)
+    auc_global, auc_local = handoff.auc_global, handoff.auc_local
+    x_train, y_train, x_test, y_test = split_stage(handoff, seed)
 
-    models = {
-        'SSW': SeeSawingWeights(epoch = 30, auc_global = auc_global, auc_local = auc_local),
-        'DPN': DualPerceptionNet(epoch = 300, learning_rate = 0.003)
-    }
+    meta_models = {name: build_meta_model(name, auc_global, auc_local, args) for name in MODELS if name in args.models}
 
     all_results = []
+    predictions = baseline_predictions(x_test)
 
-    for name, model in models.items():
+    for name, model in meta_models.items():
         training_time = model.fit(x_train, y_train, institution, seed)
-        result = evaluate_model(model, x_test, y_test, training_time)
+        predictions[name] = model.predict_proba(x_test)
+        result = evaluate_model(model, x_test, y_test, training_time, predictions[name])
         result['model'] = name
         all_results.append(result)
 
+    save_predictions(institution, seed, y_test, predictions)
+
     # Saving NSC Models Results 
-    hospital = 'Taiwan' if institution == 1 else 'USA'
-    all_results = pd.DataFrame(all_results)
-    all_results = all_results[['model', 'auroc', 'auprc', 'training time']]
-    all_results.rename(columns={'model': f'Model | {hospital} | seed={seed}'}, inplace=True)
-    all_results.to_csv('Results/Results_NSC.csv', mode='a', index=False)
-    print("results saved to Results_NSC.csv")
+    save_results(all_results, institution, seed, results_store.run_config(args))
 
 if __name__ == "__main__":
     main()
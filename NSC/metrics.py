@@ -0,0 +1,126 @@
+'''
+Metrics of the probability scores, all from one sort of the scores.
+
+    scores = metrics.Scores(y_test, proba)
+    scores.auroc, scores.auprc, scores.youden_threshold
+
+Same numbers as the sklearn calls they replace:
+    auroc            roc_auc_score(y, p)
+    auprc            auc(recall, precision) of precision_recall_curve(y, p), the trapezoid PR area
+    youden_threshold thresholds[argmax(tpr - fpr)] of roc_curve(y, p), inf when predicting nothing wins
+
+bootstrap() gives percentile confidence intervals of AUROC and AUPRC. The resamples are not
+materialised. Every resample is a vector of draw counts per row, and the metrics are weighted
+cumulative sums over the sorted score groups, so all resamples of a chunk are scored in a few array
+operations.
+'''
+import numpy as np
+
+
+def _groups(y_true, y_score):
+    # Descending distinct scores and the positive/negative count at each of them
+    y_true = np.asarray(y_true).astype(bool).ravel()
+    y_score = np.asarray(y_score, dtype=np.float64).ravel()
+    if len(y_true) != len(y_score):
+        raise ValueError(f"y_true and y_score have different lengths: {len(y_true)} vs {len(y_score)}")
+    order = np.argsort(-y_score, kind='mergesort')
+    score = y_score[order]
+    # First index of every run of equal scores
+    starts = np.flatnonzero(np.r_[True, score[1:] != score[:-1]])
+    group = np.cumsum(np.r_[True, score[1:] != score[:-1]]) - 1
+    return order, score[starts], group, y_true[order]
+
+
+def _auroc(tps, fps):
+    # Trapezoid area under (fps, tps) from (0, 0), normalised; tps/fps are cumulative, last axis
+    P, N = tps[..., -1:], fps[..., -1:]
+    tpr = np.concatenate([np.zeros_like(P), tps], axis=-1)
+    fpr = np.concatenate([np.zeros_like(N), fps], axis=-1)
+    area = np.sum(np.diff(fpr, axis=-1) * (tpr[..., 1:] + tpr[..., :-1]) / 2, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return area / (P[..., 0] * N[..., 0])
+
+
+def _auprc(tps, fps):
+    P = tps[..., -1:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        recall = tps / P
+        precision = np.where(tps + fps > 0, tps / np.where(tps + fps > 0, tps + fps, 1), 0.0)
+    recall = np.concatenate([np.zeros_like(P), recall], axis=-1)
+    precision = np.concatenate([np.ones_like(P), precision], axis=-1)
+    return np.sum(np.diff(recall, axis=-1) * (precision[..., 1:] + precision[..., :-1]) / 2, axis=-1)
+
+
+class Scores:
+    def __init__(self, y_true, y_score):
+        self.order, self.thresholds, self.group, positive = _groups(y_true, y_score)
+        n_groups = len(self.thresholds)
+        self.tps = np.cumsum(np.bincount(self.group, weights=positive, minlength=n_groups))
+        self.fps = np.cumsum(np.bincount(self.group, weights=~positive, minlength=n_groups))
+        self.positives, self.negatives = self.tps[-1], self.fps[-1]
+
+    @property
+    def auroc(self):
+        if self.positives == 0 or self.negatives == 0:
+            return None
+        return float(_auroc(self.tps, self.fps))
+
+    @property
+    def auprc(self):
+        if self.positives == 0:
+            return None
+        return float(_auprc(self.tps, self.fps))
+
+    def roc(self):
+        # fpr, tpr, thresholds with the (0, 0, inf) starting point, like roc_curve(drop_intermediate=False)
+        return (np.r_[0.0, self.fps / self.negatives], np.r_[0.0, self.tps / self.positives], np.r_[np.inf, self.thresholds])
+
+    @property
+    def youden_threshold(self):
+        if self.positives == 0 or self.negatives == 0:
+            return None
+        fpr, tpr, thresholds = self.roc()
+        # roc_curve drops the collinear points first, the first maximum has to come from the kept ones
+        fps, tps = np.r_[0.0, self.fps], np.r_[0.0, self.tps]
+        keep = np.flatnonzero(np.r_[True, np.logical_or(np.diff(fps, 2), np.diff(tps, 2)), True])
+        return float(thresholds[keep][np.argmax(tpr[keep] - fpr[keep])])
+
+    def predict(self, y_score):
+        return (np.asarray(y_score) >= self.youden_threshold).astype(int)
+
+    def summary(self):
+        return {'auroc': self.auroc, 'auprc': self.auprc, 'threshold': self.youden_threshold}
+
+
+def bootstrap(y_true, y_score, n_boot=1000, alpha=0.05, seed=None, chunk=200):
+    '''
+    Percentile bootstrap of AUROC and AUPRC. Returns {'auroc': (low, high), 'auprc': (low, high)} and the
+    per-resample values under 'samples'. Resamples without a positive or a negative are left out.
+    With the same seed, the resamples only depend on y_true, so the samples of two models scored on the
+    same rows are paired and can be subtracted.
+    '''
+    order, thresholds, group, positive = _groups(y_true, y_score)
+    n = len(order)
+    ends = np.flatnonzero(np.r_[group[1:] != group[:-1], True])
+    rng = np.random.default_rng(seed)
+    values = {'auroc': [], 'auprc': []}
+
+    for start in range(0, n_boot, chunk):
+        size = min(chunk, n_boot - start)
+        # Draw counts of every row in every resample, put in the sorted order. The draws are made on the
+        # original rows, so two score vectors of the same rows get the same resamples for the same seed
+        draws = rng.integers(0, n, size=(size, n)) + n*np.arange(size)[:, None]
+        counts = np.bincount(draws.ravel(), minlength=size*n).reshape(size, n)[:, order]
+        # Score groups are contiguous in the sorted order: cumulate per row, read at the group ends
+        tps = np.cumsum(counts * positive, axis=1)[:, ends]
+        fps = np.cumsum(counts * ~positive, axis=1)[:, ends]
+        valid = (tps[:, -1] > 0) & (fps[:, -1] > 0)
+        values['auroc'].append(_auroc(tps[valid], fps[valid]))
+        values['auprc'].append(_auprc(tps[valid], fps[valid]))
+
+    result = {'samples': {}}
+    for name, chunks in values.items():
+        samples = np.concatenate(chunks)
+        result['samples'][name] = samples
+        result[name] = tuple(np.quantile(samples, [alpha/2, 1 - alpha/2]).tolist()) if len(samples) else (None, None)
+    return result
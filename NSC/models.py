@@ -0,0 +1,57 @@
+'''
+Architectures of the small dense nets, buildable with Keras or with the NumPy trainer (numpy_nn.py).
+
+    model = models.build_model('baseline', x_train.shape[1], learning_rate=0.003, backend='numpy')
+    model.fit(x, y_one_hot, epochs=300, class_weight=class_weights,
+              callbacks=[models.reduce_lr_on_plateau(model, factor=0.5, patience=5, min_lr=0.000005)])
+
+Both backends have the same fit/predict/evaluate/get_weights/set_weights calls and the same weight
+layout, so a model can switch backend without touching the training code.
+'''
+BACKENDS = ('keras', 'numpy')
+
+# Hidden layers as (units, activation, dropout): Dense(activation) -> BatchNormalization -> Dropout,
+# followed by a Dense(2, softmax) output
+SPECS = {
+    # train.py federated/localized models and the server.py initial weights
+    'baseline': [(12, 'relu', 0.0), (6, 'relu', 0.2)],
+    # centralized-learning/centralized_learning.py
+    'centralized': [(12, 'relu', 0.0), (6, 'sigmoid', 0.2)],
+    # main.py DualPerceptionNet, on the 4 probabilities of middle_{institution}.csv
+    'dpn': [(8, 'relu', 0.1), (4, 'relu', 0.0)],
+}
+
+
+def build_model(spec, input_dim, learning_rate=0.001, backend='keras', seed=None):
+    layers = SPECS[spec] if isinstance(spec, str) else spec
+    if backend == 'numpy':
+        from numpy_nn import NumpyNet
+        return NumpyNet(input_dim, layers, learning_rate, seed)
+    if backend != 'keras':
+        raise ValueError(f"Unknown model backend: {backend}, choose from {BACKENDS}")
+
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Dense, Dropout, BatchNormalization
+    from tensorflow.keras.optimizers import Adam
+
+    model = Sequential()
+    for i, (units, activation, dropout) in enumerate(layers):
+        if i == 0:
+            model.add(Dense(units, activation=activation, input_shape=(input_dim,)))
+        else:
+            model.add(Dense(units, activation=activation))
+        model.add(BatchNormalization())
+        if dropout > 0:
+            model.add(Dropout(dropout))
+    model.add(Dense(2, activation='softmax'))
+    model.compile(optimizer=Adam(learning_rate=learning_rate), loss="categorical_crossentropy", metrics=['accuracy'])
+    return model
+
+
+def reduce_lr_on_plateau(model, **kwargs):
+    # The ReduceLROnPlateau callback matching the backend of model
+    from numpy_nn import NumpyNet, ReduceLROnPlateau
+    if isinstance(model, NumpyNet):
+        return ReduceLROnPlateau(**kwargs)
+    from tensorflow.keras.callbacks import ReduceLROnPlateau
+    return ReduceLROnPlateau(**kwargs)
@@ -0,0 +1,232 @@
+'''
+NumPy trainer for the small dense nets (models.py), a drop-in for the Keras Sequential they replace.
+
+Same layers and training rules as Keras:
+    hidden layer : Dense(activation) -> BatchNormalization -> Dropout (optional)
+    output       : Dense(2, softmax), categorical crossentropy, class_weight as per-sample weights
+    training     : Adam (epsilon-hat form of tf.keras), batch_size 32, reshuffled every epoch,
+                   BatchNormalization momentum 0.99 / epsilon 1e-3, glorot uniform kernels, zero biases
+    ReduceLROnPlateau on the epoch loss
+
+The nets are far too small for TensorFlow's per-batch dispatch to pay off, a whole training step here
+is a few dozen small array operations. get_weights/set_weights use the Keras order
+(kernel, bias, gamma, beta, moving mean, moving variance per hidden layer, then kernel, bias), so the
+weights can go to and from a Keras model and through the Flower server unchanged.
+'''
+import json
+import numpy as np
+
+ACTIVATIONS = ('relu', 'sigmoid')
+
+
+class History:
+    def __init__(self):
+        self.history = {'loss': [], 'accuracy': []}
+
+
+class ReduceLROnPlateau:
+    # Same rule as tf.keras.callbacks.ReduceLROnPlateau on a loss (mode 'min', cooldown 0)
+    def __init__(self, monitor='loss', factor=0.1, patience=10, min_lr=0.0, min_delta=1e-4):
+        if monitor != 'loss':
+            raise ValueError("NumpyNet only tracks the training loss")
+        self.factor = factor
+        self.patience = patience
+        self.min_lr = min_lr
+        self.min_delta = min_delta
+        self.best = np.inf
+        self.wait = 0
+
+    def on_epoch_end(self, model, loss):
+        if loss < self.best - self.min_delta:
+            self.best = loss
+            self.wait = 0
+            return
+        self.wait += 1
+        if self.wait >= self.patience:
+            if model.learning_rate > self.min_lr:
+                model.learning_rate = max(model.learning_rate * self.factor, self.min_lr)
+            self.wait = 0
+
+
+class NumpyNet:
+    '''
+    layers: [(units, activation, dropout), ...] hidden layers, every one followed by BatchNormalization
+    '''
+    momentum = 0.99
+    bn_epsilon = 1e-3
+    beta_1, beta_2, adam_epsilon = 0.9, 0.999, 1e-7
+
+    def __init__(self, input_dim, layers, learning_rate=0.001, seed=None):
+        self.input_dim = input_dim
+        self.layers = [(int(units), activation, float(dropout)) for units, activation, dropout in layers]
+        for _, activation, _ in self.layers:
+            if activation not in ACTIVATIONS:
+                raise ValueError(f"Unknown activation: {activation}, choose from {ACTIVATIONS}")
+        self.learning_rate = learning_rate
+        self.rng = np.random.default_rng(seed)
+
+        self.weights = []
+        fan_in = input_dim
+        for units, _, _ in self.layers:
+            self.weights += [self._glorot(fan_in, units), np.zeros(units, np.float32),
+                             np.ones(units, np.float32), np.zeros(units, np.float32),
+                             np.zeros(units, np.float32), np.ones(units, np.float32)]
+            fan_in = units
+        self.weights += [self._glorot(fan_in, 2), np.zeros(2, np.float32)]
+
+        # Adam state of the trainable arrays (everything but the moving mean/variance)
+        self.trainable = [i for i in range(len(self.weights)) if i >= 6*len(self.layers) or i % 6 < 4]
+        self._reset_optimizer()
+
+    @property
+    def output_shape(self):
+        return (None, 2)
+
+    def _glorot(self, fan_in, fan_out):
+        limit = np.sqrt(6 / (fan_in + fan_out))
+        return self.rng.uniform(-limit, limit, (fan_in, fan_out)).astype(np.float32)
+
+    def _reset_optimizer(self):
+        self.iterations = 0
+        self.m = {i: np.zeros_like(self.weights[i]) for i in self.trainable}
+        self.v = {i: np.zeros_like(self.weights[i]) for i in self.trainable}
+
+    def get_weights(self):
+        return [w.copy() for w in self.weights]
+
+    def set_weights(self, weights):
+        if len(weights) != len(self.weights):
+            raise ValueError(f"Expected {len(self.weights)} arrays, got {len(weights)}")
+        for w, new in zip(self.weights, weights):
+            if w.shape != np.shape(new):
+                raise ValueError(f"Weight shape mismatch: {w.shape} vs {np.shape(new)}")
+        self.weights = [np.array(w, dtype=np.float32) for w in weights]
+
+    ''''''''''''''''''''''''''''''''''''''''' Forward / backward '''''''''''''''''''''''''''''''''''''''''
+
+    def _forward(self, x, training):
+        cache = []
+        h = x
+        for l, (_, activation, dropout) in enumerate(self.layers):
+            W, b, gamma, beta, mean, var = self.weights[6*l:6*l + 6]
+            z = h @ W + b
+            a = np.maximum(z, 0) if activation == 'relu' else 1 / (1 + np.exp(-z))
+            if training:
+                batch_mean, batch_var = a.mean(axis=0), a.var(axis=0)
+                inv_std = 1 / np.sqrt(batch_var + self.bn_epsilon)
+                a_hat = (a - batch_mean) * inv_std
+                mean *= self.momentum
+                mean += (1 - self.momentum) * batch_mean
+                var *= self.momentum
+                var += (1 - self.momentum) * batch_var
+            else:
+                inv_std = 1 / np.sqrt(var + self.bn_epsilon)
+                a_hat = (a - mean) * inv_std
+            out = gamma * a_hat + beta
+            mask = None
+            if training and dropout > 0:
+                mask = (self.rng.random(out.shape) >= dropout).astype(np.float32) / (1 - dropout)
+                out = out * mask
+            cache.append((h, z, a, a_hat, inv_std, mask))
+            h = out
+        W, b = self.weights[-2:]
+        logits = h @ W + b
+        return logits, h, cache
+
+    @staticmethod
+    def _softmax(logits):
+        e = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return e / e.sum(axis=1, keepdims=True)
+
+    def _train_step(self, x, y, sample_weight):
+        n = len(x)
+        logits, h, cache = self._forward(x, training=True)
+        shifted = logits - logits.max(axis=1, keepdims=True)
+        log_prob = shifted - np.log(np.exp(shifted).sum(axis=1, keepdims=True))
+        # Keras SUM_OVER_BATCH_SIZE: weighted sum divided by the batch size
+        loss = float(-(sample_weight * (y * log_prob).sum(axis=1)).sum() / n)
+        correct = int((logits.argmax(axis=1) == y.argmax(axis=1)).sum())
+
+        grads = [None] * len(self.weights)
+        d = (np.exp(log_prob) - y) * (sample_weight / n)[:, None]
+        W = self.weights[-2]
+        grads[-2], grads[-1] = h.T @ d, d.sum(axis=0)
+        d = d @ W.T
+
+        for l in reversed(range(len(self.layers))):
+            _, activation, _ = self.layers[l]
+            h_in, z, a, a_hat, inv_std, mask = cache[l]
+            W, gamma = self.weights[6*l], self.weights[6*l + 2]
+            if mask is not None:
+                d = d * mask
+            grads[6*l + 2], grads[6*l + 3] = (d * a_hat).sum(axis=0), d.sum(axis=0)
+            d_hat = d * gamma
+            d = inv_std / n * (n * d_hat - d_hat.sum(axis=0) - a_hat * (d_hat * a_hat).sum(axis=0))
+            d = d * (z > 0) if activation == 'relu' else d * a * (1 - a)
+            grads[6*l], grads[6*l + 1] = h_in.T @ d, d.sum(axis=0)
+            d = d @ W.T
+
+        self.iterations += 1
+        t = self.iterations
+        lr_t = self.learning_rate * np.sqrt(1 - self.beta_2**t) / (1 - self.beta_1**t)
+        for i in self.trainable:
+            g = grads[i].astype(np.float32)
+            self.m[i] += (1 - self.beta_1) * (g - self.m[i])
+            self.v[i] += (1 - self.beta_2) * (g*g - self.v[i])
+            self.weights[i] -= (lr_t * self.m[i] / (np.sqrt(self.v[i]) + self.adam_epsilon)).astype(np.float32)
+        return loss, correct
+
+    ''''''''''''''''''''''''''''''''''''''''' Keras-like API '''''''''''''''''''''''''''''''''''''''''
+
+    def fit(self, x, y, epochs=1, batch_size=32, class_weight=None, callbacks=(), verbose=0, **kwargs):
+        x = np.asarray(x, dtype=np.float32)
+        y = np.asarray(y, dtype=np.float32)
+        labels = y.argmax(axis=1)
+        sample_weight = np.ones(len(x), dtype=np.float32)
+        if class_weight:
+            for label, weight in class_weight.items():
+                sample_weight[labels == int(label)] = weight
+
+        history = History()
+        for epoch in range(epochs):
+            order = self.rng.permutation(len(x))
+            total_loss, total_correct = 0.0, 0
+            for start in range(0, len(x), batch_size):
+                batch = order[start:start + batch_size]
+                loss, correct = self._train_step(x[batch], y[batch], sample_weight[batch])
+                total_loss += loss * len(batch)
+                total_correct += correct
+            epoch_loss = total_loss / len(x)
+            history.history['loss'].append(epoch_loss)
+            history.history['accuracy'].append(total_correct / len(x))
+            for callback in callbacks:
+                callback.on_epoch_end(self, epoch_loss)
+            if verbose:
+                print(f"Epoch {epoch + 1}/{epochs} - loss: {epoch_loss:.4f} - accuracy: {total_correct / len(x):.4f}")
+        return history
+
+    def __call__(self, x, training=False):
+        logits, _, _ = self._forward(np.asarray(x, dtype=np.float32), training)
+        return self._softmax(logits)
+
+    def predict(self, x, batch_size=None, **kwargs):
+        return self(x)
+
+    def evaluate(self, x, y, **kwargs):
+        prob = np.clip(self(x), 1e-7, 1 - 1e-7)
+        y = np.asarray(y, dtype=np.float32)
+        loss = float(-(y * np.log(prob)).sum(axis=1).mean())
+        accuracy = float((prob.argmax(axis=1) == y.argmax(axis=1)).mean())
+        return [loss, accuracy]
+
+    def save(self, path):
+        spec = {'input_dim': self.input_dim, 'layers': self.layers, 'learning_rate': self.learning_rate}
+        np.savez(path, spec=np.array(json.dumps(spec)), *self.weights)
+
+
+def load_model(path):
+    with np.load(path) as data:
+        spec = json.loads(str(data['spec']))
+        model = NumpyNet(spec['input_dim'], spec['layers'], spec['learning_rate'])
+        model.set_weights([data[f'arr_{i}'] for i in range(len(model.weights))])
+    return model
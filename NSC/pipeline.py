@@ -0,0 +1,103 @@
+'''
+Input pipeline of the DPN and localized learning runs.
+
+The frames are converted to float32 once, then fed to Keras through a cached and prefetched
+tf.data.Dataset that is reshuffled every epoch. The NumPy trainer (numpy_nn.py) gets the float32
+arrays directly. Every fit reports its throughput in samples/sec.
+
+    --batch-size         samples per training step (default 32, the Keras default used before)
+    --intra-op-threads   threads inside one TensorFlow op (0: TensorFlow default)
+    --inter-op-threads   TensorFlow ops run in parallel (0: TensorFlow default)
+'''
+import time
+import numpy as np
+
+batch_size = 32
+
+
+def add_arguments(parser):
+    parser.add_argument('--batch-size', type=int, default=32, help='Samples per training step of the DPN/localized nets')
+    parser.add_argument('--intra-op-threads', type=int, default=0, help='TensorFlow intra-op threads (0: default)')
+    parser.add_argument('--inter-op-threads', type=int, default=0, help='TensorFlow inter-op threads (0: default)')
+    return parser
+
+
+def configure(args):
+    global batch_size
+    batch_size = args.batch_size
+    if args.intra_op_threads or args.inter_op_threads:
+        # Has to happen before TensorFlow runs its first op, so TensorFlow is imported right here
+        import tensorflow as tf
+        if args.intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(args.intra_op_threads)
+        if args.inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(args.inter_op_threads)
+
+
+def as_float32(x):
+    return np.ascontiguousarray(np.asarray(x, dtype=np.float32))
+
+
+def make_dataset(x, y, batch_size=32, shuffle=True, seed=None):
+    import tensorflow as tf
+    x, y = as_float32(x), as_float32(y)
+    dataset = tf.data.Dataset.from_tensor_slices((x, y)).cache()
+    if shuffle:
+        dataset = dataset.shuffle(len(x), seed=seed, reshuffle_each_iteration=True)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+class Throughput:
+    # Samples/sec of every epoch, as a Keras callback or called by hand
+    def __init__(self, n_samples, name=''):
+        self.n_samples = n_samples
+        self.name = name
+        self.rates = []
+        self._start = None
+
+    def on_epoch_begin(self, *args, **kwargs):
+        self._start = time.perf_counter()
+
+    def on_epoch_end(self, *args, **kwargs):
+        self.rates.append(self.n_samples / (time.perf_counter() - self._start))
+
+    def report(self):
+        if self.rates:
+            # The first epoch also builds the graph and fills the cache, it is left out of the steady rate
+            steady = self.rates[1:] or self.rates
+            print(f"{self.name}: {np.median(steady):,.0f} samples/s (first epoch {self.rates[0]:,.0f})")
+        return self.rates
+
+
+def _keras_throughput(n_samples, name):
+    from tensorflow.keras.callbacks import Callback
+
+    class KerasThroughput(Throughput, Callback):
+        def __init__(self):
+            Throughput.__init__(self, n_samples, name)
+            Callback.__init__(self)
+
+    return KerasThroughput()
+
+
+def fit(model, x, y, epochs, class_weight=None, callbacks=(), name='', batch_size=None, seed=None):
+    '''
+    model.fit through the input pipeline. y is the one hot matrix. Returns the Keras-like history,
+    with the samples/sec of every epoch under history.history['samples_per_sec'].
+    '''
+    from numpy_nn import NumpyNet
+    batch_size = batch_size or globals()['batch_size']
+    x, y = as_float32(x), as_float32(y)
+
+    if isinstance(model, NumpyNet):
+        start_time = time.perf_counter()
+        history = model.fit(x, y, epochs=epochs, batch_size=batch_size, class_weight=class_weight, callbacks=list(callbacks))
+        throughput = Throughput(len(x) * epochs, name)
+        throughput.rates = [len(x) * epochs / (time.perf_counter() - start_time)]
+    else:
+        throughput = _keras_throughput(len(x), name)
+        dataset = make_dataset(x, y, batch_size, seed=seed)
+        history = model.fit(dataset, epochs=epochs, class_weight=class_weight, callbacks=list(callbacks) + [throughput])
+
+    history.history['samples_per_sec'] = throughput.report()
+    return history
@@ -0,0 +1,215 @@
+'''
+Confidence intervals and significance tests of the four models, per seed and across seeds.
+
+main.py keeps the test probabilities of every run, one NPZ per (hospital, seed), and one per
+(hospital, seed, K) for the out-of-fold probabilities over all rows of main.py --folds=K:
+
+    Results/predictions/<hospital>_<seed>.npz, <hospital>_<seed>_k<K>.npz
+        y                   test outcome of the meta split (every stage row with --folds)
+        Federated Learning  global model yes prob (column 0 of middle_{institution}.csv)
+        Localized Learning  local model yes prob (column 2)
+        SSW, DPN            yes prob of the meta models that were trained
+
+Per seed, every model gets bootstrap CIs of AUROC/AUPRC (metrics.bootstrap, the resamples are shared by
+all models so the AUROC differences are paired too) and every pair of models a DeLong test. The DeLong
+covariance is the fast one of Sun & Xu (2014): one midrank per model instead of the n_pos x n_neg
+comparison matrix. Across seeds, the AUROC/AUPRC stored in Results/results.db (results_store.py) get a
+mean, std and a bootstrap CI of the mean, per run configuration (config_hash).
+
+    python report.py --hospital=Taiwan [--seeds=10-44] [--n-boot=2000] [--output=Results/report]
+'''
+import os
+import glob
+import math
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+import fileio
+import metrics
+import results_store
+
+PREDICTIONS_DIR = os.path.join('Results', 'predictions')
+MODELS = ('Federated Learning', 'Localized Learning', 'SSW', 'DPN')
+
+
+''''''''''''''''''''''''''''''''''''''''' Prediction vectors '''''''''''''''''''''''''''''''''''''''''
+
+def predictions_path(hospital, seed, predictions_dir=PREDICTIONS_DIR, folds=1):
+    # folds > 1: the out-of-fold run of main.py --folds, kept apart from the single split run of the seed
+    suffix = f'_k{folds}' if folds > 1 else ''
+    return os.path.join(predictions_dir, f'{hospital}_{seed}{suffix}.npz')
+
+
+def save_predictions(hospital, seed, y, predictions, predictions_dir=PREDICTIONS_DIR, folds=1):
+    # predictions: {model name: yes probabilities of the test rows}
+    os.makedirs(predictions_dir, exist_ok=True)
+    path = predictions_path(hospital, seed, predictions_dir, folds)
+    arrays = {name: np.asarray(prob, dtype=np.float64).ravel() for name, prob in predictions.items()}
+    arrays['y'] = np.asarray(y).astype(np.int8).ravel()
+    # np.savez appends .npz to a name without it, so the temporary name keeps the extension
+    with fileio.atomic_path(path, suffix='.npz') as tmp_path:
+        np.savez_compressed(tmp_path, **arrays)
+    return path
+
+
+def load_predictions(hospital, seed, predictions_dir=PREDICTIONS_DIR, folds=1):
+    with np.load(predictions_path(hospital, seed, predictions_dir, folds)) as data:
+        y = data['y']
+        return y, {name: data[name] for name in MODELS if name in data.files}
+
+
+def seeds(hospital, predictions_dir=PREDICTIONS_DIR, folds=1):
+    prefix, suffix = f'{hospital}_', f'_k{folds}' if folds > 1 else ''
+    found = []
+    for path in glob.glob(os.path.join(glob.escape(predictions_dir), f'{glob.escape(prefix)}*{suffix}.npz')):
+        name = os.path.basename(path)
+        seed = name[len(prefix):len(name) - len(suffix) - 4]
+        if seed.isdigit():
+            found.append(int(seed))
+    return sorted(found)
+
+
+''''''''''''''''''''''''''''''''''''''''' DeLong '''''''''''''''''''''''''''''''''''''''''
+
+def midrank(x):
+    # 1-based ranks of x, ties get the mean of their ranks
+    x = np.asarray(x)
+    order = np.argsort(x, kind='mergesort')
+    xs = x[order]
+    starts = np.flatnonzero(np.r_[True, xs[1:] != xs[:-1]])
+    ends = np.r_[starts[1:], len(x)]
+    ranks = np.empty(len(x))
+    ranks[order] = np.repeat((starts + ends + 1) / 2, ends - starts)
+    return ranks
+
+
+def delong(y, scores):
+    '''
+    AUROC of every row of scores (models x samples) and their DeLong covariance matrix.
+    '''
+    y = np.asarray(y).astype(bool)
+    scores = np.atleast_2d(np.asarray(scores, dtype=np.float64))
+    positives, negatives = scores[:, y], scores[:, ~y]
+    m, n = positives.shape[1], negatives.shape[1]
+    if m == 0 or n == 0:
+        raise ValueError("DeLong needs both positive and negative samples")
+
+    tx = np.array([midrank(s) for s in positives])
+    ty = np.array([midrank(s) for s in negatives])
+    tz = np.array([midrank(s) for s in np.hstack([positives, negatives])])
+
+    aucs = tz[:, :m].sum(axis=1) / (m * n) - (m + 1) / (2 * n)
+    v01 = (tz[:, :m] - tx) / n
+    v10 = 1 - (tz[:, m:] - ty) / m
+    cov = np.atleast_2d(np.cov(v01)) / m + np.atleast_2d(np.cov(v10)) / n
+    return aucs, cov
+
+
+def delong_test(y, predictions):
+    # Paired two-sided DeLong test of every pair of models
+    names = list(predictions)
+    aucs, cov = delong(y, np.vstack([predictions[name] for name in names]))
+    rows = []
+    for i, j in itertools.combinations(range(len(names)), 2):
+        var = cov[i, i] + cov[j, j] - 2 * cov[i, j]
+        z = (aucs[i] - aucs[j]) / math.sqrt(var) if var > 0 else 0.0
+        rows.append({'model a': names[i], 'model b': names[j], 'auroc a': aucs[i], 'auroc b': aucs[j],
+                     'auroc diff': aucs[i] - aucs[j], 'z': z, 'p': math.erfc(abs(z) / math.sqrt(2))})
+    return pd.DataFrame(rows)
+
+
+''''''''''''''''''''''''''''''''''''''''' Reports '''''''''''''''''''''''''''''''''''''''''
+
+def seed_report(hospital, seed, n_boot=2000, alpha=0.05, predictions_dir=PREDICTIONS_DIR, folds=1):
+    '''
+    (models, pairs) DataFrames of one seed: bootstrap CIs per model, and per pair of models the DeLong
+    test plus the bootstrap CI of the paired AUROC difference.
+    '''
+    y, predictions = load_predictions(hospital, seed, predictions_dir, folds)
+    boot = {name: metrics.bootstrap(y, prob, n_boot=n_boot, alpha=alpha, seed=seed) for name, prob in predictions.items()}
+
+    models = []
+    for name, prob in predictions.items():
+        scores = metrics.Scores(y, prob)
+        models.append({'hospital': hospital, 'seed': seed, 'model': name,
+                       'auroc': scores.auroc, 'auroc low': boot[name]['auroc'][0], 'auroc high': boot[name]['auroc'][1],
+                       'auprc': scores.auprc, 'auprc low': boot[name]['auprc'][0], 'auprc high': boot[name]['auprc'][1]})
+
+    pairs = delong_test(y, predictions)
+    low, high = [], []
+    for a, b in zip(pairs['model a'], pairs['model b']):
+        diff = boot[a]['samples']['auroc'] - boot[b]['samples']['auroc']
+        low.append(np.quantile(diff, alpha / 2))
+        high.append(np.quantile(diff, 1 - alpha / 2))
+    pairs['diff low'], pairs['diff high'] = low, high
+    pairs.insert(0, 'seed', seed)
+    pairs.insert(0, 'hospital', hospital)
+    return pd.DataFrame(models), pairs
+
+
+def cross_seed(results, n_boot=10000, alpha=0.05, seed=0):
+    '''
+    Mean, std and the bootstrap CI of the mean over seeds of every (hospital, stage, model, config_hash):
+    runs with other settings (e.g. --folds, another SSW engine) are summarised apart, never averaged
+    together. The last run of a seed counts when a seed was run more than once. All the resampled means
+    come from one matrix product.
+    '''
+    keys = ['hospital', 'stage', 'model', 'config_hash']
+    results = results.drop_duplicates(keys + ['seed'], keep='last')
+    rng = np.random.default_rng(seed)
+    rows = []
+    for (hospital, stage, model, config), group in results.groupby(keys, sort=False):
+        row = {'hospital': hospital, 'stage': stage, 'model': model, 'config_hash': config, 'seeds': len(group)}
+        counts = None
+        for metric in ('auroc', 'auprc'):
+            values = group[metric].to_numpy(dtype=np.float64)
+            if counts is None:
+                draws = rng.integers(0, len(values), size=(n_boot, len(values))) + len(values)*np.arange(n_boot)[:, None]
+                counts = np.bincount(draws.ravel(), minlength=n_boot*len(values)).reshape(n_boot, len(values))
+            means = counts @ values / len(values)
+            row[metric] = values.mean()
+            row[f'{metric} std'] = values.std(ddof=1) if len(values) > 1 else float('nan')
+            row[f'{metric} low'], row[f'{metric} high'] = np.quantile(means, [alpha / 2, 1 - alpha / 2])
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bootstrap CIs and DeLong tests of the stored predictions")
+    parser.add_argument('--hospital', required=True, choices=['Taiwan', 'USA'])
+    parser.add_argument('--seeds', default=None, help='e.g. 10-44 or 10,11,12 (default: all stored seeds)')
+    parser.add_argument('--n-boot', type=int, default=2000, help='Bootstrap resamples per seed')
+    parser.add_argument('--alpha', type=float, default=0.05, help='1 - confidence level')
+    parser.add_argument('--folds', type=int, default=1, help='Report the main.py --folds=K runs instead of the single split runs')
+    parser.add_argument('--predictions-dir', default=PREDICTIONS_DIR, help='Stored prediction vectors')
+    parser.add_argument('--db', default=results_store.DB_PATH, help='Results database')
+    parser.add_argument('--config-hash', default=None, help='Only the runs with these settings (see results_store.py query)')
+    parser.add_argument('--output', default=None, help='CSV prefix, writes <prefix>_models.csv, _pairs.csv and _seeds.csv')
+    args = parser.parse_args()
+
+    from utils import seed_range
+    seed_list = seed_range(args.seeds) if args.seeds else seeds(args.hospital, args.predictions_dir, args.folds)
+
+    tables = [seed_report(args.hospital, seed, args.n_boot, args.alpha, args.predictions_dir, args.folds) for seed in seed_list]
+    models = pd.concat([t[0] for t in tables], ignore_index=True) if tables else pd.DataFrame()
+    pairs = pd.concat([t[1] for t in tables], ignore_index=True) if tables else pd.DataFrame()
+    results = results_store.query(hospital=args.hospital, seeds=seed_range(args.seeds) if args.seeds else None,
+                                  config_hash=args.config_hash, path=args.db)
+    summary = cross_seed(results, alpha=args.alpha)
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        if len(pairs):
+            significant = pairs.assign(significant=pairs['p'] < args.alpha)
+            print(significant.groupby(['model a', 'model b'], sort=False).agg(seeds=('seed', 'size'), auroc_diff=('auroc diff', 'mean'),
+                                                                             median_p=('p', 'median'), significant=('significant', 'sum')))
+        print(summary)
+
+    if args.output:
+        models.to_csv(f'{args.output}_models.csv', index=False)
+        pairs.to_csv(f'{args.output}_pairs.csv', index=False)
+        summary.to_csv(f'{args.output}_seeds.csv', index=False)
+
+
+if __name__ == "__main__":
+    main()
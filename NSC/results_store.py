@@ -0,0 +1,240 @@
+'''
+SQLite store of the model results, one row per (run, model), instead of the appended CSV blocks of
+Results_Baseline.csv / Results_NSC.csv.
+
+    Results/results.db, table results
+        stage          'baseline' (train.py: Federated/Localized Learning) or 'nsc' (main.py: SSW/DPN)
+        model, hospital ('Taiwan'/'USA'), seed
+        auroc, auprc, threshold, training_time
+        config_hash    first 16 hex of the sha256 of the run settings that change the results
+        config         those settings as JSON
+        created        unix time of the insert
+        source         'train.py', 'main.py' or 'csv:<file>' for the imported legacy CSVs
+
+The database runs in WAL mode: parallel workers (the SSW sweep, both hospitals of train.py --simulate)
+each insert their rows in one short transaction and wait on the lock (busy timeout) instead of
+interleaving half written blocks like concurrent CSV appends.
+
+    python results_store.py import Results/Results_Baseline.csv Results/Results_NSC.csv
+    python results_store.py summary --hospital=Taiwan
+    python results_store.py query --model=SSW --seeds=10-44 --output=ssw.csv
+'''
+import os
+import csv
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import pandas as pd
+
+DB_PATH = os.path.join('Results', 'results.db')
+COLUMNS = ('stage', 'model', 'hospital', 'seed', 'auroc', 'auprc', 'threshold', 'training_time',
+           'config_hash', 'config', 'created', 'source')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    stage TEXT NOT NULL,
+    model TEXT NOT NULL,
+    hospital TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    auroc REAL,
+    auprc REAL,
+    threshold REAL,
+    training_time REAL,
+    config_hash TEXT NOT NULL,
+    config TEXT NOT NULL,
+    created REAL NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_lookup ON results (hospital, model, seed);
+CREATE INDEX IF NOT EXISTS results_config ON results (config_hash);
+'''
+
+# Command line options that do not change the results, left out of the config hash
+RUN_KEYS = ('hospital', 'seed', 'seeds', 'port', 'stage_dir', 'shap_backend', 'explain', 'workers', 'round_log',
+            'no_cache', 'simulate', 'models', 'intra_op_threads', 'inter_op_threads', 'func', 'command')
+
+
+def hospital_name(institution):
+    return 'Taiwan' if institution == 1 else 'USA'
+
+
+def connect(path=DB_PATH):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def run_config(args, ignore=RUN_KEYS):
+    # The settings of an argparse Namespace (or a dict) that go into the config hash
+    config = vars(args) if isinstance(args, argparse.Namespace) else dict(args or {})
+    return {key: value for key, value in sorted(config.items()) if key not in ignore}
+
+
+def config_hash(config):
+    text = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def record(results, stage, hospital, seed, config=None, source='', path=DB_PATH):
+    '''
+    Insert the results of one run. results: dicts with 'model' and any of auroc/auprc/threshold/training time.
+    All rows go in with one transaction.
+    '''
+    return record_runs([(seed, results)], stage, hospital, config, source, path)
+
+
+def record_runs(runs, stage, hospital, config=None, source='', path=DB_PATH):
+    # Several runs with the same settings (the seeds of a sweep) in one transaction. runs: (seed, results) pairs
+    config = run_config(config)
+    config_text, digest, created = json.dumps(config, sort_keys=True, default=str), config_hash(config), time.time()
+    rows = [(stage, result['model'], hospital, int(seed), _number(result.get('auroc')), _number(result.get('auprc')),
+             _number(result.get('threshold')), _number(result.get('training time', result.get('training_time'))),
+             digest, config_text, created, source) for seed, results in runs for result in results]
+    _insert(rows, path)
+    return digest
+
+
+def _number(value):
+    return None if value is None else float(value)
+
+
+def _insert(rows, path, replace_source=None):
+    connection = connect(path)
+    try:
+        # BEGIN IMMEDIATE takes the write lock up front, a second writer waits for the busy timeout
+        connection.execute('BEGIN IMMEDIATE')
+        if replace_source is not None:
+            connection.execute('DELETE FROM results WHERE source = ?', (replace_source,))
+        connection.executemany(f"INSERT INTO results ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+        connection.execute('COMMIT')
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+
+
+def query(model=None, hospital=None, seeds=None, stage=None, config_hash=None, latest=True, path=DB_PATH):
+    '''
+    Results as a DataFrame, filtered on what is given. latest: only the newest row of every
+    (stage, model, hospital, seed, config_hash), a rerun replaces the earlier one.
+    '''
+    where, params = [], []
+    for column, value in (('model', model), ('hospital', hospital), ('stage', stage), ('config_hash', config_hash)):
+        if value is not None:
+            where.append(f'{column} = ?')
+            params.append(value)
+    if seeds is not None:
+        seeds = [int(seed) for seed in seeds]
+        where.append(f"seed IN ({', '.join('?' * len(seeds))})")
+        params += seeds
+    if latest:
+        where.append('id IN (SELECT MAX(id) FROM results GROUP BY stage, model, hospital, seed, config_hash)')
+
+    sql = f"SELECT {', '.join(COLUMNS)} FROM results"
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    connection = connect(path)
+    try:
+        return pd.read_sql_query(sql + ' ORDER BY hospital, model, seed, id', connection, params=params)
+    finally:
+        connection.close()
+
+
+def summary(results):
+    # AUROC/AUPRC/training time per (hospital, stage, model, config): number of seeds, mean and std
+    return (results.groupby(['hospital', 'stage', 'model', 'config_hash'], sort=False)
+                   .agg(seeds=('seed', 'nunique'), auroc=('auroc', 'mean'), auroc_std=('auroc', 'std'),
+                        auprc=('auprc', 'mean'), auprc_std=('auprc', 'std'), training_time=('training_time', 'mean'))
+                   .reset_index())
+
+
+''''''''''''''''''''''''''''''''''''''''' Legacy CSVs '''''''''''''''''''''''''''''''''''''''''
+
+def read_legacy_csv(path):
+    '''
+    A Results_Baseline.csv / Results_NSC.csv file as one long table. Both files are appended blocks,
+    each block starts with its own "Model | <hospital> | seed=<seed>" header row.
+    '''
+    rows = []
+    with open(path, newline='') as f:
+        header = None
+        for line in csv.reader(f):
+            if not line:
+                continue
+            if line[0].startswith('Model |'):
+                _, hospital, seed = (part.strip() for part in line[0].split('|'))
+                header = (hospital, int(seed.split('=')[1]), line[1:])
+                continue
+            if header is None:
+                raise ValueError(f"{path}: result row before the first 'Model | <hospital> | seed=<seed>' header")
+            hospital, seed, columns = header
+            values = dict(zip(columns, line[1:]))
+            rows.append({'model': line[0], 'hospital': hospital, 'seed': seed,
+                         'auroc': values.get('auroc'), 'auprc': values.get('auprc'), 'training time': values.get('training time')})
+    return rows
+
+
+def import_csv(path, stage=None, db_path=DB_PATH):
+    '''
+    Import a legacy results CSV. Importing the same file again replaces its rows instead of adding them twice.
+    The legacy rows have no run settings, they all share the config hash of an empty config.
+    '''
+    if stage is None:
+        stage = 'baseline' if 'baseline' in os.path.basename(path).lower() else 'nsc'
+    source, created, empty = f'csv:{os.path.basename(path)}', time.time(), run_config({})
+    rows = [(stage, row['model'], row['hospital'], row['seed'], _number(row['auroc'] or None), _number(row['auprc'] or None),
+             None, _number(row['training time'] or None), config_hash(empty), json.dumps(empty), created, source)
+            for row in read_legacy_csv(path)]
+    _insert(rows, db_path, replace_source=source)
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Results store")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    importer = subparsers.add_parser('import', help='import legacy Results_*.csv files')
+    importer.add_argument('files', nargs='+', help='e.g. Results/Results_Baseline.csv Results/Results_NSC.csv')
+    importer.add_argument('--stage', default=None, choices=['baseline', 'nsc'], help='default: from the file name')
+
+    select = subparsers.add_parser('query', help='stored results')
+    totals = subparsers.add_parser('summary', help='mean/std over the seeds')
+    for sub in (select, totals):
+        sub.add_argument('--model', default=None, help="e.g. SSW, 'Federated Learning'")
+        sub.add_argument('--hospital', default=None, choices=['Taiwan', 'USA'])
+        sub.add_argument('--seeds', default=None, help='e.g. 10-44 or 10,11,12')
+        sub.add_argument('--stage', default=None, choices=['baseline', 'nsc'])
+        sub.add_argument('--config-hash', default=None, help='Only the runs with these settings')
+        sub.add_argument('--all', action='store_true', help='Keep the reruns of a seed, not only the latest run')
+        sub.add_argument('--output', default=None, help='CSV file for the table')
+    for sub in (importer, select, totals):
+        sub.add_argument('--db', default=DB_PATH, help='Results database')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        for path in args.files:
+            print(f"{path}: {import_csv(path, args.stage, args.db)} rows imported")
+        return
+
+    from utils import seed_range
+    table = query(args.model, args.hospital, seed_range(args.seeds) if args.seeds else None, args.stage,
+                  args.config_hash, latest=not args.all, path=args.db)
+    if args.command == 'summary':
+        table = summary(table)
+    else:
+        table = table.drop(columns=['config'])
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.max_rows', 200):
+        print(table)
+    if args.output:
+        table.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,129 @@
 '''
 This is the script for running multiple seeds at a time.
-If you want to test only one seed, you need to comment one line of code in each train.py and main.py. 
 
-If you use linux to run this file, please change the command from python to python3
+Every seed runs the whole pipeline: server.py and train.py for both hospitals, then main.py for both
+hospitals. Several seeds run at the same time, each one with its own stage folder (runs/seed_<seed>)
+for the middle/init files, so concurrent seeds never share a file. Every worker owns a fixed range of
+PORTS_PER_WORKER Flower server ports from --base-port on, so two seeds running at the same time never
+get the same port. A seed whose processes exit with an error (e.g. its server could not bind the port)
+is started again on the next port of its worker, up to --retries times.
+
+    python script.py --seeds=10-44 --workers=8 --retries=1 --base-port=6100
+
+The number of concurrent seeds defaults to the CPU count divided by the processes a seed keeps busy.
 '''
+import os
+import sys
+import time
+import queue
+import argparse
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils import seed_range
+
+# server.py and the two train.py clients run at the same time
+PROCESSES_PER_SEED = 3
+HOSPITALS = (1, 2)
+HERE = os.path.dirname(os.path.abspath(__file__))
+PORTS_PER_WORKER = 10
+
+
+def worker_port(base_port, worker, attempt):
+    # Port of a worker's attempt: the worker's own range, a retry moves on to the next port of it
+    return base_port + worker * PORTS_PER_WORKER + attempt % PORTS_PER_WORKER
+
+
+def start(script, args, log_path):
+    log = open(log_path, 'w')
+    process = subprocess.Popen([sys.executable, script] + args, cwd=HERE, stdout=log, stderr=subprocess.STDOUT)
+    process.log = log
+    return process
+
+
+def wait_all(processes, timeout):
+    # Exit codes of all processes. As soon as one fails (or the timeout passes) the others are killed,
+    # a server whose client died would otherwise wait for it forever.
+    deadline = None if timeout is None else time.time() + timeout
+    while any(process.poll() is None for process in processes):
+        failed = any(process.returncode for process in processes if process.returncode is not None)
+        if failed or (deadline is not None and time.time() > deadline):
+            for process in processes:
+                if process.poll() is None:
+                    process.kill()
+            break
+        time.sleep(0.5)
+
+    codes = [process.wait() for process in processes]
+    for process in processes:
+        process.log.close()
+    return codes
+
+
+def run_seed_once(seed, stage_dir, timeout, port):
+    common = [f'--seed={seed}', f'--port={port}', f'--stage-dir={stage_dir}']
+    log = lambda name: os.path.join(stage_dir, f'{name}.log')
+
+    processes = [start('server.py', common, log('server'))]
+    processes += [start('train.py', common + [f'--hospital={h}'], log(f'train_{h}')) for h in HOSPITALS]
+    codes = wait_all(processes, timeout)
+    if any(codes):
+        return f'federated stage exit codes {codes}'
+
+    processes = [start('main.py', common + [f'--hospital={h}'], log(f'main_{h}')) for h in HOSPITALS]
+    codes = wait_all(processes, timeout)
+    if any(codes):
+        return f'meta stage exit codes {codes}'
+    return None
+
+
+def run_seed(seed, retries, timeout, workers, base_port):
+    stage_dir = os.path.join(HERE, 'runs', f'seed_{seed}')
+    os.makedirs(stage_dir, exist_ok=True)
+
+    # workers: queue of the free worker numbers, the seed holds one (and its ports) while it runs
+    worker = workers.get()
+    try:
+        for attempt in range(retries + 1):
+            port = worker_port(base_port, worker, attempt)
+            error = run_seed_once(seed, stage_dir, timeout, port)
+            if error is None:
+                return seed, attempt, None
+            print(f'seed {seed}: attempt {attempt + 1} on port {port} failed ({error}), logs in {stage_dir}')
+        return seed, attempt, error
+    finally:
+        workers.put(worker)
+
+
+def main():
+    default_workers = max(1, (os.cpu_count() or 1) // PROCESSES_PER_SEED)
 
-for seed in range(10, 45):
-    process1 = subprocess.Popen(['python', 'server.py'])
+    parser = argparse.ArgumentParser(description="Run the full pipeline for many seeds in parallel")
+    parser.add_argument('--seeds', type=seed_range, default=list(range(10, 45)), help='Seed range, e.g. 10-44')
+    parser.add_argument('--workers', type=int, default=default_workers, help='Seeds running at the same time')
+    parser.add_argument('--retries', type=int, default=1, help='Extra attempts for a seed that fails')
+    parser.add_argument('--timeout', type=float, default=None, help='Seconds a stage may run before it is killed')
+    parser.add_argument('--base-port', type=int, default=6100, help=f'First Flower server port, worker i uses the {PORTS_PER_WORKER} ports from base + {PORTS_PER_WORKER}*i')
+    args = parser.parse_args()
 
-    process2 = subprocess.Popen(f'python train.py --seed={seed} --hospital=1', shell=True)
-    process3 = subprocess.Popen(f'python train.py --seed={seed} --hospital=2', shell=True)
+    start_time = time.time()
+    failed = []
+    workers = queue.Queue()
+    for worker in range(args.workers):
+        workers.put(worker)
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(run_seed, seed, args.retries, args.timeout, workers, args.base_port) for seed in args.seeds]
+        for future in as_completed(futures):
+            seed, attempt, error = future.result()
+            if error is None:
+                print(f'seed {seed}: done' + (f' after {attempt + 1} attempts' if attempt else ''))
+            else:
+                failed.append(seed)
 
-    process1.wait()
-    process2.wait()
-    process3.wait()
+    print(f'{len(args.seeds) - len(failed)}/{len(args.seeds)} seeds done in {time.time() - start_time:.0f} s with {args.workers} workers')
+    if failed:
+        print(f'failed seeds: {sorted(failed)}')
+        sys.exit(1)
 
-    process4 = subprocess.Popen(f'python main.py --seed={seed} --hospital=1', shell=True)
-    process5 = subprocess.Popen(f'python main.py --seed={seed} --hospital=2', shell=True)
 
-    process4.wait()
-    process5.wait()
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 import os
+import time
 import flwr as fl
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense, Dropout, BatchNormalization
+import numpy as np
+import pandas as pd
+import utils
+import codec
+import models
 
 os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
 
@@ -10,18 +14,168 @@ min_client = 2
 rounds = 5
 total_feature_number = 43
 
-def main() -> None:
-    
-    model = Sequential() 
-    model.add(Dense(12, activation = 'relu', input_shape = (total_feature_number,))) 
-    model.add(BatchNormalization())
-    model.add(Dense(6, activation = 'relu')) 
-    model.add(BatchNormalization())
-    model.add(Dropout(0.2))
-    model.add(Dense(2, activation = 'softmax'))
-    model.compile(optimizer = 'adam', loss = "categorical_crossentropy", metrics=['accuracy'])
-
-    strategy = fl.server.strategy.FedAdam(
+
+class RoundScheduler:
+    '''
+    fixed    : every round runs, with the local epochs of fit_config.
+    adaptive : follows the aggregated AUROC the clients return after every round. A round that improved
+               it by less than min_delta halves the local epochs of the next rounds (never below
+               min_epochs), and after patience such rounds in a row the remaining rounds are skipped.
+    '''
+    def __init__(self, mode='fixed', patience=2, min_delta=0.001, min_epochs=10):
+        self.mode = mode
+        self.patience = patience
+        self.min_delta = min_delta
+        self.min_epochs = min_epochs
+        self.best_auc = None
+        self.stale_rounds = 0
+        self.epoch_scale = 1.0
+        self.stopped_at = None
+        self.round_times = []
+        self.skipped = 0
+        self._round_start = None
+
+    @property
+    def stopped(self):
+        return self.stopped_at is not None
+
+    def start_round(self):
+        self._round_start = time.time()
+
+    def local_epochs(self, epochs):
+        if self.mode == 'fixed':
+            return epochs
+        return max(self.min_epochs, int(round(epochs * self.epoch_scale)))
+
+    def end_round(self, rnd, auc):
+        if self._round_start is not None:
+            self.round_times.append(time.time() - self._round_start)
+            self._round_start = None
+        if self.mode == 'fixed' or auc is None:
+            return
+
+        if self.best_auc is None or auc > self.best_auc + self.min_delta:
+            self.best_auc = auc
+            self.stale_rounds = 0
+            return
+
+        self.stale_rounds += 1
+        self.epoch_scale /= 2
+        if self.stale_rounds >= self.patience:
+            self.stopped_at = rnd
+            print(f"Round {rnd}: global AUROC plateaued at {self.best_auc:.4f}, skipping the remaining rounds")
+
+    def skip_round(self, rnd):
+        self.skipped += 1
+        saved = self.skipped * sum(self.round_times) / max(1, len(self.round_times))
+        print(f"Round {rnd}: skipped (stopped after round {self.stopped_at}), about {saved:.1f} s of training saved so far")
+
+
+class SpcancerStrategy(fl.server.strategy.FedAdam):
+    '''
+    FedAdam that decodes the compressed client updates (see codec.py) before aggregating them,
+    schedules the rounds with a RoundScheduler and logs the bytes received, the local epochs, the
+    round time and the aggregated evaluation metrics of every round.
+    '''
+    def __init__(self, codec_config=None, scheduler=None, round_log=None, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.codec_config = codec_config or codec.codec_config()
+        self.scheduler = scheduler or RoundScheduler()
+        self.round_log = round_log
+        self.seed = seed
+        self.sent_weights = None
+        self.rounds = {}
+
+    def configure_fit(self, rnd, parameters, client_manager):
+        # No client selected: flower cancels the round
+        if self.scheduler.stopped:
+            self.scheduler.skip_round(rnd)
+            return []
+
+        self.scheduler.start_round()
+        instructions = super().configure_fit(rnd, parameters, client_manager)
+        # Clients encode their update against exactly these weights
+        self.sent_weights = fl.common.parameters_to_weights(parameters)
+        config = dict(self.codec_config, local_epochs=self.scheduler.local_epochs(self.on_fit_config_fn(rnd)['local_epochs']))
+        for _, fit_ins in instructions:
+            fit_ins.config.update(config)
+
+        self.rounds[rnd] = {'codec': config['codec'], 'round': rnd, 'local_epochs': config['local_epochs']}
+        return instructions
+
+    def configure_evaluate(self, rnd, parameters, client_manager):
+        if self.scheduler.stopped and self.scheduler.stopped_at < rnd:
+            return []
+        return super().configure_evaluate(rnd, parameters, client_manager)
+
+    def aggregate_fit(self, rnd, results, failures):
+        bytes_sent = 0
+        for _, fit_res in results:
+            payload = fl.common.parameters_to_weights(fit_res.parameters)
+            bytes_sent += codec.payload_bytes(payload)
+            fit_res.parameters = fl.common.weights_to_parameters(codec.decode_weights(payload, self.sent_weights, self.codec_config))
+
+        bytes_raw = len(results) * codec.payload_bytes(self.sent_weights)
+        self.rounds.setdefault(rnd, {'round': rnd}).update(bytes_raw=bytes_raw, bytes_sent=bytes_sent)
+        if bytes_sent and self.codec_config['codec'] != 'none':
+            print(f"Round {rnd}: clients sent {bytes_sent} bytes, {bytes_raw} as float32 ({bytes_raw/bytes_sent:.1f}x smaller)")
+
+        return super().aggregate_fit(rnd, results, failures)
+
+    def aggregate_evaluate(self, rnd, results, failures):
+        loss, metrics = super().aggregate_evaluate(rnd, results, failures)
+        if not results:
+            return loss, metrics
+
+        # Weighted by the test size of every client, like the aggregated loss
+        examples = np.array([res.num_examples for _, res in results], dtype=float)
+        metrics = dict(metrics or {})
+        for name in ('auc', 'accuracy'):
+            values = [res.metrics.get(name) for _, res in results]
+            if all(value is not None for value in values):
+                metrics[name] = float(np.dot(values, examples) / examples.sum())
+
+        self.scheduler.end_round(rnd, metrics.get('auc'))
+        self.log_round(rnd, loss, metrics)
+        return loss, metrics
+
+    def log_round(self, rnd, loss, metrics):
+        row = self.rounds.setdefault(rnd, {'round': rnd})
+        round_time = self.scheduler.round_times[-1] if self.scheduler.round_times else None
+        row.update(seed=self.seed, round_time=round_time, loss=loss, **metrics)
+        if self.round_log:
+            pd.DataFrame([row]).to_csv(self.round_log, mode='a', index=False, header=not os.path.exists(self.round_log))
+
+
+def add_arguments(parser):
+    parser.add_argument('--codec', default='none', choices=codec.CODECS, help='Encoding of the client updates')
+    parser.add_argument('--topk-ratio', type=float, default=0.01, help='Share of entries the topk codec keeps')
+    parser.add_argument('--no-delta', action='store_true', help='Encode the weights instead of the delta to the global weights')
+    parser.add_argument('--no-error-feedback', action='store_true', help='Drop what the encoding loses instead of carrying it over')
+    parser.add_argument('--round-log', default='Results/rounds.csv', help='CSV with bytes, epochs, time and metrics per round')
+    parser.add_argument('--rounds', type=int, default=rounds, help='Number of rounds (the maximum with --schedule=adaptive)')
+    parser.add_argument('--schedule', default='fixed', choices=('fixed', 'adaptive'), help='Round and local epoch scheduling')
+    parser.add_argument('--patience', type=int, default=2, help='Rounds without AUROC gain before stopping (adaptive)')
+    parser.add_argument('--min-delta', type=float, default=0.001, help='Smallest AUROC gain that counts as progress (adaptive)')
+    parser.add_argument('--min-epochs', type=int, default=10, help='Fewest local epochs per round (adaptive)')
+    parser.add_argument('--nn-backend', default='keras', choices=models.BACKENDS, help='Trainer of the federated/localized nets')
+    parser.add_argument('--folds', type=int, default=1, help='K-fold out-of-fold training, one federation per fold (same value for server.py and train.py)')
+    return parser
+
+
+def build_strategy(args=None):
+    # Only the initial weights are used, both backends have the same layout
+    model = models.build_model('baseline', total_feature_number, backend = args.nn_backend if args is not None else 'keras')
+
+    options = {}
+    if args is not None:
+        options = dict(codec_config = codec.codec_config(args.codec, not args.no_delta, args.topk_ratio, not args.no_error_feedback),
+                       scheduler = RoundScheduler(args.schedule, args.patience, args.min_delta, args.min_epochs),
+                       round_log = args.round_log,
+                       seed = args.seed)
+
+    strategy = SpcancerStrategy(
+        **options,
         min_fit_clients = min_client,
         min_eval_clients = min_client,
         min_available_clients = min_client,
@@ -29,8 +183,16 @@ def main() -> None:
         on_evaluate_config_fn = evaluate_config,
         initial_parameters = fl.common.weights_to_parameters(model.get_weights())
     )
+    return strategy
+
+
+def main() -> None:
+    args = add_arguments(utils.build_argument_parser()).parse_args()
 
-    fl.server.start_server("127.0.0.1:6001", config={"num_rounds": rounds}, strategy=strategy)
+    # With --folds the clients train one federation per fold, each one starts from fresh weights
+    for fold in range(args.folds):
+        strategy = build_strategy(args)
+        fl.server.start_server(f"127.0.0.1:{args.port}", config={"num_rounds": args.rounds}, strategy=strategy)
     
 
 def fit_config(rounds: int):
@@ -0,0 +1,126 @@
+'''
+Store of the raw SHAP values behind the Results/shap/ plots, one compressed NPZ per (model, hospital, seed):
+
+    Results/shap/values/<model>_<hospital>_<seed>.npz
+        values      (classes, rows, features) float32 SHAP values
+        samples     (rows, features) explained rows
+        background  (background rows, features) background sample of the explainer
+        features    feature names
+        meta        JSON: model, hospital, seed, method, backend
+
+utils.featureInterpreter saves every explanation here. The figures can then be redrawn and cross-seed
+importance tables built without retraining anything:
+
+    python shap_store.py importance --model=DPN --hospital=Taiwan [--output=importance.csv]
+    python shap_store.py plot --model=DPN --hospital=Taiwan --seed=42
+'''
+import os
+import glob
+import json
+import argparse
+import numpy as np
+import pandas as pd
+import fileio
+
+STORE_DIR = os.path.join('Results', 'shap', 'values')
+
+
+class ShapEntry:
+    def __init__(self, values, samples, background, features, meta):
+        self.values = values
+        self.samples = samples
+        self.background = background
+        self.features = features
+        self.meta = meta
+
+    def frame(self, cls=1):
+        # SHAP values of one class as a DataFrame (rows x features)
+        return pd.DataFrame(self.values[cls], columns=self.features)
+
+    def samples_frame(self):
+        return pd.DataFrame(self.samples, columns=self.features)
+
+
+def entry_path(model, hospital, seed, store_dir=STORE_DIR):
+    return os.path.join(store_dir, f'{model}_{hospital}_{seed}.npz')
+
+
+def save(model, hospital, seed, shap_values, samples, background, method='', backend='', store_dir=STORE_DIR):
+    os.makedirs(store_dir, exist_ok=True)
+    features = list(samples.columns) if hasattr(samples, 'columns') else [str(i) for i in range(np.shape(samples)[1])]
+    meta = {'model': model, 'hospital': hospital, 'seed': int(seed), 'method': method, 'backend': backend}
+    path = entry_path(model, hospital, seed, store_dir)
+    # np.savez appends .npz to a name without it, so the temporary name keeps the extension
+    with fileio.atomic_path(path, suffix='.npz') as tmp_path:
+        np.savez_compressed(tmp_path,
+                            values=np.stack([np.asarray(v, dtype=np.float32) for v in shap_values]),
+                            samples=np.asarray(samples, dtype=np.float32),
+                            background=np.asarray(background, dtype=np.float32),
+                            features=np.array(features),
+                            meta=np.array(json.dumps(meta)))
+    return path
+
+
+def load(model, hospital, seed, store_dir=STORE_DIR):
+    with np.load(entry_path(model, hospital, seed, store_dir)) as data:
+        return ShapEntry(data['values'], data['samples'], data['background'], data['features'].tolist(), json.loads(str(data['meta'])))
+
+
+def seeds(model, hospital, store_dir=STORE_DIR):
+    prefix = f'{model}_{hospital}_'
+    found = []
+    for path in glob.glob(os.path.join(glob.escape(store_dir), f'{glob.escape(prefix)}*.npz')):
+        seed = os.path.basename(path)[len(prefix):-4]
+        if seed.isdigit():
+            found.append(int(seed))
+    return sorted(found)
+
+
+def mean_abs(model, hospital, seed_list=None, cls=1, store_dir=STORE_DIR):
+    '''
+    Mean |SHAP| of every feature (rows) per seed (columns), plus the mean and std over the seeds,
+    sorted by the mean. Features missing for a seed are NaN there.
+    '''
+    seed_list = seeds(model, hospital, store_dir) if seed_list is None else seed_list
+    if not seed_list:
+        raise FileNotFoundError(f"No SHAP values stored for {model} | {hospital} in {store_dir}")
+    table = pd.DataFrame({seed: pd.Series(np.abs(entry.values[cls]).mean(axis=0), index=entry.features)
+                          for seed in seed_list for entry in [load(model, hospital, seed, store_dir)]})
+    table['mean'] = table[seed_list].mean(axis=1)
+    table['std'] = table[seed_list].std(axis=1)
+    return table.sort_values('mean', ascending=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stored SHAP values")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    importance = subparsers.add_parser('importance', help='mean |SHAP| per feature across seeds')
+    importance.add_argument('--model', required=True, help="e.g. DPN, 'Federated Learning'")
+    importance.add_argument('--hospital', required=True, choices=['Taiwan', 'USA'])
+    importance.add_argument('--seeds', default=None, help='e.g. 10-44 or 10,11,12 (default: all stored seeds)')
+    importance.add_argument('--output', default=None, help='CSV file for the table')
+
+    plot = subparsers.add_parser('plot', help='redraw the summary plot of one seed')
+    plot.add_argument('--model', required=True)
+    plot.add_argument('--hospital', required=True, choices=['Taiwan', 'USA'])
+    plot.add_argument('--seed', type=int, required=True)
+
+    for sub in (importance, plot):
+        sub.add_argument('--store-dir', default=STORE_DIR, help='SHAP store folder')
+    args = parser.parse_args()
+
+    if args.command == 'importance':
+        from utils import seed_range
+        table = mean_abs(args.model, args.hospital, seed_range(args.seeds) if args.seeds else None, store_dir=args.store_dir)
+        print(table[['mean', 'std']])
+        if args.output:
+            table.to_csv(args.output)
+    else:
+        import utils
+        entry = load(args.model, args.hospital, args.seed, args.store_dir)
+        utils.plot_shap_summary(entry.values[1], entry.samples_frame(), args.model, args.hospital, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+'''
+In-process Flower federation.
+
+The server.py strategy and the SpcancerClient of every hospital run inside one process: no server.py,
+no gRPC, no sockets. The flower Server loop is the same one start_server runs, only the client proxies
+call the NumPyClient directly instead of sending the weights over the network.
+
+    federation = InProcessServer(server.build_strategy(), server.rounds, server.min_client)
+    federation.connect(client)   # instead of fl.client.start_numpy_client(...)
+'''
+import threading
+import flwr as fl
+from flwr.server.client_proxy import ClientProxy
+from flwr.server.client_manager import SimpleClientManager
+
+
+class InProcessClientProxy(ClientProxy):
+    # The weights still go through Parameters (as bytes in memory), so the strategy sees exactly
+    # what it would receive over gRPC
+    def __init__(self, cid, client):
+        super().__init__(cid)
+        self.client = client
+
+    def get_parameters(self, *args, **kwargs):
+        weights = self.client.get_parameters()
+        return fl.common.ParametersRes(parameters=fl.common.weights_to_parameters(weights))
+
+    def get_properties(self, *args, **kwargs):
+        return fl.common.PropertiesRes(properties={})
+
+    def fit(self, ins, *args, **kwargs):
+        weights, num_examples, metrics = self.client.fit(fl.common.parameters_to_weights(ins.parameters), ins.config)
+        return fl.common.FitRes(parameters=fl.common.weights_to_parameters(weights), num_examples=num_examples, metrics=metrics)
+
+    def evaluate(self, ins, *args, **kwargs):
+        loss, num_examples, metrics = self.client.evaluate(fl.common.parameters_to_weights(ins.parameters), ins.config)
+        return fl.common.EvaluateRes(loss=float(loss), num_examples=num_examples, metrics=metrics)
+
+    def reconnect(self, *args, **kwargs):
+        return fl.common.Disconnect(reason="")
+
+
+class InProcessServer:
+    '''
+    connect(client) blocks like fl.client.start_numpy_client does. Once num_clients clients are
+    connected, the thread of the last one runs the server rounds and all of them return afterwards.
+    abort(error) makes the waiting and the later connect() calls raise instead.
+    '''
+    def __init__(self, strategy, num_rounds, num_clients):
+        self.strategy = strategy
+        self.num_rounds = num_rounds
+        self.num_clients = num_clients
+        self.client_manager = SimpleClientManager()
+        self.history = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._error = None
+
+    def abort(self, error):
+        # A hospital failed outside the federation (data, encoder, an earlier fold): release the
+        # clients waiting for it instead of letting them wait forever
+        with self._lock:
+            if self._done.is_set():
+                return
+            self._error = error
+        self._done.set()
+
+    def connect(self, client):
+        with self._lock:
+            if self._error is not None:
+                raise RuntimeError("In-process federation was aborted") from self._error
+            cid = str(len(self.client_manager.all()))
+            self.client_manager.register(InProcessClientProxy(cid, client))
+            last = len(self.client_manager.all()) == self.num_clients
+
+        if not last:
+            self._done.wait()
+            if self._error is not None:
+                raise RuntimeError("In-process federation failed") from self._error
+            return self.history
+
+        try:
+            server = fl.server.Server(client_manager=self.client_manager, strategy=self.strategy)
+            self.history = server.fit(num_rounds=self.num_rounds)
+        except BaseException as error:
+            self._error = error
+            raise
+        finally:
+            self._done.set()
+        return self.history
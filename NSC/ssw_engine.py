@@ -0,0 +1,200 @@
+'''
+Array engine for the seesawing weights (SSW) meta-learner.
+
+The SSW rule is order dependent: a misclassified row moves ser_weight/loc_weight before the next
+row is scored. Everything else in the rule (the true-class probabilities, the epsilon cases, the size
+and the direction of the weight step) only depends on the row itself, so it is computed once here in
+array form. What is left per epoch is a tight recurrence over plain floats.
+
+Engines
+    'numpy' : sequential-equivalent. Gives bit-identical weights and per-epoch loss to the original
+              iterrows loop (kept in main.SeeSawingWeights as engine='loop').
+    'numba' : the same sequential recurrence compiled with numba (@njit), bit-identical as well. Falls
+              back to 'numpy' when numba is not installed.
+    'batch' : fully vectorised. Every row of an epoch is scored with the weights from the start of
+              the epoch and all the steps of the misclassified rows are applied at once. This is NOT
+              the original rule, the weights drift apart from it after the first epoch.
+'''
+import math
+import warnings
+import numpy as np
+
+ENGINES = ('loop', 'numpy', 'numba', 'batch')
+
+
+class SSWInputs:
+    '''
+    Per-row quantities of the SSW rule that do not depend on the weights.
+    probs columns: global yes, global no, local yes, local no (same order as middle_{institution}.csv)
+    '''
+    def __init__(self, X, y):
+        probs = np.ascontiguousarray(np.asarray(X, dtype=np.float64))
+        if probs.ndim != 2 or probs.shape[1] != 4:
+            raise ValueError(f"SSW expects 4 probability columns, got shape {probs.shape}")
+
+        self.probs = probs
+        self.positive = np.asarray(y) == 1
+
+        g_yes, g_no, l_yes, l_no = probs[:, 0], probs[:, 1], probs[:, 2], probs[:, 3]
+        cg = np.where(self.positive, g_yes, g_no)
+        cl = np.where(self.positive, l_yes, l_no)
+
+        # 0 if the model gives the true class the highest probability, otherwise 1
+        eps_global = np.ceil(np.maximum(g_yes, g_no) - cg)
+        eps_local = np.ceil(np.maximum(l_yes, l_no) - cl)
+        epsilon = eps_global*(1-eps_local) + eps_local*(1-eps_global)
+
+        # math.exp instead of np.exp, numpy's exp may differ from libm in the last bit
+        exponent = np.where(epsilon == 1, np.abs(cl+cg)/2, np.abs(cl-cg)/2)
+        self.step_base = np.fromiter(map(math.exp, exponent.tolist()), dtype=np.float64, count=len(exponent))
+
+        # +1: move weight to the server (global) model, -1: move weight to the local model
+        both_right = (eps_global == 0) & (eps_local == 0)
+        both_wrong = (eps_global == 1) & (eps_local == 1)
+        to_local = (both_right & (cl > cg)) | (both_wrong & (cl < cg)) | ((eps_global == 1) & (eps_local == 0))
+        self.direction = np.where(to_local, -1.0, 1.0)
+
+    def __len__(self):
+        return len(self.probs)
+
+
+def learning_rates(n_rows, epoch, convergence_number):
+    # Same scheduler as the original loop: lr starts at 1/n and decays every epoch
+    lr = 1/n_rows
+    rates = []
+    for cur in range(epoch):
+        lr *= math.exp(-cur/convergence_number)
+        rates.append(lr)
+    return rates
+
+
+def run_sequential(inputs, ser_weight, loc_weight, rates):
+    g_yes, g_no, l_yes, l_no = (inputs.probs[:, i].tolist() for i in range(4))
+    positive = inputs.positive.tolist()
+    losses = []
+
+    for lr in rates:
+        # lr * (...) is exactly the delta_weights of the original rule
+        steps = (inputs.direction * (lr * inputs.step_base)).tolist()
+        loss = 0
+        for i in range(len(steps)):
+            yes_prob = ser_weight*g_yes[i] + loc_weight*l_yes[i]
+            no_prob = ser_weight*g_no[i] + loc_weight*l_no[i]
+            if positive[i]:
+                loss += no_prob
+                wrong = yes_prob < no_prob
+            else:
+                loss += yes_prob
+                wrong = yes_prob >= no_prob
+            if wrong:
+                ser_weight += steps[i]
+                loc_weight -= steps[i]
+        losses.append(loss)
+
+    return ser_weight, loc_weight, losses
+
+
+def _sequential_kernel(probs, positive, direction, step_base, rates, ser_weight, loc_weight):
+    # Same recurrence as run_sequential, written over arrays so that numba can compile it.
+    # No fastmath: the multiply/add order has to stay exactly the one of the original loop.
+    losses = np.empty(len(rates))
+    for e in range(len(rates)):
+        lr = rates[e]
+        loss = 0.0
+        for i in range(probs.shape[0]):
+            yes_prob = ser_weight*probs[i, 0] + loc_weight*probs[i, 2]
+            no_prob = ser_weight*probs[i, 1] + loc_weight*probs[i, 3]
+            if positive[i]:
+                loss += no_prob
+                wrong = yes_prob < no_prob
+            else:
+                loss += yes_prob
+                wrong = yes_prob >= no_prob
+            if wrong:
+                step = direction[i] * (lr * step_base[i])
+                ser_weight += step
+                loc_weight -= step
+        losses[e] = loss
+    return ser_weight, loc_weight, losses
+
+
+_compiled_kernel = None
+
+
+def run_numba(inputs, ser_weight, loc_weight, rates):
+    global _compiled_kernel
+    # numba is imported and the kernel compiled on first use only, so importing this module stays cheap
+    if _compiled_kernel is None:
+        try:
+            from numba import njit
+        except ImportError:
+            warnings.warn("numba is not installed, the SSW 'numba' engine falls back to 'numpy'")
+            return run_sequential(inputs, ser_weight, loc_weight, rates)
+        _compiled_kernel = njit(cache=True)(_sequential_kernel)
+
+    ser_weight, loc_weight, losses = _compiled_kernel(inputs.probs, inputs.positive, inputs.direction, inputs.step_base,
+                                                      np.asarray(rates, dtype=np.float64), float(ser_weight), float(loc_weight))
+    return ser_weight, loc_weight, losses.tolist()
+
+
+def run_batch(inputs, ser_weight, loc_weight, rates):
+    probs = inputs.probs
+    losses = []
+
+    for lr in rates:
+        yes_prob = ser_weight*probs[:, 0] + loc_weight*probs[:, 2]
+        no_prob = ser_weight*probs[:, 1] + loc_weight*probs[:, 3]
+        wrong = np.where(inputs.positive, yes_prob < no_prob, yes_prob >= no_prob)
+        losses.append(float(np.sum(np.where(inputs.positive, no_prob, yes_prob))))
+
+        step = float(np.sum(inputs.direction[wrong] * (lr * inputs.step_base[wrong])))
+        ser_weight += step
+        loc_weight -= step
+
+    return ser_weight, loc_weight, losses
+
+
+''''''''''''''''''''''''''''''''''''''''' Inference '''''''''''''''''''''''''''''''''''''''''
+
+def weight_matrix(ser_weight, loc_weight):
+    # probs @ W gives [no prob, yes prob] per row, the same column order as the Keras softmax output
+    return np.array([[0.0, ser_weight],
+                     [ser_weight, 0.0],
+                     [0.0, loc_weight],
+                     [loc_weight, 0.0]])
+
+
+def predict_proba(X, ser_weight, loc_weight):
+    # (n, 4) probabilities -> (n, 2) [no prob, yes prob] in one matrix product
+    probs = np.asarray(X, dtype=np.float64)
+    if probs.ndim != 2 or probs.shape[1] != 4:
+        raise ValueError(f"SSW expects 4 probability columns, got shape {probs.shape}")
+    return probs @ weight_matrix(ser_weight, loc_weight)
+
+
+def predict_proba_stream(source, ser_weight, loc_weight, chunksize=100000):
+    '''
+    Streaming variant of predict_proba for inputs that do not fit in memory.
+    source: a CSV path in the middle_{institution}.csv layout, or any iterable of (m, 4) chunks.
+    Yields one (m, 2) [no prob, yes prob] array per chunk.
+    '''
+    if isinstance(source, str):
+        import pandas as pd
+        source = (chunk.iloc[:, :4] for chunk in pd.read_csv(source, chunksize=chunksize))
+
+    W = weight_matrix(ser_weight, loc_weight)
+    for chunk in source:
+        yield np.asarray(chunk, dtype=np.float64) @ W
+
+
+def fit(X, y, ser_weight, loc_weight, epoch, convergence_number, engine='numpy'):
+    inputs = SSWInputs(X, y)
+    rates = learning_rates(len(inputs), epoch, convergence_number)
+
+    if engine == 'numpy':
+        return run_sequential(inputs, ser_weight, loc_weight, rates)
+    if engine == 'numba':
+        return run_numba(inputs, ser_weight, loc_weight, rates)
+    if engine == 'batch':
+        return run_batch(inputs, ser_weight, loc_weight, rates)
+    raise ValueError(f"Unknown SSW engine: {engine}")
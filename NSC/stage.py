@@ -0,0 +1,157 @@
+'''
+Binary handoff of the federated stage (train.py) to the meta stage (main.py).
+
+train.py used to write middle_{institution}.csv and init_{institution}.csv, and main.py parsed them back
+as text. The stage artifact keeps the same content as arrays:
+
+    <stage_dir>/stage_<institution>/
+        probs.npy    (n, 4) float32  global yes, global no, local yes, local no (the middle CSV columns)
+        outcome.npy  (n,) int8       Outcome of the test rows
+        index.npy    (n,) int64      row index of the test rows in the source dataset
+        meta.json    global/local AUROC (the init CSV), column names, row count
+
+main.py loads the arrays memory mapped (np.load mmap_mode='r') and trains on row subsets of them (rows()),
+the whole stage is never copied into a DataFrame. The probabilities are the float32 model outputs
+themselves, not their text form, and float32 -> float64 widening in frame() (the legacy CSV layout) is
+exact. meta.json is written last, so an artifact without it is an interrupted write and is not loaded.
+
+When both stages run in one process tree, to_shared_memory/from_shared_memory pass a Stage through a
+multiprocessing.shared_memory block instead. The reader gets views on the block, nothing is copied.
+'''
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+import fileio
+
+COLUMNS = ('global model predict yes prob', 'global model predict no prob',
+           'local model predict yes prob', 'local model predict no prob')
+FORMATS = ('npy', 'csv', 'both')
+
+
+class Stage:
+    def __init__(self, probs, outcome, index, auc_global, auc_local):
+        self.probs = probs
+        self.outcome = outcome
+        self.index = index
+        self.auc_global = float(auc_global)
+        self.auc_local = float(auc_local)
+
+    def __len__(self):
+        return len(self.probs)
+
+    def rows(self, index):
+        # (probs, outcome) of the given rows (positions or a boolean mask), only those rows are copied
+        return np.asarray(self.probs)[index], np.asarray(self.outcome)[index].astype(np.int64)
+
+    def frame(self):
+        # The middle_{institution}.csv layout, indexed by the source rows
+        df = pd.DataFrame(np.asarray(self.probs, dtype=np.float64), columns=list(COLUMNS), index=pd.Index(self.index))
+        df['Outcome'] = np.asarray(self.outcome, dtype=np.int64)
+        return df
+
+    def meta(self):
+        return {'global auroc': self.auc_global, 'local auroc': self.auc_local, 'columns': list(COLUMNS), 'rows': len(self)}
+
+
+def artifact_path(stage_dir, institution):
+    return os.path.join(stage_dir, f'stage_{institution}')
+
+
+def from_predictions(fed_prob, cen_prob, y_test, auc_global, auc_local):
+    # fed_prob/cen_prob: (n, 2) [no prob, yes prob] of the federated and the localized model
+    fed_prob, cen_prob = np.asarray(fed_prob), np.asarray(cen_prob)
+    probs = np.column_stack([fed_prob[:, 1], fed_prob[:, 0], cen_prob[:, 1], cen_prob[:, 0]]).astype(np.float32)
+    index = np.asarray(y_test.index if hasattr(y_test, 'index') else np.arange(len(probs)), dtype=np.int64)
+    return Stage(probs, np.asarray(y_test, dtype=np.int8), index, auc_global, auc_local)
+
+
+def save(stage, stage_dir, institution):
+    path = artifact_path(stage_dir, institution)
+    os.makedirs(path, exist_ok=True)
+    # A rewrite drops meta.json first, a reader never sees new arrays with the old meta
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        os.remove(os.path.join(path, 'meta.json'))
+    for name in ('probs', 'outcome', 'index'):
+        with fileio.atomic_path(os.path.join(path, f'{name}.npy'), suffix='.npy') as tmp_path:
+            np.save(tmp_path, np.ascontiguousarray(getattr(stage, name)))
+    with fileio.atomic_path(os.path.join(path, 'meta.json')) as tmp_path, open(tmp_path, 'w') as f:
+        json.dump(stage.meta(), f, indent=1)
+    return path
+
+
+def remove(stage_dir, institution):
+    # meta.json goes first, like in save: a reader never loads a half removed artifact
+    path = artifact_path(stage_dir, institution)
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        os.remove(os.path.join(path, 'meta.json'))
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def exists(stage_dir, institution):
+    return os.path.exists(os.path.join(artifact_path(stage_dir, institution), 'meta.json'))
+
+
+def load(stage_dir, institution, mmap=True):
+    path = artifact_path(stage_dir, institution)
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    mode = 'r' if mmap else None
+    arrays = [np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mode) for name in ('probs', 'outcome', 'index')]
+    if any(len(a) != meta['rows'] for a in arrays):
+        raise ValueError(f"{path}: array lengths {[len(a) for a in arrays]} do not match meta.json rows={meta['rows']}")
+    return Stage(*arrays, meta['global auroc'], meta['local auroc'])
+
+
+def save_csv(stage, stage_dir, institution):
+    # The legacy middle/init CSV files, for tools that still read them
+    import utils
+    stage.frame().to_csv(utils.stage_path(stage_dir, 'middle', institution), index=False)
+    pd.DataFrame({'global auroc': [stage.auc_global], 'local auroc': [stage.auc_local]}).to_csv(
+        utils.stage_path(stage_dir, 'init', institution), index=False)
+
+
+''''''''''''''''''''''''''''''''''''''''' Shared memory '''''''''''''''''''''''''''''''''''''''''
+
+def _layout(rows, dtypes):
+    # (name, dtype, shape, byte offset) of the arrays inside the block, 8 byte aligned. The dtypes are
+    # the ones of the Stage arrays, a float64 CSV stage is not rounded to float32 on the way through
+    layout, offset = [], 0
+    for name, shape in (('probs', (rows, 4)), ('outcome', (rows,)), ('index', (rows,))):
+        dtype = np.dtype(dtypes[name])
+        layout.append((name, dtype, shape, offset))
+        offset += -(-int(np.prod(shape)) * dtype.itemsize // 8) * 8
+    return layout, max(offset, 1)
+
+
+def to_shared_memory(stage, name=None):
+    '''
+    Copy a Stage into a new shared memory block. Returns (block, descriptor), the descriptor is the
+    small JSON-able dict another process passes to from_shared_memory. The caller keeps the block
+    open while readers use it and unlinks it afterwards.
+    '''
+    from multiprocessing import shared_memory
+    dtypes = {name: np.asarray(getattr(stage, name)).dtype.str for name in ('probs', 'outcome', 'index')}
+    layout, size = _layout(len(stage), dtypes)
+    block = shared_memory.SharedMemory(create=True, size=size, name=name)
+    for array_name, dtype, shape, offset in layout:
+        np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)[...] = getattr(stage, array_name)
+    descriptor = dict(stage.meta(), block=block.name, dtypes=dtypes)
+    return block, descriptor
+
+
+def from_shared_memory(descriptor):
+    '''
+    (block, Stage) with the Stage arrays as views on the block. Keep the block referenced as long as
+    the arrays are used and close() it afterwards.
+    '''
+    from multiprocessing import shared_memory
+    try:
+        # Python 3.13+: a reader must not register the block, the resource tracker would unlink it at exit
+        block = shared_memory.SharedMemory(name=descriptor['block'], track=False)
+    except TypeError:
+        block = shared_memory.SharedMemory(name=descriptor['block'])
+    layout, _ = _layout(descriptor['rows'], descriptor['dtypes'])
+    arrays = [np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset) for _, dtype, shape, offset in layout]
+    return block, Stage(*arrays, descriptor['global auroc'], descriptor['local auroc'])
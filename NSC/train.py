@@ -1,210 +1,214 @@
 import os
-import flwr as fl
 import numpy as np
 import pandas as pd
-import tensorflow as tf
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense, Dropout
-from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.layers import BatchNormalization
-from tensorflow.keras.callbacks import ReduceLROnPlateau
-from tensorflow.keras.utils import to_categorical
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import roc_auc_score, f1_score, average_precision_score, precision_recall_curve, auc
 import utils
-import matplotlib.pyplot as plt
+import server
+import datacache
+import models
+import pipeline
+import metrics
+import results_store
+import stage
 
 
 os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
 
 
-'''''''''''''''''''''''''''''''''' Feature Groups '''''''''''''''''''''''''''''''''''''''
-
-global_feature = ['Laterality', 'Age', 'Gender', 'SepNodule', 'PleuInva', 'Tumorsz', 'LYMND', 'AJCC', 'Radiation', 
-                 'Chemotherapy', 'Surgery']
-
-global_feature_en = ['Age_6', 'Tumorsz_1', 'Tumorsz_4', 'LYMND_3', 'Chemotherapy_1', 'AJCC_1', 'Surgery_2', 
-                     'SepNodule_2', 'Laterality_2', 'PleuInva_1', 'Tumorsz_2', 'AJCC_3', 'Laterality_1', 'Age_4',
-                     'Chemotherapy_2', 'LYMND_9', 'Gender_2', 'Tumorsz_9', 'Age_7', 'Age_9', 'Gender_1', 'AJCC_2',
-                     'Laterality_3', 'Radiation_1', 'Laterality_9', 'LYMND_5', 'Age_3', 'PleuInva_9', 'Radiation_2',
-                     'Tumorsz_3', 'LYMND_1', 'LYMND_4', 'Age_2', 'AJCC_5', 'Age_8', 'AJCC_9', 'AJCC_4', 'PleuInva_2',
-                     'LYMND_2', 'Surgery_1', 'Age_5', 'SepNodule_9', 'SepNodule_1']
-
-taiwan_feature = ['PleuEffu', 'EGFR', 'ALK', 'MAGN', 'DIFF', 'BMI_label', 'CIG', 'BN', 'ALC']
-seer_feature = ['Income', 'Area', 'Race']
-
-''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
-
-def federated_learning(x_train, y_train, x_test, y_test, institution, class_weights, seed):
-
-    x_train = x_train[global_feature]
-    x_test = x_test[global_feature]
-
-    # One hot encoding 
-    columns_exclude = ['Radiation', 'Chemotherapy', 'Surgery']
-
-    x_train = pd.get_dummies(x_train, drop_first=False, columns=[col for col in global_feature if col not in columns_exclude])
-    x_test = pd.get_dummies(x_test, drop_first=False, columns=[col for col in global_feature if col not in columns_exclude])
-
-    for col in global_feature_en: 
-        if col not in x_train.columns:
-            x_train[col] = 0
-        if col not in x_test.columns:
-            x_test[col] = 0
-
-    # Ensure columns order is the same
-    x_train = x_train[global_feature_en]
-    x_test = x_test[global_feature_en]
-
-    # Load and compile Keras model
-    opt_adam = Adam(learning_rate = 0.003)
-    model = Sequential() 
-    model.add(Dense(12, activation = 'relu', input_shape = (x_train.shape[1],))) 
-    model.add(BatchNormalization())
-    model.add(Dense(6, activation = 'relu'))
-    model.add(BatchNormalization())
-    model.add(Dropout(0.2))
-    model.add(Dense(2, activation = 'softmax'))
-    model.compile(optimizer = opt_adam, loss = "categorical_crossentropy", metrics = ['accuracy'])
+# connect(client) joins the federation and returns once all rounds are over,
+# e.g. connect_grpc(6001) or simulation.InProcessServer.connect
+def federated_learning(x_train, y_train, x_test, y_test, institution, class_weights, seed, connect, backend='keras', explain=True):
+    # Load and compile the model ('keras' or the NumPy trainer, see models.py)
+    model = models.build_model('baseline', x_train.shape[1], learning_rate = 0.003, backend = backend)
 
     # Start Flower client
     client_hospital = utils.SpcancerClient(model, x_train, y_train, x_test, y_test, class_weights)
-    fl.client.start_numpy_client("127.0.0.1:6001", client=client_hospital)
+    connect(client_hospital)
 
     # Evaluate Models 
     pred_prob = model.predict(x_test.astype(float))
-    auroc = roc_auc_score(y_test, pred_prob[:, 1])
-
-    precision, recall, _ = precision_recall_curve(y_test, pred_prob[:, 1])
-    auprc = auc(recall, precision)
+    scores = metrics.Scores(y_test, pred_prob[:, 1])
+    auroc, auprc = scores.auroc, scores.auprc
 
     # Passing seed from main is only used in here
-    utils.featureInterpreter('Federated Learning', model, x_train.astype(np.int32), institution, 'baseline', seed)
+    if explain:
+        utils.explain('Federated Learning', model, x_train.astype(np.int32), institution, 'baseline', seed)
 
     return auroc, auprc, pred_prob
 
 
-def localized_learning(x_train, y_train, x_test, y_test, institution, class_weights, seed):
- 
-    col_exclude_tw = ['Radiation', 'Chemotherapy', 'Surgery']
-    col_exclude_seer = ['Radiation', 'Chemotherapy', 'Surgery']
-
-    local_feature = list(global_feature)
-    local_feature += (list(taiwan_feature) if institution == 1 else list(seer_feature))
-
-    columns_exclude = list(col_exclude_tw) if institution == 1 else list(col_exclude_seer)
-
-    x_train = x_train[local_feature]
-    x_test = x_test[local_feature]
+def localized_learning(x_train, y_train, x_test, y_test, institution, class_weights, seed, backend='keras', explain=True):
+    # Load and compile the model ('keras' or the NumPy trainer, see models.py)
+    model = models.build_model('baseline', x_train.shape[1], learning_rate = 0.003, backend = backend)
 
-    # One hot encoding 
-    x_train = pd.get_dummies(x_train, drop_first=False, columns=[col for col in local_feature if col not in columns_exclude])
-    x_test = pd.get_dummies(x_test, drop_first=False, columns=[col for col in local_feature if col not in columns_exclude])
-
-
-    # Load and compile Keras model
-    opt_adam = Adam(learning_rate = 0.003)
-    model = Sequential() 
-    model.add(Dense(12, activation = 'relu', input_shape = (x_train.shape[1],))) 
-    model.add(BatchNormalization())
-    model.add(Dense(6, activation = 'relu'))
-    model.add(BatchNormalization())
-    model.add(Dropout(0.2))
-    model.add(Dense(2, activation = 'softmax'))
-    model.compile(optimizer = opt_adam, loss = "categorical_crossentropy", metrics = ['accuracy'])
-
-    lr_scheduler = ReduceLROnPlateau(monitor='loss', factor=0.5, patience=5, min_lr=0.000005)
-    history = model.fit(x_train.astype(float), y_train, epochs = 300, class_weight = class_weights, callbacks=[lr_scheduler])
+    lr_scheduler = models.reduce_lr_on_plateau(model, monitor='loss', factor=0.5, patience=5, min_lr=0.000005)
+    history = pipeline.fit(model, x_train, y_train, epochs = 300, class_weight = class_weights, callbacks=[lr_scheduler], name='Localized Learning')
 
     # Draw Loss funciton 
     # utils.draw_loss_function(history=history, name="localized learning")
     
     # Evaluate Models 
     pred_prob = model.predict(x_test.astype(float))
-    auroc = roc_auc_score(y_test, pred_prob[:, 1])
-
-    precision, recall, _ = precision_recall_curve(y_test, pred_prob[:, 1])
-    auprc = auc(recall, precision)
+    scores = metrics.Scores(y_test, pred_prob[:, 1])
+    auroc, auprc = scores.auroc, scores.auprc
 
     # Passing seed from main is only used in here
-    utils.featureInterpreter('Localized Learning', model, x_train.astype(np.int32), institution, 'baseline', seed)
+    if explain:
+        utils.explain('Localized Learning', model, x_train.astype(np.int32), institution, 'baseline', seed)
 
     return auroc, auprc, pred_prob
 
 
+def connect_grpc(port, retries=30):
+    def connect(client, fold=0):
+        import time
+        import grpc
+        import flwr as fl
+        # server.py restarts for every fold of --folds, a client that is back first waits for it.
+        # Only before the first round: once the client trained (the codec counted a fit) an error is real
+        for attempt in range(retries):
+            try:
+                fl.client.start_numpy_client(f"127.0.0.1:{port}", client=client)
+                return
+            except grpc.RpcError as error:
+                if error.code() != grpc.StatusCode.UNAVAILABLE or client.codec.history or attempt == retries - 1:
+                    raise
+                time.sleep(1)
+    return connect
+
+
 def main() -> None:  
     '''
     If you use the script to run this program, where you can test multiple seeds per time. You need to comment 
     LINE: institution, seed = int(input("Please choose a hospital: 1 for Taiwan, 2 for US (SEER Database): ")), 42
     Otherwise, you need to comment the following line, where you can only test for one seed.
     LINE: institution, seed = utils.parse_argument_for_running_script()
+
+    With --simulate both hospitals and the server.py strategy run inside this process, without server.py,
+    gRPC or any network access (--hospital is ignored then).
+
+    With --folds (e.g. --folds=5, same value for server.py) the federated and localized probabilities of
+    every patient are produced out of fold, for the K-fold stacking of main.py --folds.
     '''
-    institution, seed = utils.parse_argument_for_running_script()
+    parser = utils.build_argument_parser()
+    parser.add_argument('--simulate', action='store_true', help='Run the server and both hospitals in this process')
+    parser.add_argument('--no-cache', action='store_true', help='Rebuild the encoded split from the CSV, skip Data_folder/cache')
+    parser.add_argument('--stage-format', default='npy', choices=stage.FORMATS, help='Handoff files for main.py: .npy arrays, the middle/init CSVs or both')
+    server.add_arguments(parser)
+    pipeline.add_arguments(parser)
+    args = parser.parse_args()
+    utils.configure_explanations(args.shap_backend, args.explain, args.nn_backend)
+    pipeline.configure(args)
+    institution, seed = args.hospital, args.seed
     # institution, seed = int(input("Please choose a hospital: 1 for Taiwan, 2 for US (SEER Database): ")), 42
 
-    columns = list(global_feature)
+    if not args.simulate:
+        run_institution(institution, seed, args, connect_grpc(args.port))
+        return
+
+    import simulation
+    from concurrent.futures import ThreadPoolExecutor
 
-    if institution == 1:
-        columns.extend(taiwan_feature)
-        df = pd.read_csv('Data_folder/Taiwan_en.csv')
-    else: 
-        columns.extend(seer_feature)
-        df = pd.read_csv('Data_folder/SEER_en.csv')
+    # Every hospital runs in its own thread, like its own process on the gRPC path
+    # One federation per fold with --folds
+    federations = [simulation.InProcessServer(server.build_strategy(args), args.rounds, server.min_client) for _ in range(args.folds)]
+    connect = lambda client, fold=0: federations[fold].connect(client)
 
-    columns.append('Target')
-    df = df[columns]
+    def run(institution):
+        try:
+            run_institution(institution, seed, args, connect)
+        except BaseException as error:
+            # The other hospital may be waiting in a federation this one never joins
+            for federation in federations:
+                federation.abort(error)
+            raise
 
-    trainset, testset = train_test_split(df, test_size=0.4, stratify=df['Target'], random_state=seed)
+    with ThreadPoolExecutor(max_workers=server.min_client) as pool:
+        futures = [pool.submit(run, institution) for institution in (1, 2)]
+        for future in futures:
+            future.result()
 
-    x_train, y_train = trainset.drop(columns=['Target']), trainset['Target']
-    x_test, y_test = testset.drop(columns=['Target']), testset['Target']
-    y_train_one_hot = to_categorical(y_train, num_classes=2)
 
+def run_institution(institution, seed, args, connect):
+    # Encoded train/test split, from Data_folder/cache unless the source CSV changed
+    split = datacache.load_split(institution, seed, test_size=0.4, use_cache=not args.no_cache)
     print(f'------------------------{f"Name of your Institution: {institution}"}------------------------')
-    print(f"x_train (data number, feature number): {x_train.shape}")
-    print(f"x_test (data number, feature number): {x_test.shape}")
+
+    if args.folds > 1:
+        fed_prob, cen_prob, y_test = out_of_fold(split, institution, seed, args, connect)
+        fed_scores, cen_scores = metrics.Scores(y_test, fed_prob[:, 1]), metrics.Scores(y_test, cen_prob[:, 1])
+        auroc_global, auprc_global = fed_scores.auroc, fed_scores.auprc
+        auroc_local, auprc_local = cen_scores.auroc, cen_scores.auprc
+    else:
+        y_test = split.y_test
+        auroc_global, auprc_global, fed_prob, auroc_local, auprc_local, cen_prob = train_baselines(
+            split.x_train_global, split.x_test_global, split.x_train_local, split.x_test_local,
+            split.y_train, split.y_test, institution, seed, args, connect)
+
+    # Handoff to main.py: memory mapped .npy arrays (stage.py), the middle/init CSV files with --stage-format
+    handoff = stage.from_predictions(fed_prob, cen_prob, y_test, auroc_global, auroc_local)
+    print(pd.DataFrame({'global auroc': [handoff.auc_global], 'local auroc': [handoff.auc_local]}))
+    os.makedirs(args.stage_dir, exist_ok=True)
+    if args.stage_format in ('npy', 'both'):
+        stage.save(handoff, args.stage_dir, institution)
+    else:
+        # main.py loads stage_<institution> before the CSVs, the artifact of an earlier run must not shadow them
+        stage.remove(args.stage_dir, institution)
+    if args.stage_format in ('csv', 'both'):
+        stage.save_csv(handoff, args.stage_dir, institution)
+
+    # Saving Baseline Models Results 
+    hospital = 'Taiwan' if institution == 1 else 'USA'
+    baseline = [
+        {'model': 'Federated Learning', 'auroc': auroc_global, 'auprc': auprc_global},
+        {'model': 'Localized Learning', 'auroc': auroc_local, 'auprc': auprc_local}
+    ]
+    results_store.record(baseline, 'baseline', hospital, seed, results_store.run_config(args), source='train.py')
+    print("Results saved to Results/results.db")
+
+
+def train_baselines(x_train_global, x_test_global, x_train_local, x_test_local, y_train, y_test, institution, seed, args, connect, explain=True):
+    y_train_one_hot = utils.one_hot(y_train)
+
+    print(f"x_train (data number, feature number): {x_train_local.shape}")
+    print(f"x_test (data number, feature number): {x_test_local.shape}")
     print(f'The number of true cases in y_train:  {(y_train == 1).sum()}')
     print(f'The number of true cases in y_test:  {(y_test == 1).sum()}')
 
     # class weights
-    beta = (len(x_train)-1)/len(x_train)
+    beta = (len(x_train_local)-1)/len(x_train_local)
     print(f"Beta{beta}")
     class_weights = utils.get_class_balanced_weights(y_train, beta)
     print(f"class weights: {class_weights}")
 
-    auroc_global, auprc_global, fed_prob = federated_learning(x_train, y_train_one_hot, x_test, y_test, institution, class_weights, seed)
-    auroc_local, auprc_local, cen_prob = localized_learning(x_train, y_train_one_hot, x_test, y_test, institution, class_weights, seed)
-
-    auroc = {
-        'global auroc': np.array(auroc_global).astype(float),
-        'local auroc': np.array(auroc_local).astype(float)
-    }
-
-    auroc_csv = pd.DataFrame(auroc, index=[0])
-    print(auroc_csv)
-    auroc_csv.to_csv(f"init_{institution}.csv",index=False)
-
-    result = {
-        'global model predict yes prob': fed_prob[:,1],
-        'global model predict no prob': fed_prob[:,0],
-        'local model predict yes prob': cen_prob[:,1],
-        'local model predict no prob': cen_prob[:,0],
-        'Outcome': y_test
-    }
+    auroc_global, auprc_global, fed_prob = federated_learning(x_train_global, y_train_one_hot, x_test_global, y_test, institution, class_weights, seed, connect, args.nn_backend, explain)
+    auroc_local, auprc_local, cen_prob = localized_learning(x_train_local, y_train_one_hot, x_test_local, y_test, institution, class_weights, seed, args.nn_backend, explain)
+    return auroc_global, auprc_global, fed_prob, auroc_local, auprc_local, cen_prob
 
-    middle = pd.DataFrame(result)
-    middle.to_csv(f"middle_{institution}.csv",index=False)
 
-    # Saving Baseline Models Results 
-    hospital = 'Taiwan' if institution == 1 else 'USA'
-    baseline = {
-        f'Model | {hospital} | seed={seed}': ['Federated Learning', 'Localized Learning'],
-        'auroc': [np.array(auroc_global).astype(float), np.array(auroc_local).astype(float)],
-        'auprc': [np.array(auprc_global).astype(float), np.array(auprc_local).astype(float)]
-    }
-    baseline_results = pd.DataFrame(baseline)
-    baseline_results.to_csv('Results/Results_Baseline.csv', mode='a', index=False)
-    print("Results saved to Results_Baseline.csv")
+def out_of_fold(split, institution, seed, args, connect):
+    '''
+    --folds: federated and localized probabilities of every patient of the hospital, each one from the
+    models of the fold that did not train on it. Every fold is its own federation (server.py runs one
+    per fold), connect(client, fold) joins the one of the fold. Only the first fold is explained.
+    Returns the (n, 2) federated and localized probabilities and the outcome, in source row order.
+    '''
+    from sklearn.model_selection import StratifiedKFold
+
+    # The whole cohort: both parts of the cached split, back in source row order
+    x_global = pd.concat([split.x_train_global, split.x_test_global]).sort_index()
+    x_local = pd.concat([split.x_train_local, split.x_test_local]).sort_index()
+    y = pd.concat([split.y_train, split.y_test]).sort_index()
+
+    fed_prob = np.empty((len(y), 2), dtype=np.float32)
+    cen_prob = np.empty((len(y), 2), dtype=np.float32)
+    splitter = StratifiedKFold(n_splits=args.folds, shuffle=True, random_state=seed)
+    for fold, (train_index, test_index) in enumerate(splitter.split(x_local, y)):
+        print(f'------------------------ fold {fold + 1}/{args.folds} ------------------------')
+        fold_connect = lambda client, fold=fold: connect(client, fold)
+        _, _, fed_prob[test_index], _, _, cen_prob[test_index] = train_baselines(
+            x_global.iloc[train_index], x_global.iloc[test_index], x_local.iloc[train_index], x_local.iloc[test_index],
+            y.iloc[train_index], y.iloc[test_index], institution, seed, args, fold_connect, explain=(fold == 0))
+    return fed_prob, cen_prob, y
 
 
 if __name__ == "__main__":
@@ -1,63 +1,30 @@
-import pandas as pd
+import os
 import argparse
-import flwr as fl
-import seaborn as sns
+import threading
+import numpy as np
+import pandas as pd
 from collections import Counter
-import matplotlib.pyplot as plt
-from sklearn.metrics import roc_auc_score
-from tensorflow.keras.callbacks import ReduceLROnPlateau
-from tensorflow.keras.utils import to_categorical
-import shap
-
-
-class SpcancerClient(fl.client.NumPyClient):
-    def __init__(self, model, x_train, y_train, x_test, y_test, class_weights):
-        self.model = model
-        self.x_train, self.y_train = x_train.astype(float), y_train.astype(float)
-        self.x_test, self.y_test = x_test.astype(float), y_test.astype(float)
-        self.class_weights = class_weights
-
-    def get_parameters(self):
-        return self.model.get_weights()
-
-
-    # config is the information which is sent by the server every round.
-    # The content of the config will change every round
-    def fit(self, parameters, config):
-        self.model.set_weights(parameters)
-
-        print(f"Round: {config['round']}")
-        epochs: int = config["local_epochs"]
-
-        lr_scheduler = ReduceLROnPlateau(monitor='loss', factor=0.5, patience=5, min_lr=0.000005)
-        history = self.model.fit(self.x_train, self.y_train, epochs=epochs, class_weight=self.class_weights, callbacks=[lr_scheduler])
+import explainers
+import shap_store
 
-        # draw_loss_function(history=history, name="federated learning")
+# Heavy packages (flwr, TensorFlow, shap, matplotlib, seaborn) are imported inside the functions that
+# use them, so that SSW and preprocessing runs start without loading them.
+# utils.SpcancerClient (client.py) is resolved on first access, see __getattr__ at the bottom.
 
-        # Return updated model parameters and results
-        results = {
-            "loss": history.history["loss"][0],
-            "accuracy": history.history["accuracy"][0],
-        }
+# SHAP backend of featureInterpreter (explainers.py), and whether the explanations run inside fit ('sync'),
+# are queued for jobs.py ('defer') or are not produced at all ('skip')
+explain_backend = 'kernel'
+explain_mode = 'sync'
+EXPLAIN_MODES = ('sync', 'defer', 'skip')
 
-        return self.model.get_weights(), len(self.x_train), results
+# pyplot keeps one global current figure, and every plot ends with plt.close('all'). The hospital threads
+# of train.py --simulate draw one plot at a time, otherwise they close or draw into each other's figures
+_plot_lock = threading.Lock()
 
 
-    def evaluate(self, parameters, config):
-        self.model.set_weights(parameters)
-
-        pred_prob = self.model.predict(self.x_test)
-
-        loss, accuracy = self.model.evaluate(self.x_test, to_categorical(self.y_test, num_classes=2), steps = config['val_steps'])
-        auc = roc_auc_score(self.y_test, pred_prob[:, 1])
-
-        results = {
-            "accuracy": accuracy,
-            "auc": auc,
-        }
-
-        return loss, len(self.x_test), results
-
+def one_hot(y, num_classes=2):
+    # Same float32 matrix as keras to_categorical, without importing TensorFlow
+    return np.eye(num_classes, dtype=np.float32)[np.asarray(y, dtype=int)]
 
 
 def get_class_balanced_weights(y_train, beta):
@@ -75,6 +42,7 @@ def get_class_balanced_weights(y_train, beta):
 
 
 def draw_loss_function(history, name):
+    import matplotlib.pyplot as plt
     try:
         plt.plot(history.history['loss'])
     except:
@@ -87,35 +55,99 @@ def draw_loss_function(history, name):
     plt.show()
 
 
-def parse_argument_for_running_script():
+def build_argument_parser():
+    # Shared by every entry point, scripts add their own options on top of it
     parser = argparse.ArgumentParser(description="Training Script for a Federated Learning Model")
     parser.add_argument('--seed', type=int, default=42, help='Random seed for reproducibility')
     parser.add_argument('--hospital', type=int, default=1, help='Hospital Data for training')
-    args = parser.parse_args()
+    parser.add_argument('--port', type=int, default=6001, help='Port of the Flower server on 127.0.0.1')
+    parser.add_argument('--stage-dir', default='.', help='Folder of the middle/init files passed from train.py to main.py')
+    parser.add_argument('--shap-backend', default='kernel', choices=explainers.BACKENDS, help='SHAP explainer of featureInterpreter')
+    parser.add_argument('--explain', default='sync', choices=EXPLAIN_MODES, help='SHAP/plots inside fit, queued for jobs.py, or skipped')
+    return parser
+
+
+def stage_path(stage_dir, name, institution):
+    # e.g. stage_path('.', 'middle', 1) -> ./middle_1.csv
+    return os.path.join(stage_dir, f'{name}_{institution}.csv')
+
+
+def parse_argument_for_running_script():
+    args = build_argument_parser().parse_args()
     return args.hospital, args.seed
 
 
+def seed_range(text):
+    # '10-44' -> [10, ..., 44] (inclusive), '10,12,15' -> [10, 12, 15]
+    try:
+        if '-' in text:
+            first, last = text.split('-')
+            return list(range(int(first), int(last) + 1))
+        return [int(seed) for seed in text.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid seed range: {text}, use e.g. 10-44 or 10,11,12")
+
+
+def configure_explanations(backend, mode='sync', nn_backend='keras'):
+    # nn_backend: the models.BACKENDS entry of the explained models, 'numpy' rules out gradient/deep SHAP
+    global explain_backend, explain_mode
+    explainers.check_backend(backend, nn_backend if mode != 'skip' else 'keras')
+    if mode not in EXPLAIN_MODES:
+        raise ValueError(f"Unknown explain mode: {mode}, choose from {EXPLAIN_MODES}")
+    explain_backend, explain_mode = backend, mode
+
+
+# What the training code calls once a model is trained, featureInterpreter or a jobs.py job depending on explain_mode
+def explain(name, model, x_train, institution, method, seed):
+    if explain_mode == 'sync':
+        featureInterpreter(name, model, x_train, institution, method, seed)
+    elif explain_mode == 'defer':
+        import jobs
+        jobs.submit_shap(name, model, x_train, institution, method, seed, explain_backend)
+
+
+def explain_SSW(ser_weight, loc_weight, institution, seed):
+    if explain_mode == 'sync':
+        featureInterpreter_SSW(ser_weight, loc_weight, institution, seed)
+    elif explain_mode == 'defer':
+        import jobs
+        jobs.submit_ssw(ser_weight, loc_weight, institution, seed)
+
+
 def featureInterpreter(name, model, x_train, institution, method, seed):
+    import shap
     hospital = 'Taiwan' if institution == 1 else 'USA'
 
     background_data = shap.sample(x_train, 100)
-    explainer = shap.KernelExplainer(model.predict, background_data)
-    shap_values = explainer.shap_values(x_train.iloc[299:399, :])
+    samples = x_train.iloc[299:399, :]
+    shap_values = explainers.shap_values(model, background_data, samples, explain_backend)
+
+    # Raw values kept in Results/shap/values, the plot can be redrawn from there (shap_store.py)
+    shap_store.save(name, hospital, seed, shap_values, samples, background_data, method, explain_backend)
 
     # shap summary plot 
     # shap.summary_plot(shap_values, x_train.iloc[299:399, :], show=False)
     
     # shap summary beeswarm plot (yes class)
-    shap.summary_plot(shap_values[1], x_train.iloc[299:399, :], show=False)
+    plot_shap_summary(shap_values[1], samples, name, hospital, seed)
+
 
-    plt.subplots_adjust(top=0.85) 
-    plt.title(f'{name} | {hospital} | summary | seed = {seed}')
-    plt.savefig(f'Results/shap/{name}_{hospital}_{seed}.png')
-    plt.close('all')
+def plot_shap_summary(shap_values, samples, name, hospital, seed):
+    import shap
+    import matplotlib.pyplot as plt
+    with _plot_lock:
+        shap.summary_plot(shap_values, samples, show=False)
+
+        plt.subplots_adjust(top=0.85) 
+        plt.title(f'{name} | {hospital} | summary | seed = {seed}')
+        plt.savefig(f'Results/shap/{name}_{hospital}_{seed}.png')
+        plt.close('all')
 
 
 
 def featureInterpreter_SSW(ser_weight, loc_weight, institution, seed):
+    import seaborn as sns
+    import matplotlib.pyplot as plt
     hospital = 'Taiwan' if institution == 1 else 'USA'
 
     feature_result = pd.DataFrame({
@@ -124,10 +156,19 @@ def featureInterpreter_SSW(ser_weight, loc_weight, institution, seed):
         'weight': [ser_weight, ser_weight, loc_weight, loc_weight]
     })
     
-    plt.subplots_adjust(left=0.35)
-    sns.barplot(x='weight', y='feature', data=feature_result)
-    plt.xlabel("Weight")
-
-    plt.title(f'SSW | {hospital} | summary | seed = {seed}')
-    plt.savefig(f'Results/shap/SSW_{hospital}_{seed}.png')
-    plt.close('all')
\ No newline at end of file
+    with _plot_lock:
+        plt.subplots_adjust(left=0.35)
+        sns.barplot(x='weight', y='feature', data=feature_result)
+        plt.xlabel("Weight")
+
+        plt.title(f'SSW | {hospital} | summary | seed = {seed}')
+        plt.savefig(f'Results/shap/SSW_{hospital}_{seed}.png')
+        plt.close('all')
+
+
+def __getattr__(name):
+    # Lazy module attribute: the flwr client class is only built when someone uses it
+    if name == 'SpcancerClient':
+        from client import SpcancerClient
+        return SpcancerClient
+    raise AttributeError(f"module 'utils' has no attribute {name!r}")
@@ -1,11 +1,11 @@
-import pandas as pd
+import profiler
 
-# Load CSV file into DataFrame
-df = pd.read_csv('SEER_en.csv')
+# Distinct values from the cached profile (profiler.py), the dataset is only read when it changed
+profile = profiler.load_or_profile('SEER_en.csv')
 
-# Select the column and then get unique values
-column_name = ["Histologic Type ICD-O-3", 'Target']
+# Histologic Type ICD-O-3 is named PTHLTYPE in SEER_en.csv
+column_name = ['PTHLTYPE', 'Target']
 
 for col in column_name:
-    unique_values = df[col].unique()
+    unique_values = profiler.distinct_values(profile, col)
     print(f"{col}: {unique_values}\n")
@@ -0,0 +1,43 @@
+'''
+Chunked CSV -> CSV runner shared by modify-seer-col-name.py and modify-twn-col-name.py.
+
+With chunksize the raw export is read chunksize rows at a time, every chunk goes through transform and
+is appended to the output, so the memory stays bounded by the chunk size whatever the size of the export.
+With workers > 1 the chunks are transformed in a process pool; at most 2 * workers chunks are in flight
+and the output keeps the input order.
+
+Caveat: pandas infers the dtypes per chunk. An integer column with missing values is written as float
+(1.0) only in the chunks that hold a missing value. Columns that have to be stable are cast in transform.
+'''
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+
+def _transformed(chunks, transform, workers):
+    if workers <= 1:
+        for chunk in chunks:
+            yield transform(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(transform, chunk))
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run(input_path, output_path, transform, chunksize=None, workers=1):
+    if not chunksize:
+        transform(pd.read_csv(input_path)).to_csv(output_path, index=False)
+        return
+
+    rows = 0
+    with open(output_path, 'w', newline='') as f:
+        for i, chunk in enumerate(_transformed(pd.read_csv(input_path, chunksize=chunksize), transform, workers)):
+            chunk.to_csv(f, header=(i == 0), index=False)
+            rows += len(chunk)
+    print(f"{output_path}: {rows} rows written")
@@ -1,20 +1,18 @@
-import pandas as pd
+import os
+import sys
+import profiler
 
-s = set()
-df = pd.read_csv('SEER_en.csv')
+# FeatureEncoder and feature groups of the NSC folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'NSC'))
+from encoder import FeatureEncoder
+from features import global_feature
 
-global_feature = ['Laterality', 'Age', 'Gender', 'SepNodule', 'PleuInva', 'Tumorsz', 'LYMND', 'AJCC', 'Radiation', 
-                    'Chemotherapy', 'Surgery']
+# Vocabulary of the global features over both hospitals, from the cached profiles (profiler.py)
+profiles = [profiler.load_or_profile('SEER_en.csv'), profiler.load_or_profile('Taiwan_en.csv')]
 
-df = df[global_feature]
-encode = pd.get_dummies(df, drop_first=False, columns=global_feature)
-s.update(encode.columns)
-
-df = pd.read_csv('Taiwan_en.csv')
-
-df = df[global_feature]
-new = pd.get_dummies(df, drop_first=False, columns=global_feature)
-s.update(new.columns)
+# Only printed: the federated input layout is the fixed global_feature_en order of encoder.global_encoder()
+encoder = FeatureEncoder.from_vocabulary(profiler.vocabulary(profiles, global_feature))
 
+s = set(encoder.columns)
 print(f"[{s}]")
-print(len(s))
\ No newline at end of file
+print(len(s))
@@ -0,0 +1,77 @@
+'''
+PTHLTYPE (ICD-O-3 histologic type) grouping of the lung cancer cases
+
+squamous cell carcinoma (8051-2, 8070-6, 8078, 8083-4, 8090, 8094, 8120, 8123)
+small cell carcinoma (8002, 8041-5)
+adenocarcinoma (8015, 8050, 8140-1, 8143-5, 8147, 8190, 8201, 8211, 8250-5, 8260, 8290, 8310, 8320, 8323, 8333, 8401, 8440, 8470-1, 8480-1, 8490, 8503, 8507, 8550, 8570-2, 8574, 8576)
+large cell carcinoma (8012-4, 8021, 8034, 8082
+other specified carcinoma (8003-4, 8022, 8030-3, 8035, 8200, 8240-1, 8243-6, 8249, 8430, 8525, 8560, 8562, 8575)
+carcinoma not otherwise specified [NOS] (8010-1, 8020, 8230)
+non-small cell carcinoma (8046) 
+malignant neoplasm NOS (8000-1)
+
+The ranges are kept as one interval table sorted by the first code, a whole column is classified with
+a single np.searchsorted. Codes may be numbers (8140) or strings ('8140', '8140/3').
+'''
+import numpy as np
+import pandas as pd
+
+GROUPS = ['squamous cell carcinoma', 'small cell carcinoma', 'adenocarcinoma', 'large cell carcinoma',
+          'other specified carcinoma', 'carcinoma not otherwise specified [NOS]', 'non-small cell carcinoma',
+          'malignant neoplasm NOS']
+UNKNOWN = 'unknown'
+# Integer code of a group when PTHLTYPE is used as a model feature: position in GROUPS + 1, unknown is 9
+UNKNOWN_CODE = 9
+
+ranges = {
+    'squamous cell carcinoma': [(8051, 8052), (8070, 8076), (8078, 8078), (8083, 8084), (8090, 8090), (8094, 8094), (8120, 8120), (8123, 8123)],
+    'small cell carcinoma': [(8002, 8002), (8041, 8045)],
+    'adenocarcinoma': [(8015, 8015), (8050, 8050), (8140, 8141), (8143, 8145), (8147, 8147), (8190, 8190), (8201, 8201), (8211, 8211),
+                       (8250, 8255), (8260, 8260), (8290, 8290), (8310, 8310), (8320, 8320), (8323, 8323), (8333, 8333), (8401, 8401),
+                       (8440, 8440), (8470, 8471), (8480, 8481), (8490, 8490), (8503, 8503), (8507, 8507), (8550, 8550), (8570, 8572),
+                       (8574, 8574), (8576, 8576)],
+    'large cell carcinoma': [(8012, 8014), (8021, 8021), (8034, 8034), (8082, 8082)],
+    'other specified carcinoma': [(8003, 8004), (8022, 8022), (8030, 8033), (8035, 8035), (8200, 8200), (8240, 8241), (8243, 8246),
+                                  (8249, 8249), (8430, 8430), (8525, 8525), (8560, 8560), (8562, 8562), (8575, 8575)],
+    'carcinoma not otherwise specified [NOS]': [(8010, 8011), (8020, 8020), (8230, 8230)],
+    'non-small cell carcinoma': [(8046, 8046)],
+    'malignant neoplasm NOS': [(8000, 8001)],
+}
+
+# Interval table: first code, last code (inclusive), group index, sorted by first code
+_table = sorted((low, high, GROUPS.index(group)) for group, spans in ranges.items() for low, high in spans)
+LOWS = np.array([row[0] for row in _table])
+HIGHS = np.array([row[1] for row in _table])
+GROUP_INDEX = np.array([row[2] for row in _table])
+
+if np.any(LOWS[1:] <= HIGHS[:-1]):
+    raise ValueError("Overlapping ICD-O-3 ranges in the histology table")
+
+
+def _numeric_codes(pthltype):
+    if pd.api.types.is_numeric_dtype(pthltype):
+        return pd.to_numeric(pthltype).to_numpy(dtype=float)
+    # '8140', '8140/3' or ' 8140 ': the first four digits are the histologic type
+    return pd.to_numeric(pthltype.astype('string').str.extract(r'(\d{4})', expand=False), errors='coerce').to_numpy(dtype=float)
+
+
+def group_index(pthltype):
+    # Index into GROUPS of every code, -1 for the codes outside the table and the missing ones
+    codes = _numeric_codes(pthltype)
+    known = ~np.isnan(codes) & (codes == np.floor(codes))
+    row = np.searchsorted(LOWS, np.where(known, codes, -1), side='right') - 1
+    hit = known & (row >= 0) & (codes <= HIGHS[np.maximum(row, 0)])
+    return np.where(hit, GROUP_INDEX[np.maximum(row, 0)], -1)
+
+
+def group_of(pthltype):
+    # Series of histologic type codes -> categorical Series of group names
+    index = group_index(pthltype)
+    categories = GROUPS + [UNKNOWN]
+    return pd.Series(pd.Categorical.from_codes(np.where(index >= 0, index, len(GROUPS)), categories), index=pthltype.index)
+
+
+def group_code(pthltype):
+    # Series of histologic type codes -> integer group codes 1..8, 9 for unknown
+    index = group_index(pthltype)
+    return pd.Series(np.where(index >= 0, index + 1, UNKNOWN_CODE), index=pthltype.index)
@@ -1,9 +1,171 @@
+import argparse
+import numpy as np
+from functools import partial
 import pandas as pd
+import etl
+import histology
 
-df = pd.read_csv('SEER.csv')
+'''
+Recode a SEER case listing (SEER.csv) to the Taiwan encoding and column names (SEER_en.csv).
+
+    python modify-seer-col-name.py --input=SEER.csv --output=SEER_en.csv [--verify]
+    python modify-seer-col-name.py --chunksize=500000 --workers=4    # streaming, see etl.py
+
+The recoding rules are the tables below, run column at a time with map/np.select/pd.cut. The original
+row by row functions are kept under "Reference recoding"; --verify runs both and checks the outputs are
+identical.
+'''
 
 # Let SEER data have the same encoding as Taiwan data
 
+# column: ({value: code}, code of every other value). None as the default keeps the value missing.
+VALUE_MAPS = {
+    'Sex': ({'Male': 1}, 2),
+    'Visceral and Parietal Pleural Invasion Recode (2010+)': ({
+        'Not documented; No resection of primary; Not assessed or unknown if assessed': 9,
+        'Blank(s)': 9,
+        'PL1 or PL2; Invasion of visceral pleura present, NOS': 2,
+        'Tumor extends to pleura, NOS; not stated if visceral or parietal': 2,
+        'PL3; Tumor invades into or through the parietal pleura OR chest wall': 2,
+        'PL0; No evidence; Tumor does not completely traverse the elastic layer of pleura': 1}, None),
+    # ' None/Unknown' with the leading space is how the SEER export spells it
+    'Radiation recode': ({' None/Unknown': 1, 'Radiation, NOS  method or source not specified': 1,
+                          'Recommended, unknown if administered': 1, 'Refused (1988+)': 1}, 2),
+    'Chemotherapy recode (yes, no/unk)': ({'No/Unknown': 1}, 2),
+    'Derived AJCC Stage Group, 6th ed (2004-2015)': ({'IA': 1, 'IB': 1, 'IIA': 2, 'IIB': 2, 'IIIA': 3, 'IIIB': 3, 'IV': 4}, 9),
+    'Median household income inflation adj to 2021': ({
+        '< $35,000': 0, '$35,000 - $39,999': 0, '$40,000 - $44,999': 1, '$45,000 - $49,999': 2,
+        '$50,000 - $54,999': 3, '$55,000 - $59,999': 4, '$60,000 - $64,999': 5, '$65,000 - $69,999': 6,
+        '$70,000 - $74,999': 7, '$75,000+': 8}, 9),
+    'Rural-Urban Continuum Code': ({
+        'Counties in metropolitan areas ge 1 million pop': 1,
+        'Counties in metropolitan areas of 250,000 to 1 million pop': 2,
+        'Nonmetropolitan counties adjacent to a metropolitan area': 3,
+        'Nonmetropolitan counties not adjacent to a metropolitan area': 4,
+        'Counties in metropolitan areas of lt 250 thousand pop': 5}, 9),
+    'Race recode (White, Black, Other)': ({
+        'White': 0, 'Black': 1, 'Other (American Indian/AK Native, Asian/Pacific Islander)': 2}, 9),
+    'Race and origin recode (NHW, NHB, NHAIAN, NHAPI, Hispanic)': ({
+        'Non-Hispanic White': 0, 'Non-Hispanic Black': 1, 'Hispanic (All Races)': 2,
+        'Non-Hispanic Asian or Pacific Islander': 3, 'Non-Hispanic American Indian/Alaska Native': 4}, 9),
+}
+
+# column: ([(substring, code), ...], default), the first substring found wins
+CONTAINS_MAPS = {
+    'Laterality': ([('Right', 1), ('Left', 2), ('Paired', 3)], 9),
+    # 'Seprate' is the spelling of the SEER export
+    'Separate Tumor Nodules Ipsilateral Lung Recode (2010+)': ([('None', 1), ('Seprate nodules', 2)], 9),
+}
+
+# column: (bin edges, code of every bin), bins are [edge, next edge) on the integer value.
+# The tumor size gaps (49-50, 99-100, 149-150) fall in 9, the same as the original if/elif chain.
+INF = np.inf
+NUMERIC_BINS = {
+    'CS tumor size (2004-2015)': ([-INF, 49, 51, 99, 101, 149, 151, 998, INF], [1, 9, 2, 9, 3, 9, 4, 9]),
+    'Regional nodes positive (1988+)': ([-INF, 0, 1, 3, 7, 16, 96, INF], [9, 1, 2, 3, 4, 5, 9]),
+    'RX Summ--Surg Prim Site (1998+)': ([-INF, 0, 1, INF], [2, 1, 2]),
+}
+
+# (lower, upper, code): an age range 'lower-upper years' or 'lower+ years' gets the code of the first
+# row with lower >= row lower and upper <= row upper, otherwise 9 (80-84 and 85+ included)
+AGE_BINS = [(20, 30, 2), (30, 40, 3), (40, 50, 4), (50, 60, 5), (60, 70, 6), (70, 80, 7), (81, 90, 8)]
+
+
+def value_map(series, mapping, default):
+    codes = series.map(mapping)
+    if default is None:
+        return codes
+    return codes.fillna(default).astype(np.int64)
+
+
+def on_uniques(series, recode_uniques, missing):
+    # The string columns only hold a handful of distinct values: recode those and gather by code
+    codes, uniques = pd.factorize(series)
+    table = np.append(np.asarray(recode_uniques(pd.Series(uniques, dtype=object)), dtype=np.int64), missing)
+    return pd.Series(table[codes], index=series.index)
+
+
+def contains_map(series, patterns, default):
+    def recode_uniques(uniques):
+        conditions = [uniques.str.contains(pattern, regex=False).to_numpy(dtype=bool) for pattern, _ in patterns]
+        return np.select(conditions, [code for _, code in patterns], default)
+    return on_uniques(series, recode_uniques, default)
+
+
+def numeric_bins(series, edges, codes):
+    values = pd.to_numeric(series).astype(np.int64)
+    binned = pd.cut(values, edges, right=False, labels=codes, ordered=False)
+    return binned.astype(np.int64)
+
+
+def age_bins(series):
+    def recode_uniques(uniques):
+        bounds = uniques.str.extract(r'^\s*(\d+)\s*(?:-\s*(\d+)|(\+))')
+        if bounds[0].isna().any():
+            raise ValueError(f"Unexpected age range: {uniques[bounds[0].isna()].iloc[0]!r}")
+        lower = bounds[0].astype(np.int64).to_numpy()
+        upper = bounds[1].astype(float).fillna(INF).to_numpy()
+        conditions = [(lower >= low) & (upper <= high) for low, high, _ in AGE_BINS]
+        return np.select(conditions, [code for _, _, code in AGE_BINS], 9)
+    if series.isna().any():
+        raise ValueError("Missing age range")
+    return on_uniques(series, recode_uniques, 9)
+
+
+def recode(df):
+    df = df.copy()
+    for column, (patterns, default) in CONTAINS_MAPS.items():
+        df[column] = contains_map(df[column], patterns, default)
+    df['Age recode with <1 year olds'] = age_bins(df['Age recode with <1 year olds'])
+    for column, (mapping, default) in VALUE_MAPS.items():
+        df[column] = value_map(df[column], mapping, default)
+    for column, (edges, codes) in NUMERIC_BINS.items():
+        df[column] = numeric_bins(df[column], edges, codes)
+
+    # if 'Sequence number' column is '1st of 2 or more primaries', then Target is 1, else 0
+    df['Target'] = (df['Sequence number'] == '1st of 2 or more primaries').astype(np.int64)
+    return df
+
+
+# Make SEER data have the same column name
+
+column_name_mapping = {
+    # 'old_name': 'new_name'
+    'Laterality':'Laterality',
+    'Histologic Type ICD-O-3':'PTHLTYPE',
+    'Age recode with <1 year olds':'Age',
+    'Sex':'Gender',
+    'Separate Tumor Nodules Ipsilateral Lung Recode (2010+)':'SepNodule',
+    'Visceral and Parietal Pleural Invasion Recode (2010+)':'PleuInva',
+    'CS tumor size (2004-2015)':'Tumorsz',
+    'Regional nodes positive (1988+)':'LYMND',
+    'Radiation recode':'Radiation',
+    'Chemotherapy recode (yes, no/unk)':'Chemotherapy',
+    'RX Summ--Surg Prim Site (1998+)':'Surgery', 
+    'Derived AJCC Stage Group, 6th ed (2004-2015)': 'AJCC',
+    'Median household income inflation adj to 2021':'Income',
+    'Rural-Urban Continuum Code':'Area',
+    'Race recode (White, Black, Other)':'Race', 
+    'Race and origin recode (NHW, NHB, NHAIAN, NHAPI, Hispanic)':'Origin'
+}
+
+
+def transform(df, recoder=recode, pthl_group=False):
+    df = recoder(df)
+    df.rename(columns=column_name_mapping, inplace=True)
+    # Histology group of PTHLTYPE as a feature column (histology.py), 9 for unknown codes
+    if pthl_group:
+        df['PTHLTYPE_group'] = histology.group_code(df['PTHLTYPE'])
+    # PleuInva keeps the values without a code missing, pandas makes it float as soon as one row has
+    # one and a chunk without such a row would be written as int. As the nullable Int64 it is written
+    # as 2 in every chunk and in the whole file, a missing code stays empty
+    df = df.astype({'PleuInva': 'Int64'})
+    # Drop the data before 2010 out
+    return df[df['Year of diagnosis'] >= 2010]
+
+
+''''''''''''''''''''''''''''''''''''''' Reference recoding '''''''''''''''''''''''''''''''''''''''
+
 def encode_age_range(age_range):
     if '-' in age_range:
         lower, upper = age_range.split('-')
@@ -154,85 +316,81 @@ def encode_radiation(element):
         return 2
 
 
+def legacy_recode(df):
+    # The original row by row recoding, kept as the reference of --verify
+    df = df.copy()
+    # if string in 'Laterality' column contains 'Right', then replace it with 1, 
+    # else if contains 'Left', then replace it with 2, 
+    # else if contains 'Paired', then replace it with 3,
+    # else replace it with 9
+    df['Laterality'] = df['Laterality'].apply(lambda x: 1 if 'Right' in x else 2 if 'Left' in x else 3 if 'Paired' in x else 9)
 
-# if string in 'Laterality' column contains 'Right', then replace it with 1, 
-# else if contains 'Left', then replace it with 2, 
-# else if contains 'Paired', then replace it with 3,
-# else replace it with 9
-df['Laterality'] = df['Laterality'].apply(lambda x: 1 if 'Right' in x else 2 if 'Left' in x else 3 if 'Paired' in x else 9)
 
+    df['Age recode with <1 year olds'] = df['Age recode with <1 year olds'].apply(encode_age_range)
 
-df['Age recode with <1 year olds'] = df['Age recode with <1 year olds'].apply(encode_age_range)
+    # if 'Sex' column is Male, then replace it with 1, else 2
+    df['Sex'] = df['Sex'].apply(lambda x: 1 if x == 'Male' else 2)
 
-# if 'Sex' column is Male, then replace it with 1, else 2
-df['Sex'] = df['Sex'].apply(lambda x: 1 if x == 'Male' else 2)
+    # if 'Separate Tumor Nodules Ipsilateral Lung Recode (2010+)' column contains 'None', then replace it with 1, 
+    # else if contains 'Seprate nodules', then replace it with 2, else replace it with 9 
+    df['Separate Tumor Nodules Ipsilateral Lung Recode (2010+)'] = df['Separate Tumor Nodules Ipsilateral Lung Recode (2010+)'].apply(lambda x: 1 if 'None' in x else 2 if 'Seprate nodules' in x else 9)
 
-# if 'Separate Tumor Nodules Ipsilateral Lung Recode (2010+)' column contains 'None', then replace it with 1, 
-# else if contains 'Seprate nodules', then replace it with 2, else replace it with 9 
-df['Separate Tumor Nodules Ipsilateral Lung Recode (2010+)'] = df['Separate Tumor Nodules Ipsilateral Lung Recode (2010+)'].apply(lambda x: 1 if 'None' in x else 2 if 'Seprate nodules' in x else 9)
+    # if 'Visceral and Parietal Pleural Invasion Recode (2010+)' column contains 'None', then replace it with 1,
+    # Too much blanks in this column
+    df['Visceral and Parietal Pleural Invasion Recode (2010+)'] = df['Visceral and Parietal Pleural Invasion Recode (2010+)'].apply(encode_SSF2_range)
 
-# if 'Visceral and Parietal Pleural Invasion Recode (2010+)' column contains 'None', then replace it with 1,
-# Too much blanks in this column
-df['Visceral and Parietal Pleural Invasion Recode (2010+)'] = df['Visceral and Parietal Pleural Invasion Recode (2010+)'].apply(encode_SSF2_range)
+    # if 'Tumor Size Summary (2016+)' column is 'Blank(s)', then replace it with 9
+    # if between 1-49, then replace it with 1
+    # else if between 50-99, then replace it with 2
+    # else if between 100-149, then replace it with 3
+    # else if greater or equal to 150, then replace it with 4
+    df['CS tumor size (2004-2015)'] = df['CS tumor size (2004-2015)'].apply(encode_tumorsz)
 
-# if 'Tumor Size Summary (2016+)' column is 'Blank(s)', then replace it with 9
-# if between 1-49, then replace it with 1
-# else if between 50-99, then replace it with 2
-# else if between 100-149, then replace it with 3
-# else if greater or equal to 150, then replace it with 4
-df['CS tumor size (2004-2015)'] = df['CS tumor size (2004-2015)'].apply(encode_tumorsz)
+    # if 'Regional nodes positive' column is 0, then replace it with 1
+    # else if is 1-2, then replace it with 2
+    # else if is 3-6, then replace it with 3
+    # else if is 7-15, then replace it with 4
+    # else if is greater or equal to 16, then replace it with 5, else replace it with 9
+    df['Regional nodes positive (1988+)'] = df['Regional nodes positive (1988+)'].apply(encode_LYMND)
 
-# if 'Regional nodes positive' column is 0, then replace it with 1
-# else if is 1-2, then replace it with 2
-# else if is 3-6, then replace it with 3
-# else if is 7-15, then replace it with 4
-# else if is greater or equal to 16, then replace it with 5, else replace it with 9
-df['Regional nodes positive (1988+)'] = df['Regional nodes positive (1988+)'].apply(encode_LYMND)
+    # Check if 'None/Unknown' exists in the 'Radiation recode' column
+    df['Radiation recode'] = df['Radiation recode'].apply(encode_radiation)
 
-# Check if 'None/Unknown' exists in the 'Radiation recode' column
-df['Radiation recode'] = df['Radiation recode'].apply(encode_radiation)
+    df['Chemotherapy recode (yes, no/unk)'] = df['Chemotherapy recode (yes, no/unk)'].apply(lambda x: 1 if x == 'No/Unknown' else 2)
 
-df['Chemotherapy recode (yes, no/unk)'] = df['Chemotherapy recode (yes, no/unk)'].apply(lambda x: 1 if x == 'No/Unknown' else 2)
+    df['Derived AJCC Stage Group, 6th ed (2004-2015)'] = df['Derived AJCC Stage Group, 6th ed (2004-2015)'].apply(encode_ajcc_stage)
 
-df['Derived AJCC Stage Group, 6th ed (2004-2015)'] = df['Derived AJCC Stage Group, 6th ed (2004-2015)'].apply(encode_ajcc_stage)
+    df['RX Summ--Surg Prim Site (1998+)'] = df['RX Summ--Surg Prim Site (1998+)'].apply(lambda x: 1 if int(x) == 0 else 2)
 
-df['RX Summ--Surg Prim Site (1998+)'] = df['RX Summ--Surg Prim Site (1998+)'].apply(lambda x: 1 if int(x) == 0 else 2)
+    # if 'Sequence number' column is '1st of 2 or more primaries', then replace it with 1, else 0
+    df['Target'] = 0
+    df.loc[df['Sequence number'] == '1st of 2 or more primaries', 'Target'] = 1
 
-# if 'Sequence number' column is '1st of 2 or more primaries', then replace it with 1, else 0
-df['Target'] = 0
-df.loc[df['Sequence number'] == '1st of 2 or more primaries', 'Target'] = 1
 
+    df['Median household income inflation adj to 2021'] = df['Median household income inflation adj to 2021'].apply(encode_income)
+    df['Rural-Urban Continuum Code'] = df['Rural-Urban Continuum Code'].apply(encode_rural_urban)
+    df['Race recode (White, Black, Other)'] = df['Race recode (White, Black, Other)'].apply(encode_race)
+    df['Race and origin recode (NHW, NHB, NHAIAN, NHAPI, Hispanic)'] = df['Race and origin recode (NHW, NHB, NHAIAN, NHAPI, Hispanic)'].apply(encode_race_origin)
+    return df
 
-df['Median household income inflation adj to 2021'] = df['Median household income inflation adj to 2021'].apply(encode_income)
-df['Rural-Urban Continuum Code'] = df['Rural-Urban Continuum Code'].apply(encode_rural_urban)
-df['Race recode (White, Black, Other)'] = df['Race recode (White, Black, Other)'].apply(encode_race)
-df['Race and origin recode (NHW, NHB, NHAIAN, NHAPI, Hispanic)'] = df['Race and origin recode (NHW, NHB, NHAIAN, NHAPI, Hispanic)'].apply(encode_race_origin)
 
+def verify(df):
+    expected = transform(df, legacy_recode)
+    result = transform(df)
+    pd.testing.assert_frame_equal(result, expected)
+    print(f"Vectorized recoding matches the reference on all {len(df)} rows")
 
-# Make SEER data have the same column name
-
-column_name_mapping = {
-    # 'old_name': 'new_name'
-    'Laterality':'Laterality',
-    'Histologic Type ICD-O-3':'PTHLTYPE',
-    'Age recode with <1 year olds':'Age',
-    'Sex':'Gender',
-    'Separate Tumor Nodules Ipsilateral Lung Recode (2010+)':'SepNodule',
-    'Visceral and Parietal Pleural Invasion Recode (2010+)':'PleuInva',
-    'CS tumor size (2004-2015)':'Tumorsz',
-    'Regional nodes positive (1988+)':'LYMND',
-    'Radiation recode':'Radiation',
-    'Chemotherapy recode (yes, no/unk)':'Chemotherapy',
-    'RX Summ--Surg Prim Site (1998+)':'Surgery', 
-    'Derived AJCC Stage Group, 6th ed (2004-2015)': 'AJCC',
-    'Median household income inflation adj to 2021':'Income',
-    'Rural-Urban Continuum Code':'Area',
-    'Race recode (White, Black, Other)':'Race', 
-    'Race and origin recode (NHW, NHB, NHAIAN, NHAPI, Hispanic)':'Origin'
-}
 
-#Drop the data before 2010 out 
-df.rename(columns=column_name_mapping, inplace=True)
-df = df[df['Year of diagnosis'] >= 2010]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recode SEER.csv to the Taiwan encoding")
+    parser.add_argument('--input', type=str, default='SEER.csv', help='Raw SEER case listing')
+    parser.add_argument('--output', type=str, default='SEER_en.csv', help='Recoded dataset')
+    parser.add_argument('--verify', action='store_true', help='Check the output against the reference recoding')
+    parser.add_argument('--chunksize', type=int, default=0, help='Stream the input this many rows at a time (0: load it whole)')
+    parser.add_argument('--workers', type=int, default=1, help='Processes recoding the chunks in streaming mode')
+    parser.add_argument('--pthl-group', action='store_true', help='Add the PTHLTYPE_group histology column')
+    args = parser.parse_args()
 
-df.to_csv('SEER_en.csv', index=False)
+    if args.verify:
+        verify(pd.read_csv(args.input))
+    etl.run(args.input, args.output, partial(transform, pthl_group=args.pthl_group), args.chunksize, args.workers)
@@ -1,6 +1,13 @@
-import pandas as pd
+import os
+import sys
+import argparse
+from functools import partial
+import etl
+import histology
 
-df = pd.read_csv('Taiwan.csv')
+# Feature groups of the NSC folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'NSC'))
+from features import local_feature
 
 # Make SEER data have the same column name
 
@@ -19,7 +26,28 @@ column_name_mapping = {
     'AJCCstage': 'AJCC'
 }
 
+# Integer codes of the renamed dataset. pandas reads a column with a missing value as float, so the
+# whole file and the streamed chunks that hold one wrote 1.0 while the other chunks wrote 1. As the
+# nullable Int64 they are written as 1 in every mode, a missing code stays empty
+CODED_COLUMNS = local_feature(1) + ['PTHLTYPE', 'Target']
 
-df.rename(columns=column_name_mapping, inplace=True)
 
-df.to_csv('Taiwan_en.csv', index=False)
+def transform(df, pthl_group=False):
+    df = df.rename(columns=column_name_mapping)
+    df = df.astype({column: 'Int64' for column in CODED_COLUMNS if column in df.columns})
+    # Histology group of PTHLTYPE as a feature column (histology.py), 9 for unknown codes
+    if pthl_group:
+        df['PTHLTYPE_group'] = histology.group_code(df['PTHLTYPE'])
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rename the Taiwan columns to the shared names")
+    parser.add_argument('--input', type=str, default='Taiwan.csv', help='Raw Taiwan export')
+    parser.add_argument('--output', type=str, default='Taiwan_en.csv', help='Renamed dataset')
+    parser.add_argument('--chunksize', type=int, default=0, help='Stream the input this many rows at a time (0: load it whole)')
+    parser.add_argument('--workers', type=int, default=1, help='Processes renaming the chunks in streaming mode')
+    parser.add_argument('--pthl-group', action='store_true', help='Add the PTHLTYPE_group histology column')
+    args = parser.parse_args()
+
+    etl.run(args.input, args.output, partial(transform, pthl_group=args.pthl_group), args.chunksize, args.workers)
@@ -0,0 +1,140 @@
+'''
+Single pass profile of a dataset (SEER_en.csv, Taiwan_en.csv, ...).
+
+    python profiler.py SEER_en.csv Taiwan_en.csv [--chunksize=200000] [--force]
+
+One streaming read of the CSV collects, for every column: the missing count, the distinct values with
+their counts and their counts per Target. It also builds the PTHLTYPE group table per Target
+(histology.py). The profile is written next to the dataset as <name>.profile.json, keyed by the SHA-256
+of the file. load_or_profile() returns the cached profile and only rescans when the file changed, so
+count-distinct-elements.py, global-feature-onehot-set.py and PTHL_grouping.py read it instead of the
+whole dataset.
+
+Columns with more than max_distinct distinct values only keep their distinct count.
+'''
+import os
+import sys
+import json
+import argparse
+from collections import Counter, defaultdict
+import pandas as pd
+import histology
+
+# File hash and atomic writes of the NSC folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'NSC'))
+from encoder import file_hash
+from fileio import atomic_path
+
+PROFILE_VERSION = 1
+TARGET = 'Target'
+
+
+def profile_path(path):
+    return os.path.splitext(path)[0] + '.profile.json'
+
+
+def _sort_key(value):
+    # Numbers first, then strings, so mixed columns still sort
+    return (isinstance(value, str), value)
+
+
+def profile(path, chunksize=200000, max_distinct=1000):
+    rows = 0
+    missing = Counter()
+    counts = defaultdict(Counter)          # column -> (value, target) -> count
+    groups = Counter()                     # (PTHLTYPE group, target) -> count
+    targets = set()
+    dtypes = {}
+
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        rows += len(chunk)
+        target = chunk[TARGET] if TARGET in chunk else pd.Series(0, index=chunk.index)
+        targets.update(target.dropna().unique().tolist())
+        for column in chunk.columns:
+            dtypes.setdefault(column, str(chunk[column].dtype))
+            missing[column] += int(chunk[column].isna().sum())
+            if column in counts and counts[column] is None:
+                continue
+            size = chunk.groupby([chunk[column], target]).size()
+            column_counts = counts[column]
+            for (value, label), count in size.items():
+                column_counts[(value, label)] += int(count)
+            if len({value for value, _ in column_counts}) > max_distinct:
+                counts[column] = None
+        if 'PTHLTYPE' in chunk:
+            size = pd.DataFrame({'group': histology.group_of(chunk['PTHLTYPE']), 'target': target}).groupby(['group', 'target']).size()
+            for (group, label), count in size.items():
+                groups[(group, label)] += int(count)
+
+    # Without a Target column every row counts as target 0 and only the totals are kept
+    has_target = TARGET in dtypes
+    targets = sorted(targets)
+    columns = {}
+    for column, dtype in dtypes.items():
+        info = {'dtype': dtype, 'missing': missing[column]}
+        if counts[column] is None:
+            info['distinct'] = f'>{max_distinct}'
+        else:
+            per_value = defaultdict(lambda: [0]*len(targets))
+            for (value, label), count in counts[column].items():
+                per_value[value][targets.index(label)] += count
+            values = sorted(per_value, key=_sort_key)
+            info['distinct'] = len(values)
+            # [value, total count, count per target...] in the order of 'targets'
+            info['values'] = [[value, sum(per_value[value])] + (per_value[value] if has_target else []) for value in values]
+        columns[column] = info
+
+    result = {'version': PROFILE_VERSION, 'source': os.path.basename(path), 'sha256': file_hash(path),
+              'rows': rows, 'targets': targets if has_target else [], 'columns': columns}
+    if groups and has_target:
+        table = defaultdict(lambda: [0]*len(targets))
+        for (group, label), count in groups.items():
+            table[group][targets.index(label)] += count
+        result['pthltype_groups'] = [[group] + table[group] for group in sorted(table)]
+    return result
+
+
+def save(result, path):
+    with atomic_path(path) as tmp_path, open(tmp_path, 'w') as f:
+        json.dump(result, f, indent=1, default=lambda value: value.item())
+
+
+def load_or_profile(path, chunksize=200000, force=False):
+    cache = profile_path(path)
+    if not force and os.path.exists(cache):
+        with open(cache) as f:
+            result = json.load(f)
+        if result.get('version') == PROFILE_VERSION and result.get('sha256') == file_hash(path):
+            return result
+    result = profile(path, chunksize)
+    save(result, cache)
+    return result
+
+
+def distinct_values(result, column):
+    return [row[0] for row in result['columns'][column].get('values', [])]
+
+
+def vocabulary(results, features):
+    # Category vocabulary of features over one or more profiles, sorted like FeatureEncoder.fit
+    return {feature: sorted({value for result in results for value in distinct_values(result, feature)}, key=_sort_key)
+            for feature in features}
+
+
+def group_frame(result):
+    # PTHLTYPE group table as a DataFrame: group, count per target
+    return pd.DataFrame(result.get('pthltype_groups', []), columns=['group'] + [f'{TARGET}={t}' for t in result['targets']])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Profile datasets in a single pass")
+    parser.add_argument('datasets', nargs='+', help='CSV files to profile')
+    parser.add_argument('--chunksize', type=int, default=200000, help='Rows read per chunk')
+    parser.add_argument('--force', action='store_true', help='Rescan even when the cached profile is up to date')
+    args = parser.parse_args()
+
+    for dataset in args.datasets:
+        result = load_or_profile(dataset, args.chunksize, args.force)
+        print(f"{dataset}: {result['rows']} rows, {len(result['columns'])} columns -> {profile_path(dataset)}")
+        for column, info in result['columns'].items():
+            print(f"    {column}: {info['distinct']} distinct, {info['missing']} missing")